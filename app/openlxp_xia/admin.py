@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from .models import MetadataFieldOverwrite, XIAConfiguration, XISConfiguration
+from .models import (MetadataFieldOverwrite, StageMetric, ValidationFinding,
+                     ValueNormalizationRule, XIAConfiguration,
+                     XISConfiguration)
 
 
 def marked_default(MetadataFieldOverwriteAdmin, request, queryset):
@@ -40,7 +42,8 @@ class XISConfigurationAdmin(admin.ModelAdmin):
     list_display = ('xis_metadata_api_endpoint',
                     'xis_supplemental_api_endpoint',)
     fields = ['xis_metadata_api_endpoint',
-              'xis_supplemental_api_endpoint', 'xis_api_key']
+              'xis_supplemental_api_endpoint', 'xis_api_key',
+              ('xis_metadata_compression', 'xis_supplemental_compression')]
 
 
 @admin.register(MetadataFieldOverwrite)
@@ -54,3 +57,34 @@ class MetadataFieldOverwriteAdmin(admin.ModelAdmin):
               'field_value',
               'overwrite']
     actions = [marked_default, unmarked_default]
+
+
+@admin.register(ValueNormalizationRule)
+class ValueNormalizationRuleAdmin(admin.ModelAdmin):
+    list_display = ('target_field_path',
+                    'input_values',
+                    'output_value',)
+    fields = ['target_field_path',
+              'input_values',
+              'output_value']
+
+
+@admin.register(StageMetric)
+class StageMetricAdmin(admin.ModelAdmin):
+    list_display = ('command', 'name', 'kind', 'count', 'total_seconds',
+                    'max_seconds', 'modified',)
+    list_filter = ('command', 'kind',)
+    readonly_fields = ('command', 'name', 'kind', 'count', 'total_seconds',
+                       'max_seconds', 'buckets',)
+
+
+@admin.register(ValidationFinding)
+class ValidationFindingAdmin(admin.ModelAdmin):
+    list_display = ('stage', 'finding_type', 'field_path',
+                    'metadata_key_hash', 'created',)
+    list_filter = ('stage', 'finding_type',)
+    search_fields = ('=field_path', '=metadata_key_hash',)
+    readonly_fields = ('stage', 'finding_type', 'field_path',
+                       'metadata_key_hash', 'created',)
+    # counting millions of findings on every page is too slow
+    show_full_result_count = False
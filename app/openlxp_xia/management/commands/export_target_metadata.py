@@ -0,0 +1,167 @@
+import gzip
+import hashlib
+import logging
+import os
+
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from openlxp_xia.management.commands.load_target_metadata import \
+    rename_metadata_ledger_fields
+from openlxp_xia.management.utils.instrumentation import (
+    InstrumentedCommand, increment, timer)
+from openlxp_xia.management.utils.json_serializer import dumps
+from openlxp_xia.management.utils.profiling import profile_records
+from openlxp_xia.management.utils.xia_internal import get_publisher_detail
+from openlxp_xia.models import MetadataLedger
+
+logger = logging.getLogger('dict_config_logger')
+
+MANIFEST_FILE_NAME = 'manifest.json'
+SHARD_FILE_PREFIX = 'target_metadata'
+
+
+def get_target_metadata_for_export():
+    """Retrieving active and validated target metadata from MetadataLedger
+    that needs to be exported"""
+    logger.info("Retrieving target metadata from MetadataLedger to be "
+                "exported")
+    target_data_dict = MetadataLedger.objects.filter(
+        record_lifecycle_status='Active',
+        target_metadata_validation_status='Y').order_by(
+        'metadata_record_uuid').values(
+        'metadata_record_uuid',
+        'target_metadata',
+        'target_metadata_hash',
+        'target_metadata_key',
+        'target_metadata_key_hash')
+    return target_data_dict
+
+
+def iter_records_by_key(target_data_dict, chunk_size):
+    """Yielding records a page of chunk_size at a time, each page starting
+    after the last metadata_record_uuid of the previous one, so a single
+    page is held in memory even by drivers buffering whole result sets"""
+    pages = target_data_dict.order_by('metadata_record_uuid')
+    page = list(pages[:chunk_size])
+    while page:
+        # rows are renamed for XIS once yielded
+        last_uuid = page[-1]['metadata_record_uuid']
+        yield from page
+        if len(page) < chunk_size:
+            break
+        page = list(pages.filter(
+            metadata_record_uuid__gt=last_uuid)[:chunk_size])
+
+
+def get_file_sha256(file_path, block_size=1024 * 1024):
+    """Computing sha256 hex digest of a file reading it in blocks"""
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def open_shard(output_dir, shard_number, compress):
+    """Opening a new NDJSON shard file for writing"""
+    file_name = '%s-%05d.ndjson' % (SHARD_FILE_PREFIX, shard_number)
+    if compress:
+        file_name += '.gz'
+        shard = gzip.open(os.path.join(output_dir, file_name), 'wb')
+    else:
+        shard = open(os.path.join(output_dir, file_name), 'wb')
+    return file_name, shard
+
+
+def close_shard(output_dir, file_name, shard, record_count):
+    """Closing a shard file and returning its manifest entry"""
+    shard.close()
+    file_path = os.path.join(output_dir, file_name)
+    return {
+        'file': file_name,
+        'records': record_count,
+        'bytes': os.path.getsize(file_path),
+        'sha256': get_file_sha256(file_path)
+    }
+
+
+@timer('export')
+def export_target_metadata(target_data_dict, output_dir, shard_size=0,
+                           compress=False, chunk_size=2000):
+    """Streaming target metadata records as NDJSON shards into output_dir
+    and writing a manifest with per shard counts and hashes.
+
+    Records are rendered in the same format they are POSTed to XIS. A
+    shard_size of zero writes every record to a single shard."""
+    os.makedirs(output_dir, exist_ok=True)
+    provider_name = get_publisher_detail()
+
+    shards = []
+    shard_number = 0
+    shard_records = 0
+    total_records = 0
+    file_name, shard = open_shard(output_dir, shard_number, compress)
+    try:
+        for row in profile_records(
+                iter_records_by_key(target_data_dict, chunk_size)):
+            if shard_size and shard_records == shard_size:
+                shards.append(close_shard(output_dir, file_name, shard,
+                                          shard_records))
+                shard_number += 1
+                shard_records = 0
+                file_name, shard = open_shard(output_dir, shard_number,
+                                              compress)
+            record = rename_metadata_ledger_fields(row, provider_name)
+            shard.write(dumps(record).encode('utf-8'))
+            shard.write(b'\n')
+            shard_records += 1
+            total_records += 1
+    finally:
+        shards.append(close_shard(output_dir, file_name, shard,
+                                  shard_records))
+
+    manifest = {
+        'created': timezone.now(),
+        'provider_name': provider_name,
+        'format': 'ndjson',
+        'compression': 'gzip' if compress else 'none',
+        'shard_size': shard_size,
+        'record_count': total_records,
+        'shards': shards
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE_NAME), 'w') as file:
+        file.write(dumps(manifest))
+
+    logger.info("Exported %s target metadata records in %s shards to %s",
+                total_records, len(shards), output_dir)
+    increment('export.records', total_records)
+    return manifest
+
+
+class Command(InstrumentedCommand):
+    """Django command to export transformed and validated target metadata
+    as NDJSON for bulk loading"""
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('output_dir',
+                            help='Directory the NDJSON shards and manifest '
+                                 'are written to')
+        parser.add_argument('--shard-size', type=int, default=0,
+                            help='Number of records per shard, 0 writes a '
+                                 'single shard')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Gzip compress the shards')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of records fetched from the '
+                                 'database at a time')
+
+    def handle(self, *args, **options):
+        """Target metadata is streamed from MetadataLedger to NDJSON files"""
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        target_data_dict = get_target_metadata_for_export()
+        export_target_metadata(target_data_dict, options['output_dir'],
+                               options['shard_size'], options['gzip'],
+                               options['chunk_size'])
@@ -0,0 +1,243 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+
+from django.core.management.base import CommandError
+
+from openlxp_xia.management.utils.instrumentation import (
+    InstrumentedCommand, increment, timer)
+from openlxp_xia.management.utils.json_serializer import loads
+from openlxp_xia.management.utils.profiling import profile_records
+from openlxp_xia.management.utils.model_help import sanitize_metadata_batch
+from openlxp_xia.management.utils.xia_internal import get_key_digest
+from openlxp_xia.models import MetadataLedger, XIAConfiguration
+
+logger = logging.getLogger('dict_config_logger')
+
+SOURCE_FILE_FORMATS = ('json', 'ndjson', 'csv')
+
+JSON_ARRAY_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def get_source_file_format(file_name):
+    """Inferring the source file format from the file extension"""
+    extension = os.path.splitext(file_name)[1].lower().lstrip('.')
+    if extension == 'jsonl':
+        extension = 'ndjson'
+    if extension not in SOURCE_FILE_FORMATS:
+        raise CommandError('Unable to infer the format of ' + file_name +
+                           ', use --format')
+    return extension
+
+
+def iter_json_array(file, read_size=1024 * 1024,
+                    max_record_size=64 * 1024 * 1024):
+    """Yielding records from a JSON array without loading the whole
+    document; a document that is not an array is read as a whole"""
+    decoder = json.JSONDecoder()
+    buffer = file.read(read_size).lstrip()
+    if not buffer:
+        raise CommandError('Source file is empty')
+    if not buffer.startswith('['):
+        try:
+            document = json.loads(buffer + file.read())
+        except json.JSONDecodeError as err:
+            raise CommandError('Source file is not valid JSON: ' + str(err))
+        yield from document if isinstance(document, list) else [document]
+        return
+
+    index = 1
+    eof = False
+    while True:
+        index = JSON_ARRAY_SEPARATORS.match(buffer, index).end()
+        if index < len(buffer):
+            if buffer[index] == ']':
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, index)
+            except json.JSONDecodeError as err:
+                # record is incomplete or malformed
+                if eof or len(buffer) - index > max_record_size:
+                    raise CommandError('Source file has an invalid record: '
+                                       + str(err))
+            else:
+                # a number at the end of the buffer may continue in the file
+                if end < len(buffer) or eof:
+                    yield record
+                    index = end
+                    continue
+        elif eof:
+            raise CommandError('Source file ends before its JSON array is '
+                               'closed')
+        # the buffer is only copied when more of the file is read
+        chunk = file.read(read_size)
+        eof = not chunk
+        buffer = buffer[index:] + chunk
+        index = 0
+
+
+def iter_ndjson(file):
+    """Yielding records from newline delimited JSON"""
+    for line in file:
+        if line.strip():
+            yield loads(line)
+
+
+def iter_source_records(file, file_format):
+    """Yielding source records from a text file in the given format"""
+    if file_format == 'csv':
+        return csv.DictReader(file)
+    if file_format == 'ndjson':
+        return iter_ndjson(file)
+    return iter_json_array(file)
+
+
+def get_source_metadata_key_value(record, key_fields):
+    """Creating key value for source metadata from the key fields, None when
+    a key field is missing"""
+    field_values = []
+    for key_field in key_fields:
+        value = record.get(key_field)
+        if value in (None, ''):
+            return None
+        field_values.append(str(value))
+    return '_'.join(field_values)
+
+
+def get_existing_hashes(key_hashes):
+    """Retrieving (key hash, metadata hash) pairs of active records already
+    in MetadataLedger"""
+    return set(MetadataLedger.objects.filter(
+        source_metadata_key_hash__in=key_hashes,
+        record_lifecycle_status='Active').values_list(
+        'source_metadata_key_hash', 'source_metadata_hash'))
+
+
+def store_source_metadata_batch(batch, stats):
+    """Sanitizing new and changed records of a batch and storing them in
+    MetadataLedger"""
+    existing_hashes = get_existing_hashes(
+        {record['key_hash'] for record in batch})
+
+    changed_records = []
+    for record in batch:
+        record_hashes = (record['key_hash'], record['hash'])
+        if record_hashes in existing_hashes:
+            stats['unchanged'] += 1
+            continue
+        # duplicates in the same source are only stored once
+        existing_hashes.add(record_hashes)
+        changed_records.append(record)
+
+    with timer('ingest.sanitize'):
+        sanitized_records = sanitize_metadata_batch(
+            [record['metadata'] for record in changed_records])
+
+    new_records = []
+    for record, (metadata, findings) in zip(changed_records,
+                                            sanitized_records):
+        # like MetadataLedger.clean, homoglyph findings are logged and the
+        # sanitized record is stored
+        if findings:
+            logger.warning("Record %s contains dangerous homoglyphs in %s",
+                           record['key'], ', '.join(finding.field_path
+                                                    for finding in findings))
+            stats['homoglyphs'] += 1
+
+        new_records.append(MetadataLedger(
+            record_lifecycle_status='Active',
+            source_metadata=metadata,
+            source_metadata_hash=record['hash'],
+            source_metadata_key=record['key'],
+            source_metadata_key_hash=record['key_hash'],
+            source_metadata_key_digest=get_key_digest(record['key']),
+            source_metadata_validation_status=''))
+
+    with timer('ingest.db_write'):
+        MetadataLedger.objects.bulk_create(new_records)
+    stats['created'] += len(new_records)
+
+
+@timer('ingest')
+def ingest_source_metadata(records, key_fields, batch_size=1000):
+    """Hashing source records and storing new and changed ones in
+    MetadataLedger in batches"""
+    stats = {'read': 0, 'created': 0, 'unchanged': 0, 'homoglyphs': 0,
+             'missing_key': 0}
+    batch = []
+    for metadata in profile_records(records):
+        stats['read'] += 1
+        key_value = get_source_metadata_key_value(metadata, key_fields)
+        if key_value is None:
+            logger.warning("Record %s is missing a key field and was not "
+                           "ingested", stats['read'])
+            stats['missing_key'] += 1
+            continue
+
+        batch.append({
+            'metadata': metadata,
+            'key': key_value,
+            'key_hash': hashlib.sha512(
+                key_value.encode('utf-8')).hexdigest(),
+            'hash': hashlib.sha512(
+                str(metadata).encode('utf-8')).hexdigest()})
+        if len(batch) == batch_size:
+            store_source_metadata_batch(batch, stats)
+            batch = []
+
+    if batch:
+        store_source_metadata_batch(batch, stats)
+
+    logger.info("Ingested source metadata: %(read)s read, %(created)s "
+                "created, %(unchanged)s unchanged, %(homoglyphs)s with "
+                "homoglyphs, %(missing_key)s missing key fields", stats)
+    increment('ingest.records', stats['read'])
+    for name in ('created', 'unchanged', 'homoglyphs', 'missing_key'):
+        increment('ingest.' + name, stats[name])
+    return stats
+
+
+class Command(InstrumentedCommand):
+    """Django command to ingest extracted source metadata into the
+    MetadataLedger"""
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('source_file', nargs='?',
+                            help='JSON, NDJSON or CSV file with the source '
+                                 'metadata, defaults to the source file of '
+                                 'the XIA configuration')
+        parser.add_argument('--format', choices=SOURCE_FILE_FORMATS,
+                            help='Format of the source file, inferred from '
+                                 'the file extension by default')
+        parser.add_argument('--key-fields', nargs='+', required=True,
+                            help='Source fields joined to create the '
+                                 'source metadata key')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of records stored at a time')
+
+    def handle(self, *args, **options):
+        """Source metadata is read from a file and stored in
+        MetadataLedger"""
+        if options['source_file']:
+            file_name = options['source_file']
+            binary_file = open(file_name, 'rb')
+        else:
+            source_file = XIAConfiguration.objects.first().source_file
+            if not source_file:
+                raise CommandError('No source file given or configured')
+            file_name = source_file.name
+            binary_file = source_file.open('rb')
+
+        with binary_file:
+            file_format = options['format'] or get_source_file_format(
+                file_name)
+            with io.TextIOWrapper(binary_file, encoding='utf-8',
+                                  newline='') as file:
+                ingest_source_metadata(
+                    iter_source_records(file, file_format),
+                    options['key_fields'], options['batch_size'])
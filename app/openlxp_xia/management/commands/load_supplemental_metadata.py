@@ -1,12 +1,16 @@
-import json
 import logging
 
 import requests
-from django.core.management.base import BaseCommand
-from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models import Q
 from django.utils import timezone
 
+from openlxp_xia.management.utils.instrumentation import (
+    InstrumentedCommand, increment, timer)
+from openlxp_xia.management.utils.json_serializer import dumps
+from openlxp_xia.management.utils.leases import (get_pending_expires,
+                                                 recover_pending_records)
+from openlxp_xia.management.utils.profiling import profile_records
+from openlxp_xia.management.utils.transactions import record_writes
 from openlxp_xia.management.utils.xia_internal import get_publisher_detail
 from openlxp_xia.management.utils.xis_client import \
     posting_supplemental_metadata_to_xis
@@ -27,60 +31,83 @@ def rename_supplemental_metadata_fields(data):
     return data
 
 
-def post_supplemental_metadata_to_xis(data):
-    """POSTing XIA metadata_ledger to XIS metadata_ledger"""
-    # Traversing through each row one by one from data
-    # get_xis_supplemental_metadata_api_endpoint
-    for row in data:
-        data = rename_supplemental_metadata_fields(row)
-        renamed_data = json.dumps(data, cls=DjangoJSONEncoder)
+def post_supplemental_record_to_xis(row):
+    """POSTing a row of XIA supplemental_ledger to XIS metadata_ledger"""
+    data = rename_supplemental_metadata_fields(row)
+    renamed_data = dumps(data)
 
-        # Getting UUID to update target_metadata_transmission_status to pending
-        uuid_val = data.get('unique_record_identifier')
+    # Getting UUID to update target_metadata_transmission_status to pending
+    uuid_val = data.get('unique_record_identifier')
 
-        # Updating status in XIA metadata_ledger to 'Pending'
+    # Updating status in XIA metadata_ledger to 'Pending'
+    with timer('load_supplemental.db_write'):
         SupplementalLedger.objects.filter(
             metadata_record_uuid=uuid_val).update(
-            supplemental_metadata_transmission_status='Pending')
+            supplemental_metadata_transmission_status='Pending',
+            supplemental_metadata_pending_expires=get_pending_expires())
 
-        # POSTing data to XIS
-        try:
+    # POSTing data to XIS
+    try:
+        with timer('load_supplemental.http_post'):
             xis_response = posting_supplemental_metadata_to_xis(
                 renamed_data)
+        increment('load_supplemental.records')
 
-            # Receiving XIS response after validation and updating
-            # metadata_ledger
-            if xis_response.status_code == 201:
+        # Receiving XIS response after validation and updating
+        # metadata_ledger
+        if xis_response.status_code == 201:
+            with timer('load_supplemental.db_write'):
                 SupplementalLedger.objects.filter(
                     metadata_record_uuid=uuid_val).update(
-                    supplemental_metadata_transmission_status_code=xis_response
-                    .status_code,
+                    supplemental_metadata_transmission_status_code=(
+                        xis_response.status_code),
                     supplemental_metadata_transmission_status='Successful',
+                    supplemental_metadata_pending_expires=None,
                     supplemental_metadata_transmission_date=timezone.now())
-            else:
+        else:
+            with timer('load_supplemental.db_write'):
                 SupplementalLedger.objects.filter(
                     metadata_record_uuid=uuid_val).update(
-                    supplemental_metadata_transmission_status_code=xis_response
-                    .status_code,
+                    supplemental_metadata_transmission_status_code=(
+                        xis_response.status_code),
                     supplemental_metadata_transmission_status='Failed',
+                    supplemental_metadata_pending_expires=None,
                     supplemental_metadata_transmission_date=timezone.now())
-                logger.warning(
-                    "Bad request sent " + str(xis_response.status_code)
-                    + "error found " + xis_response.text)
-        except requests.exceptions.RequestException as e:
-            logger.error(e)
-            # Updating status in XIA metadata_ledger to 'Failed'
+            increment('load_supplemental.failed')
+            logger.warning("Bad request sent %s error found %s",
+                           xis_response.status_code, xis_response.text)
+    except requests.exceptions.RequestException as e:
+        logger.error(e)
+        # Updating status in XIA metadata_ledger to 'Failed'
+        with timer('load_supplemental.db_write'):
             SupplementalLedger.objects.filter(
                 metadata_record_uuid=uuid_val).update(
-                supplemental_metadata_transmission_status='Failed')
-            raise SystemExit('Exiting! Can not make connection with XIS.')
+                supplemental_metadata_transmission_status='Failed',
+                supplemental_metadata_pending_expires=None)
+        raise SystemExit('Exiting! Can not make connection with XIS.')
+
+
+@timer('load_supplemental')
+def post_supplemental_records_to_xis(data):
+    """POSTing rows of XIA supplemental_ledger to XIS metadata_ledger once"""
+    # Traversing through each row one by one from data
+    # get_xis_supplemental_metadata_api_endpoint
+    for row in profile_records(data):
+        with record_writes('load_supplemental',
+                           row.get('metadata_record_uuid')):
+            post_supplemental_record_to_xis(row)
+
 
+def post_supplemental_metadata_to_xis(data):
+    """POSTing XIA metadata_ledger to XIS metadata_ledger until no records
+    are left to load"""
+    post_supplemental_records_to_xis(data)
     load_supplemental_metadata_to_xis()
 
 
-def load_supplemental_metadata_to_xis():
-    """Retrieve number of Metadata_Ledger records in XIA to load into XIS  and
-    calls the post_data_to_xis accordingly"""
+def get_supplemental_metadata_for_loading():
+    """Retrieving supplemental metadata from SupplementalLedger that needs
+    to be loaded into XIS"""
     combined_query = SupplementalLedger.objects.filter(
         Q(supplemental_metadata_transmission_status='Ready') | Q(
             supplemental_metadata_transmission_status='Failed'))
@@ -93,20 +120,36 @@ def load_supplemental_metadata_to_xis():
         'supplemental_metadata_hash',
         'supplemental_metadata_key',
         'supplemental_metadata_key_hash')
+    return data
+
+
+def load_supplemental_metadata_to_xis():
+    """Retrieve number of Metadata_Ledger records in XIA to load into XIS  and
+    calls the post_data_to_xis accordingly"""
+    data = get_supplemental_metadata_for_loading()
 
     # Checking available no. of records in XIA to load into XIS is Zero or not
-    if len(data) == 0:
+    with timer('load_supplemental.query'):
+        len_data = len(data)
+    if len_data == 0:
         logger.info("Supplemental Metadata Loading in XIS is complete, "
                     "Zero records are available in XIA to transmit")
     else:
         post_supplemental_metadata_to_xis(data)
 
 
-class Command(BaseCommand):
+def recover_pending_supplemental_metadata():
+    """Making the supplemental metadata left Pending by an interrupted
+    load ready to be loaded again"""
+    return recover_pending_records(SupplementalLedger, 'supplemental_metadata')
+
+
+class Command(InstrumentedCommand):
     """Django command to load supplemental metadata in the Experience Index
     Service (XIS)"""
 
     def handle(self, *args, **options):
         """Metadata is load from XIA Supplemental_Ledger to XIS
         Metadata_Ledger"""
+        recover_pending_supplemental_metadata()
         load_supplemental_metadata_to_xis()
@@ -1,12 +1,16 @@
-import json
 import logging
 
 import requests
-from django.core.management.base import BaseCommand
-from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models import Q
 from django.utils import timezone
 
+from openlxp_xia.management.utils.instrumentation import (
+    InstrumentedCommand, increment, timer)
+from openlxp_xia.management.utils.json_serializer import dumps
+from openlxp_xia.management.utils.leases import (get_pending_expires,
+                                                 recover_pending_records)
+from openlxp_xia.management.utils.profiling import profile_records
+from openlxp_xia.management.utils.transactions import record_writes
 from openlxp_xia.management.utils.xia_internal import get_publisher_detail
 from openlxp_xia.management.utils.xis_client import \
     posting_metadata_ledger_to_xis
@@ -15,7 +19,7 @@ from openlxp_xia.models import MetadataLedger
 logger = logging.getLogger('dict_config_logger')
 
 
-def rename_metadata_ledger_fields(data):
+def rename_metadata_ledger_fields(data, provider_name=None):
     """Renaming XIA column names to match with XIS column names"""
     data['unique_record_identifier'] = data.pop('metadata_record_uuid')
     data['metadata'] = data.pop('target_metadata')
@@ -23,62 +27,86 @@ def rename_metadata_ledger_fields(data):
     data['metadata_key'] = data.pop('target_metadata_key')
     data['metadata_key_hash'] = data.pop('target_metadata_key_hash')
     # Adding Publisher in the list to POST to XIS
-    data['provider_name'] = get_publisher_detail()
+    if provider_name is None:
+        provider_name = get_publisher_detail()
+    data['provider_name'] = provider_name
     return data
 
 
-def post_data_to_xis(data):
-    """POSTing XIA metadata_ledger to XIS metadata_ledger"""
-    # Traversing through each row one by one from data
-    for row in data:
-        data = rename_metadata_ledger_fields(row)
-        renamed_data = json.dumps(data, cls=DjangoJSONEncoder)
+def post_record_to_xis(row, provider_name=None):
+    """POSTing a row of XIA metadata_ledger to XIS metadata_ledger"""
+    data = rename_metadata_ledger_fields(row, provider_name)
+    renamed_data = dumps(data)
 
-        # Getting UUID to update target_metadata_transmission_status to pending
-        uuid_val = data.get('unique_record_identifier')
+    # Getting UUID to update target_metadata_transmission_status to pending
+    uuid_val = data.get('unique_record_identifier')
 
-        # Updating status in XIA metadata_ledger to 'Pending'
+    # Updating status in XIA metadata_ledger to 'Pending'
+    with timer('load_target.db_write'):
         MetadataLedger.objects.filter(
             metadata_record_uuid=uuid_val).update(
-            target_metadata_transmission_status='Pending')
+            target_metadata_transmission_status='Pending',
+            target_metadata_pending_expires=get_pending_expires())
 
-        # POSTing data to XIS
-        try:
+    # POSTing data to XIS
+    try:
+        with timer('load_target.http_post'):
             xis_response = posting_metadata_ledger_to_xis(renamed_data)
+        increment('load_target.records')
 
-            # Receiving XIS response after validation and updating
-            # metadata_ledger
-            if xis_response.status_code == 201:
+        # Receiving XIS response after validation and updating
+        # metadata_ledger
+        if xis_response.status_code == 201:
+            with timer('load_target.db_write'):
                 MetadataLedger.objects.filter(
                     metadata_record_uuid=uuid_val).update(
                     target_metadata_transmission_status_code=xis_response.
                         status_code,
                     target_metadata_transmission_status='Successful',
+                    target_metadata_pending_expires=None,
                     target_metadata_transmission_date=timezone.now())
-            else:
+        else:
+            with timer('load_target.db_write'):
                 MetadataLedger.objects.filter(
                     metadata_record_uuid=uuid_val).update(
                     target_metadata_transmission_status_code=xis_response.
                         status_code,
                     target_metadata_transmission_status='Failed',
+                    target_metadata_pending_expires=None,
                     target_metadata_transmission_date=timezone.now())
-                logger.warning(
-                    "Bad request sent " + str(xis_response.status_code)
-                    + "error found " + xis_response.text)
-        except requests.exceptions.RequestException as e:
-            logger.error(e)
-            # Updating status in XIA metadata_ledger to 'Failed'
+            increment('load_target.failed')
+            logger.warning("Bad request sent %s error found %s",
+                           xis_response.status_code, xis_response.text)
+    except requests.exceptions.RequestException as e:
+        logger.error(e)
+        # Updating status in XIA metadata_ledger to 'Failed'
+        with timer('load_target.db_write'):
             MetadataLedger.objects.filter(
                 metadata_record_uuid=uuid_val).update(
-                target_metadata_transmission_status='Failed')
-            raise SystemExit('Exiting! Can not make connection with XIS.')
+                target_metadata_transmission_status='Failed',
+                target_metadata_pending_expires=None)
+        raise SystemExit('Exiting! Can not make connection with XIS.')
+
+
+@timer('load_target')
+def post_records_to_xis(data, provider_name=None):
+    """POSTing rows of XIA metadata_ledger to XIS metadata_ledger once"""
+    # Traversing through each row one by one from data
+    for row in profile_records(data):
+        with record_writes('load_target', row.get('metadata_record_uuid')):
+            post_record_to_xis(row, provider_name)
 
+
+def post_data_to_xis(data):
+    """POSTing XIA metadata_ledger to XIS metadata_ledger until no records
+    are left to load"""
+    post_records_to_xis(data)
     get_records_to_load_into_xis()
 
 
-def get_records_to_load_into_xis():
-    """Retrieve number of Metadata_Ledger records in XIA to load into XIS  and
-    calls the post_data_to_xis accordingly"""
+def get_target_metadata_for_loading():
+    """Retrieving target metadata from MetadataLedger that needs to be
+    loaded into XIS"""
     combined_query = MetadataLedger.objects.filter(
         Q(target_metadata_transmission_status='Ready') | Q(
             target_metadata_transmission_status='Failed'))
@@ -91,18 +119,34 @@ def get_records_to_load_into_xis():
         'target_metadata_hash',
         'target_metadata_key',
         'target_metadata_key_hash')
+    return data
+
+
+def get_records_to_load_into_xis():
+    """Retrieve number of Metadata_Ledger records in XIA to load into XIS  and
+    calls the post_data_to_xis accordingly"""
+    data = get_target_metadata_for_loading()
 
     # Checking available no. of records in XIA to load into XIS is Zero or not
-    if len(data) == 0:
+    with timer('load_target.query'):
+        len_data = len(data)
+    if len_data == 0:
         logger.info("Data Loading in XIS is complete, Zero records are "
                     "available in XIA to transmit")
     else:
         post_data_to_xis(data)
 
 
-class Command(BaseCommand):
+def recover_pending_target_metadata():
+    """Making the target metadata left Pending by an interrupted load ready
+    to be loaded again"""
+    return recover_pending_records(MetadataLedger, 'target_metadata')
+
+
+class Command(InstrumentedCommand):
     """Django command to load metadata in the Experience Index Service (XIS)"""
 
     def handle(self, *args, **options):
         """Metadata is load from XIA Metadata_Ledger to XIS Metadata_Ledger"""
+        recover_pending_target_metadata()
         get_records_to_load_into_xis()
@@ -0,0 +1,69 @@
+import datetime
+import logging
+
+from django.db.models import Count
+from django.utils import timezone
+
+from openlxp_xia.management.utils.instrumentation import InstrumentedCommand
+from openlxp_xia.models import ValidationFinding
+
+logger = logging.getLogger('dict_config_logger')
+
+
+def get_finding_counts(stage=None, finding_type=None, since=None, top=20):
+    """Returns the (stage, finding_type, field_path, count) of the fields
+    failing validation most often"""
+    findings = ValidationFinding.objects.all()
+    if stage:
+        findings = findings.filter(stage=stage)
+    if finding_type:
+        findings = findings.filter(finding_type=finding_type)
+    if since:
+        findings = findings.filter(created__gte=since)
+    return list(findings.values_list('stage', 'finding_type', 'field_path')
+                .annotate(count=Count('id')).order_by('-count')[:top])
+
+
+def purge_findings(days):
+    """Deletes the findings older than a number of days"""
+    deleted, _ = ValidationFinding.objects.filter(
+        created__lt=timezone.now() - datetime.timedelta(days=days)).delete()
+    logger.info("%s validation findings older than %s days deleted",
+                deleted, days)
+    return deleted
+
+
+class Command(InstrumentedCommand):
+    """Django command to report the fields failing validation most
+    often"""
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--stage',
+                            choices=[choice for choice, _ in
+                                     ValidationFinding.STAGE_CHOICES])
+        parser.add_argument('--type', dest='finding_type',
+                            choices=[choice for choice, _ in
+                                     ValidationFinding.FINDING_TYPE_CHOICES])
+        parser.add_argument('--days', type=int,
+                            help='Only count the findings of the last days')
+        parser.add_argument('--top', type=int, default=20,
+                            help='Number of fields reported')
+        parser.add_argument('--purge-days', type=int,
+                            help='Delete the findings older than this '
+                                 'number of days first')
+
+    def handle(self, *args, **options):
+        """Findings are aggregated per stage, type and field"""
+        if options['purge_days'] is not None:
+            purge_findings(options['purge_days'])
+        since = timezone.now() - datetime.timedelta(days=options['days']) \
+            if options['days'] else None
+        counts = get_finding_counts(options['stage'],
+                                    options['finding_type'], since,
+                                    options['top'])
+        self.stdout.write('%-16s %-12s %10s  %s' % ('stage', 'type', 'count',
+                                                    'field'))
+        for stage, finding_type, field_path, count in counts:
+            self.stdout.write('%-16s %-12s %10s  %s' % (stage, finding_type,
+                                                        count, field_path))
@@ -0,0 +1,264 @@
+import logging
+import queue
+import threading
+
+from django.db import connection
+
+from openlxp_xia.management.commands.load_supplemental_metadata import (
+    get_supplemental_metadata_for_loading, post_supplemental_records_to_xis,
+    recover_pending_supplemental_metadata)
+from openlxp_xia.management.commands.load_target_metadata import (
+    get_target_metadata_for_loading, post_records_to_xis,
+    recover_pending_target_metadata)
+from openlxp_xia.management.commands.transform_source_metadata import (
+    get_overwrite_plan, get_source_metadata_for_transformation,
+    get_type_coercion_plan, transform_source_using_key)
+from openlxp_xia.management.commands.validate_source_metadata import (
+    get_source_metadata_for_validation, validate_source_using_key)
+from openlxp_xia.management.commands.validate_target_metadata import (
+    get_target_metadata_for_validation, validate_target_using_key)
+from openlxp_xia.management.utils.instrumentation import (
+    InstrumentedCommand, timer)
+from openlxp_xia.management.utils.leases import (claim_records,
+                                                 release_leases,
+                                                 renew_leases)
+from openlxp_xia.management.utils.profiling import profile_thread
+from openlxp_xia.management.utils.transactions import exit_on_sigterm
+from openlxp_xia.management.utils.xia_internal import (
+    get_normalization_plan, get_publisher_detail, get_target_key_fields)
+from openlxp_xia.management.utils.xss_client import (
+    get_data_types_for_validation, get_required_fields_for_validation,
+    get_source_validation_schema, get_target_metadata_for_transformation,
+    get_target_validation_schema)
+from openlxp_xia.models import MetadataLedger, SupplementalLedger
+
+logger = logging.getLogger('dict_config_logger')
+
+
+@timer('pipeline.fetch_schema')
+def get_pipeline_context():
+    """Retrieving schemas, mappings and configuration used by every stage
+    of the pipeline once"""
+    logger.info("Loading schemas and mappings for the pipeline")
+    source_schema = get_source_validation_schema()
+    target_schema = get_target_validation_schema()
+    source_required, source_recommended = \
+        get_required_fields_for_validation(source_schema)
+    target_required, target_recommended = \
+        get_required_fields_for_validation(target_schema)
+    target_data_types = get_data_types_for_validation(target_schema)
+    return {
+        'source_required': source_required,
+        'source_recommended': source_recommended,
+        'target_required': target_required,
+        'target_recommended': target_recommended,
+        'target_data_types': target_data_types,
+        'target_mapping': get_target_metadata_for_transformation(),
+        'overwrite_plan': get_overwrite_plan(),
+        'coercion_plan': get_type_coercion_plan(target_data_types),
+        'normalization_plan': get_normalization_plan(),
+        'target_key_fields': get_target_key_fields(),
+        'provider_name': get_publisher_detail()
+    }
+
+
+def get_pipeline_record_chunks(chunk_size, max_records=None):
+    """Claiming the active records not yet loaded into XIS, or whose load
+    failed other than on a bad request, which no other worker is
+    processing, a chunk of primary keys at a time as the chunks are run"""
+    with timer('pipeline.query'):
+        recover_pending_target_metadata()
+        recover_pending_supplemental_metadata()
+    claimable = MetadataLedger.objects.filter(
+        record_lifecycle_status='Active',
+        target_metadata_transmission_status__in=['Ready', 'Failed']).exclude(
+        target_metadata_transmission_status_code=400)
+    claimed = 0
+    while max_records is None or claimed < max_records:
+        limit = chunk_size
+        if max_records is not None:
+            limit = min(chunk_size, max_records - claimed)
+        # records of the chunks already run stay leased until the end of
+        # the run so failed loads are not retried by the same run
+        with timer('pipeline.query'):
+            record_ids = claim_records(claimable, limit)
+        if not record_ids:
+            break
+        claimed += len(record_ids)
+        yield record_ids
+    logger.info("%s records run through the pipeline", claimed)
+
+
+def renew_pipeline_leases(record_ids):
+    """Extending the leases of the chunk of records being run"""
+    renew_leases(MetadataLedger, record_ids=record_ids)
+
+
+def release_pipeline_leases():
+    """Releasing the records claimed by the pipeline to other workers"""
+    release_leases(MetadataLedger)
+    release_leases(SupplementalLedger)
+
+
+def validate_source_chunk(record_ids, context):
+    """Validating source metadata of a chunk of records"""
+    source_data_dict = get_source_metadata_for_validation().filter(
+        metadata_record_uuid__in=record_ids)
+    validate_source_using_key(source_data_dict, context['source_required'],
+                              context['source_recommended'])
+
+
+def transform_chunk(record_ids, context):
+    """Transforming source metadata of a chunk of records"""
+    source_data_dict = get_source_metadata_for_transformation().filter(
+        metadata_record_uuid__in=record_ids)
+    transform_source_using_key(source_data_dict, context['target_mapping'],
+                               context['source_required'],
+                               context['target_data_types'],
+                               context['overwrite_plan'],
+                               context['coercion_plan'],
+                               context['normalization_plan'],
+                               context['target_key_fields'])
+
+
+def validate_target_chunk(record_ids, context):
+    """Validating target metadata of a chunk of records"""
+    target_data_dict = get_target_metadata_for_validation().filter(
+        metadata_record_uuid__in=record_ids)
+    validate_target_using_key(target_data_dict, context['target_required'],
+                              context['target_recommended'],
+                              context['target_data_types'])
+
+
+def load_chunk(record_ids, context):
+    """Loading target and supplemental metadata of a chunk of records into
+    XIS"""
+    post_records_to_xis(get_target_metadata_for_loading().filter(
+        metadata_record_uuid__in=record_ids), context['provider_name'])
+
+    key_hashes = MetadataLedger.objects.filter(
+        metadata_record_uuid__in=record_ids).values_list(
+        'target_metadata_key_hash', flat=True)
+    # supplemental records sharing a key with records of another worker are
+    # only loaded by the worker claiming them first
+    supplemental_ids = claim_records(
+        get_supplemental_metadata_for_loading().filter(
+            supplemental_metadata_key_hash__in=list(key_hashes)))
+    post_supplemental_records_to_xis(
+        get_supplemental_metadata_for_loading().filter(
+            metadata_record_uuid__in=supplemental_ids))
+
+
+PIPELINE_STAGES = (validate_source_chunk, transform_chunk,
+                   validate_target_chunk, load_chunk)
+
+
+def run_pipeline_sequential(chunks, context, stages=PIPELINE_STAGES):
+    """Running every chunk through all stages before the next chunk"""
+    for chunk_number, record_ids in enumerate(chunks):
+        for stage in stages:
+            renew_pipeline_leases(record_ids)
+            stage(record_ids, context)
+        logger.info("Pipeline chunk %s complete", chunk_number + 1)
+
+
+def run_pipeline_stage(stage, context, in_queue, out_queue, errors):
+    """Running a stage on the chunks of its input queue in its own thread,
+    passing them on to the next stage"""
+    try:
+        with profile_thread():
+            while True:
+                record_ids = in_queue.get()
+                # None marks the end of the chunks
+                if record_ids is None:
+                    break
+                # once a stage failed the remaining chunks are drained so
+                # the stages before it never block on a full queue
+                if errors:
+                    continue
+                try:
+                    renew_pipeline_leases(record_ids)
+                    stage(record_ids, context)
+                except BaseException as e:
+                    # SystemExit is raised by the loaders when XIS can not
+                    # be reached
+                    logger.error("Pipeline stage %s failed: %s",
+                                 stage.__name__, e)
+                    errors.append(e)
+                    continue
+                out_queue.put(record_ids)
+    finally:
+        out_queue.put(None)
+        connection.close()
+
+
+def run_pipeline_threaded(chunks, context, stages=PIPELINE_STAGES,
+                          queue_size=2):
+    """Running each stage in its own thread so a chunk is transformed
+    while the next one is validated and the previous one loaded"""
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages))]
+    # the last stage output is only drained here
+    queues.append(queue.Queue())
+    errors = []
+    threads = [threading.Thread(
+        target=run_pipeline_stage, name='pipeline-' + stage.__name__,
+        args=(stage, context, queues[index], queues[index + 1], errors))
+        for index, stage in enumerate(stages)]
+    for thread in threads:
+        thread.start()
+
+    for record_ids in chunks:
+        if errors:
+            break
+        queues[0].put(record_ids)
+    queues[0].put(None)
+
+    completed = 0
+    while queues[-1].get() is not None:
+        completed += 1
+        logger.info("Pipeline chunk %s complete", completed)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+class Command(InstrumentedCommand):
+    """Django command to validate, transform, validate and load metadata
+    into the Experience Index Service (XIS) as one streaming job"""
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of records passed through the '
+                                 'stages at a time')
+        parser.add_argument('--threads', action='store_true',
+                            help='Run each stage in its own thread so '
+                                 'chunks move through the stages '
+                                 'concurrently')
+        parser.add_argument('--queue-size', type=int, default=2,
+                            help='Number of chunks waiting between two '
+                                 'threaded stages')
+        parser.add_argument('--max-records', type=int,
+                            help='Number of records claimed by the run, '
+                                 'leaving the others to pipelines running '
+                                 'on other hosts')
+
+    def handle(self, *args, **options):
+        """Metadata in MetadataLedger is run through every stage chunk by
+        chunk"""
+        context = get_pipeline_context()
+        try:
+            chunks = get_pipeline_record_chunks(options['chunk_size'],
+                                                options['max_records'])
+            if options['threads']:
+                run_pipeline_threaded(chunks, context,
+                                      queue_size=options['queue_size'])
+            else:
+                # writes are committed on SIGTERM so the next run resumes
+                # after the records already loaded
+                with exit_on_sigterm():
+                    run_pipeline_sequential(chunks, context)
+        finally:
+            release_pipeline_leases()
+        logger.info('Pipeline complete, MetadataLedger loaded into XIS')
@@ -0,0 +1,92 @@
+import json
+import logging
+
+from django.core.management.base import CommandError
+
+from openlxp_xia.management.utils.instrumentation import InstrumentedCommand
+from openlxp_xia.management.utils.stub_server import StubServer
+
+logger = logging.getLogger('dict_config_logger')
+
+
+def read_json_file(file_path):
+    """Reading a schema or mapping from a JSON file"""
+    try:
+        with open(file_path) as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        raise CommandError('Unable to read %s: %s' % (file_path, e))
+
+
+def parse_schema_options(schema_options):
+    """Reading schemas given as NAME=PATH"""
+    schemas = {}
+    for option in schema_options:
+        name, separator, file_path = option.partition('=')
+        if not separator:
+            raise CommandError('Schemas are given as NAME=PATH, not ' +
+                               option)
+        schemas[name] = read_json_file(file_path)
+    return schemas
+
+
+def parse_mapping_options(mapping_options):
+    """Reading mappings given as TARGET:SOURCE=PATH"""
+    mappings = {}
+    for option in mapping_options:
+        names, separator, file_path = option.partition('=')
+        target, colon, source = names.partition(':')
+        if not separator or not colon:
+            raise CommandError('Mappings are given as TARGET:SOURCE=PATH, '
+                               'not ' + option)
+        mappings[(target, source)] = read_json_file(file_path)
+    return mappings
+
+
+class Command(InstrumentedCommand):
+    """Django command to serve a local stub of the XSS and XIS endpoints
+    used by XIA"""
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--host', default='127.0.0.1',
+                            help='Address to listen on')
+        parser.add_argument('--port', type=int, default=8020,
+                            help='Port to listen on')
+        parser.add_argument('--latency', type=float, default=0,
+                            help='Seconds every response is delayed by')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='Fraction of ledger POSTs answered with '
+                                 '500')
+        parser.add_argument('--throttle-rate', type=float, default=0,
+                            help='Fraction of ledger POSTs answered with '
+                                 '429')
+        parser.add_argument('--seed', type=int,
+                            help='Seed making errors and throttling '
+                                 'reproducible')
+        parser.add_argument('--schema', action='append', default=[],
+                            help='Schema served by XSS as NAME=PATH, '
+                                 'repeatable')
+        parser.add_argument('--mapping', action='append', default=[],
+                            help='Mapping served by XSS as '
+                                 'TARGET:SOURCE=PATH, repeatable')
+
+    def handle(self, *args, **options):
+        """Stub endpoints are served until interrupted"""
+        stub_server = StubServer(
+            options['host'], options['port'], latency=options['latency'],
+            error_rate=options['error_rate'],
+            throttle_rate=options['throttle_rate'], seed=options['seed'],
+            schemas=parse_schema_options(options['schema']),
+            mappings=parse_mapping_options(options['mapping']))
+        logger.info("Stub XSS API at %s, XIS endpoints at %smetadata/ and "
+                    "%ssupplemental-data/", stub_server.url, stub_server.url,
+                    stub_server.url)
+        try:
+            stub_server.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub_server.server.server_close()
+            logger.info("Stub server stopped: %s",
+                        stub_server.stub_settings.stats)
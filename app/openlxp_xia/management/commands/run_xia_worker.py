@@ -0,0 +1,150 @@
+import logging
+import signal
+import threading
+import time
+
+from django.db import DatabaseError, close_old_connections, connection
+
+from openlxp_xia.management.commands.run_pipeline import (
+    PIPELINE_STAGES, get_pipeline_context, get_pipeline_record_chunks,
+    release_pipeline_leases, renew_pipeline_leases)
+from openlxp_xia.management.utils.findings import flush_findings
+from openlxp_xia.management.utils.instrumentation import (
+    InstrumentedCommand, flush_metrics, get_metrics, reset_metrics)
+from openlxp_xia.management.utils.xis_client import (close_xis_session,
+                                                     open_xis_session)
+
+logger = logging.getLogger('dict_config_logger')
+
+# counters of records processed by the stages, a cycle which did not
+# increment any of them found no work
+WORK_COUNTERS = ('validate_source.records', 'transform.records',
+                 'validate_target.records', 'load_target.records',
+                 'load_supplemental.records')
+
+
+def get_next_sleep(sleep, found_work, min_sleep, max_sleep):
+    """Returns the seconds to sleep before the next cycle, doubled after
+    every cycle without work and back to the minimum once work is found"""
+    if found_work:
+        return min_sleep
+    return min(max_sleep, max(sleep, min_sleep) * 2)
+
+
+def count_processed_records():
+    """Returns the number of records processed by the stages so far"""
+    counters = get_metrics()[1]
+    return sum(counters.get(name, 0) for name in WORK_COUNTERS)
+
+
+def run_worker_cycle(context, chunk_size, stop, stages=PIPELINE_STAGES,
+                     claim_chunks=1):
+    """Running the records waiting in MetadataLedger which no other worker
+    claimed through every stage, returning whether any record was
+    processed"""
+    processed = count_processed_records()
+    try:
+        chunks = get_pipeline_record_chunks(chunk_size,
+                                            chunk_size * claim_chunks)
+        for record_ids in chunks:
+            # a chunk is always completed, the next ones are left for the
+            # next run once the worker is stopped
+            if stop.is_set():
+                break
+            for stage in stages:
+                renew_pipeline_leases(record_ids)
+                stage(record_ids, context)
+    finally:
+        release_pipeline_leases()
+    return count_processed_records() > processed
+
+
+def run_worker(stop, chunk_size=500, min_sleep=1, max_sleep=60,
+               context_ttl=300, command_name='run_xia_worker',
+               stages=PIPELINE_STAGES, claim_chunks=1):
+    """Polling MetadataLedger for records to run through the pipeline
+    until stopped, keeping schemas, mappings and connections between
+    cycles"""
+    open_xis_session()
+    context = None
+    context_time = 0
+    sleep = min_sleep
+    try:
+        while not stop.is_set():
+            # connections closed by the database or older than
+            # CONN_MAX_AGE are replaced
+            close_old_connections()
+            found_work = False
+            try:
+                if context is None or \
+                        time.monotonic() - context_time > context_ttl:
+                    context = get_pipeline_context()
+                    context_time = time.monotonic()
+                found_work = run_worker_cycle(context, chunk_size, stop,
+                                              stages, claim_chunks)
+            # SystemExit is raised by the loaders when XIS can not be
+            # reached, the worker backs off and tries again
+            except (Exception, SystemExit) as e:
+                logger.exception("Worker cycle failed: %s", e)
+                sleep = max_sleep
+            if found_work:
+                try:
+                    flush_metrics(command_name)
+                    flush_findings()
+                    reset_metrics()
+                except DatabaseError as e:
+                    logger.warning("Unable to store metrics and findings "
+                                   "of %s: %s", command_name, e)
+            sleep = get_next_sleep(sleep, found_work, min_sleep, max_sleep)
+            if not found_work:
+                stop.wait(sleep)
+    finally:
+        close_xis_session()
+        connection.close()
+    logger.info("Worker stopped")
+
+
+class Command(InstrumentedCommand):
+    """Django command polling MetadataLedger for records to validate,
+    transform, validate and load into the Experience Index Service (XIS)
+    until it receives SIGTERM"""
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of records passed through the '
+                                 'stages at a time')
+        parser.add_argument('--min-sleep', type=float, default=1,
+                            help='Seconds slept after a cycle without '
+                                 'work, doubled up to --max-sleep')
+        parser.add_argument('--max-sleep', type=float, default=60,
+                            help='Longest sleep between two cycles')
+        parser.add_argument('--claim-chunks', type=int, default=1,
+                            help='Number of chunks claimed per cycle, the '
+                                 'other records being left to workers on '
+                                 'other hosts')
+        parser.add_argument('--context-ttl', type=float, default=300,
+                            help='Seconds schemas, mappings and '
+                                 'configuration are reused before being '
+                                 'fetched again')
+
+    def handle(self, *args, **options):
+        """Records are run through the pipeline as they arrive in
+        MetadataLedger"""
+        stop = threading.Event()
+
+        def request_stop(signum, frame):
+            logger.info("Received signal %s, stopping after the current "
+                        "chunk", signum)
+            stop.set()
+
+        previous_handlers = {signum: signal.signal(signum, request_stop)
+                             for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            run_worker(stop, options['chunk_size'], options['min_sleep'],
+                       options['max_sleep'], options['context_ttl'],
+                       self.get_command_name(),
+                       claim_chunks=options['claim_chunks'])
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
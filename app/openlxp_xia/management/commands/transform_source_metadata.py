@@ -1,14 +1,19 @@
+import collections
 import hashlib
 import logging
 
-import pandas as pd
-from django.core.management.base import BaseCommand
 from django.utils import timezone
 
+from openlxp_xia.management.utils.findings import record_finding
+from openlxp_xia.management.utils.instrumentation import (
+    InstrumentedCommand, increment, timer)
+from openlxp_xia.management.utils.lazy_import import lazy_import
+from openlxp_xia.management.utils.profiling import profile_records
+from openlxp_xia.management.utils.transactions import CommitBatch
 from openlxp_xia.management.utils.xia_internal import (
-    dict_flatten, get_target_metadata_key_value, is_date,
-    replace_field_on_target_schema, required_recommended_logs,
-    type_cast_overwritten_values)
+    dict_flatten, get_key_filter, get_normalization_plan,
+    get_target_key_fields, get_target_metadata_key_value, is_date,
+    replace_field_on_target_schema, type_cast_overwritten_values)
 from openlxp_xia.management.utils.xss_client import (
     get_data_types_for_validation, get_required_fields_for_validation,
     get_source_validation_schema, get_target_metadata_for_transformation,
@@ -16,8 +21,18 @@ from openlxp_xia.management.utils.xss_client import (
 from openlxp_xia.models import (MetadataFieldOverwrite, MetadataLedger,
                                 SupplementalLedger)
 
+pd = lazy_import('pandas')
+
 logger = logging.getLogger('dict_config_logger')
 
+# a MetadataFieldOverwrite with its value type cast
+OverwriteRule = collections.namedtuple('OverwriteRule',
+                                       ['field_name', 'value', 'overwrite'])
+# converter of a target field returning the value, explicitly converted
+# when needed, and whether it had the expected datatype
+TypeCoercion = collections.namedtuple('TypeCoercion',
+                                      ['field_path', 'convert'])
+
 
 def get_source_metadata_for_transformation():
     """Retrieving Source metadata from MetadataLedger that needs to be
@@ -33,89 +48,122 @@ def get_source_metadata_for_transformation():
     return source_data_dict
 
 
-def create_supplemental_metadata(metadata_columns, supplemental_metadata):
-    """Function to identify supplemental metadata store them"""
+def get_mapped_source_paths(target_mapping_dict):
+    """Returns the source paths mapped to target fields as a frozenset"""
+    return frozenset(
+        source_path for fields in target_mapping_dict.values()
+        for source_path in fields.values()
+        if not is_empty_value(source_path))
+
+
+def create_supplemental_metadata(mapped_paths, supplemental_metadata):
+    """Function to identify supplemental metadata, the source fields not
+    mapped to the target schema"""
+    return {column: value for column, value in supplemental_metadata.items()
+            if column not in mapped_paths}
 
-    for metadata_column_list in metadata_columns:
-        for column in metadata_column_list:
-            supplemental_metadata.pop(column, None)
-    return supplemental_metadata
 
+def get_overwrite_plan():
+    """Loading the fields to be overwritten or appended with their type
+    cast values once, as a tuple of OverwriteRule"""
+    return tuple(
+        OverwriteRule(each.field_name,
+                      # checking and converting type of overwritten values
+                      type_cast_overwritten_values(each.field_type,
+                                                   each.field_value),
+                      each.overwrite)
+        for each in MetadataFieldOverwrite.objects.all())
 
-def get_metadata_fields_to_overwrite(metadata_df):
-    """looping through fields to be overwrite or appended"""
-    for each in MetadataFieldOverwrite.objects.all():
-        column = each.field_name
-        overwrite_flag = each.overwrite
-        # checking and converting type of overwritten values
-        value = type_cast_overwritten_values(each.field_type, each.field_value)
 
-        metadata_df = overwrite_append_metadata(metadata_df, column, value,
-                                                overwrite_flag)
-    return metadata_df
+def is_empty_value(value):
+    """Returns whether a metadata value is missing, None, NaN or empty"""
+    return value is None or value == '' or value != value
 
 
-def overwrite_append_metadata(metadata_df, column, value, overwrite_flag):
+def overwrite_append_metadata(metadata, column, value, overwrite_flag):
     """Overwrite & append metadata fields based on overwrite flag """
 
-    # field should be overwritten and append
-    if overwrite_flag:
-        metadata_df[column] = value
-    # skip field to be overwritten and append
-    else:
-        if column not in metadata_df.columns:
-            metadata_df[column] = value
-        else:
-            metadata_df.loc[metadata_df[column].isnull(), column] = value
-            metadata_df.loc[metadata_df[column] == "", column] = value
-    return metadata_df
+    # field should be overwritten and append, or skipped when it already
+    # holds a value
+    if overwrite_flag or is_empty_value(metadata.get(column)):
+        metadata[column] = value
+    return metadata
 
 
-def overwrite_metadata_field(metadata_df):
+def overwrite_metadata_field(metadata, overwrite_plan=None):
     """Overwrite & append metadata fields with admin entered values """
-    # get metadata fields to be overwritten and appended and replace values
-    metadata_df = get_metadata_fields_to_overwrite(metadata_df)
-    # return source metadata as dictionary
-
-    source_data_dict = metadata_df.to_dict(orient='index')
-    return source_data_dict[0]
+    if overwrite_plan is None:
+        overwrite_plan = get_overwrite_plan()
+    for rule in overwrite_plan:
+        metadata = overwrite_append_metadata(metadata, rule.field_name,
+                                             rule.value, rule.overwrite)
+    return metadata
+
+
+def coerce_datetime(value):
+    """Returns the value and whether it is a date, explicitly converted to
+    string if it is not"""
+    if is_date(value):
+        return value, True
+    return str(value), False
+
+
+def get_instance_coercion(data_type):
+    """Returns a converter keeping values of a datatype and explicitly
+    converting others to string"""
+    def coerce_instance(value):
+        if isinstance(value, data_type):
+            return value, True
+        return str(value), False
+    return coerce_instance
+
+
+def get_type_coercion_plan(expected_data_types):
+    """Compiling the expected datatypes of the target schema into a
+    dictionary of (section, field) to TypeCoercion"""
+    coercion_plan = {}
+    for item, data_type in expected_data_types.items():
+        section, _, key = item.partition('.')
+        if data_type == "datetime":
+            convert = coerce_datetime
+        elif isinstance(data_type, type):
+            convert = get_instance_coercion(data_type)
+        # datatypes unknown to the schema are converted like fields
+        # without datatype
+        else:
+            continue
+        coercion_plan[(section, key)] = TypeCoercion(item, convert)
+    return coercion_plan
 
 
-def type_checking_target_metadata(ind, target_data_dict, expected_data_types):
+def type_checking_target_metadata(ind, target_data_dict, expected_data_types,
+                                  coercion_plan=None):
     """Function for type checking and explicit type conversion of metadata"""
-    for index in target_data_dict:
-        for section in target_data_dict[index]:
-            for key in target_data_dict[index][section]:
-                item = section + '.' + key
-                # check if item has a expected datatype from schema
-                if item in expected_data_types:
-                    # check for datetime datatype for field in metadata
-                    if expected_data_types[item] == "datetime":
-                        if not is_date(target_data_dict[index][section][key]):
-                            # explicitly convert to string if incorrect
-                            target_data_dict[index][section][key] = str(
-                                target_data_dict[index][section][key])
-                            required_recommended_logs(ind, "datatype",
-                                                      item)
-                    # check for datatype for field in metadata(except datetime)
-                    elif (not isinstance(target_data_dict[index][section][key],
-                                         expected_data_types[item])):
-                        # explicitly convert to string if incorrect
-                        target_data_dict[index][section][key] = str(
-                            target_data_dict[index][section][key])
-                        required_recommended_logs(ind, "datatype",
-                                                  item)
+    if coercion_plan is None:
+        coercion_plan = get_type_coercion_plan(expected_data_types)
+    for record in target_data_dict.values():
+        for section, fields in record.items():
+            for key, value in fields.items():
+                coercion = coercion_plan.get((section, key))
                 # explicitly convert to string if datatype not present
-                else:
-                    target_data_dict[index][section][key] = str(
-                        target_data_dict[index][section][key])
+                if coercion is None:
+                    fields[key] = str(value)
+                    continue
+                fields[key], matched = coercion.convert(value)
+                if not matched:
+                    record_finding("transform", "datatype",
+                                   coercion.field_path, ind)
     return target_data_dict
 
 
 def create_target_metadata_dict(ind, target_mapping_dict, source_metadata,
-                                required_column_list, expected_data_types):
+                                required_column_list, expected_data_types,
+                                overwrite_plan=None, coercion_plan=None,
+                                mapped_paths=None):
     """Function to replace and transform source data to target data for
     using target mapping schema"""
+    if mapped_paths is None:
+        mapped_paths = get_mapped_source_paths(target_mapping_dict)
 
     # Create dataframe using target metadata schema
     target_schema = pd.DataFrame.from_dict(
@@ -131,8 +179,7 @@ def create_target_metadata_dict(ind, target_mapping_dict, source_metadata,
         source_metadata.items()}
 
     # replacing fields to be overwritten or appended
-    metadata_df = pd.DataFrame(source_metadata, index=[0])
-    metadata = overwrite_metadata_field(metadata_df)
+    metadata = overwrite_metadata_field(source_metadata, overwrite_plan)
 
     # Replacing metadata schema with mapped values from source metadata
 
@@ -150,30 +197,34 @@ def create_target_metadata_dict(ind, target_mapping_dict, source_metadata,
 
     # type checking and explicit type conversion of metadata
     target_data_dict = type_checking_target_metadata(ind, target_data_dict,
-                                                     expected_data_types)
+                                                     expected_data_types,
+                                                     coercion_plan)
 
     # send values to be skipped while creating supplemental data
 
     supplemental_metadata = \
-        create_supplemental_metadata(target_schema.values.tolist(), metadata)
+        create_supplemental_metadata(mapped_paths, metadata)
 
     return target_data_dict, supplemental_metadata
 
 
 def store_transformed_source_metadata(key_value, key_value_hash,
                                       target_data_dict,
-                                      hash_value, supplemental_metadata):
+                                      hash_value, supplemental_metadata,
+                                      key_value_digest=None):
     """Storing target metadata in MetadataLedger"""
+    source_key_filter = get_key_filter('source_metadata', key_value_hash,
+                                       key_value_digest)
 
     source_extraction_date = MetadataLedger.objects.values_list(
         "source_metadata_extraction_date", flat=True).get(
-        source_metadata_key_hash=key_value_hash,
+        source_key_filter,
         record_lifecycle_status='Active',
         source_metadata_transformation_date=None
     )
 
     data_for_transformation = MetadataLedger.objects.filter(
-        source_metadata_key_hash=key_value_hash,
+        source_key_filter,
         record_lifecycle_status='Active',
         source_metadata_transformation_date=None
     )
@@ -185,6 +236,7 @@ def store_transformed_source_metadata(key_value, key_value_hash,
         source_metadata_transformation_date=timezone.now(),
         target_metadata_key=key_value,
         target_metadata_key_hash=key_value_hash,
+        target_metadata_key_digest=key_value_digest or '',
         target_metadata=target_data_dict,
         target_metadata_hash=hash_value)
 
@@ -199,7 +251,9 @@ def store_transformed_source_metadata(key_value, key_value_hash,
             supplemental_metadata_key=key_value,
             supplemental_metadata_key_hash=key_value_hash,
             supplemental_metadata=supplemental_metadata,
-            record_lifecycle_status='Active')
+            record_lifecycle_status='Active',
+            defaults={'supplemental_metadata_key_digest':
+                      key_value_digest or ''})
 
         SupplementalLedger.objects.filter(
             supplemental_metadata_hash=supplemental_hash_value,
@@ -210,47 +264,63 @@ def store_transformed_source_metadata(key_value, key_value_hash,
             supplemental_metadata_transformation_date=timezone.now())
 
 
+@timer('transform')
 def transform_source_using_key(source_data_dict, target_mapping_dict,
-                               required_column_list, expected_data_types):
+                               required_column_list, expected_data_types,
+                               overwrite_plan=None, coercion_plan=None,
+                               normalization_plan=None, key_fields=None):
     """Transforming source data using target metadata schema"""
     logger.info(
         "Transforming source data using target renaming and mapping "
         "schemas and storing in json format ")
     logger.info("Identifying supplemental data and storing them ")
-    len_source_metadata = len(source_data_dict)
+    with timer('transform.query'):
+        len_source_metadata = len(source_data_dict)
     logger.info(
         "Overwrite & append metadata fields with admin entered values")
-    for ind in range(len_source_metadata):
-        for table_column_name in source_data_dict[ind]:
-            target_data_dict, supplemental_metadata = \
-                create_target_metadata_dict(ind, target_mapping_dict,
-                                            source_data_dict
-                                            [ind]
-                                            [table_column_name],
-                                            required_column_list,
-                                            expected_data_types
-                                            )
-            # Looping through target values in dictionary
-            for ind1 in target_data_dict:
-                # Replacing values in field referring target schema
-                replace_field_on_target_schema(ind1,
-                                               target_data_dict)
-                # Key creation for target metadata
-                key = get_target_metadata_key_value(target_data_dict[ind1])
-
-                hash_value = hashlib.sha512(
-                    str(target_data_dict[ind1]).encode(
-                        'utf-8')).hexdigest()
-                store_transformed_source_metadata(key['key_value'],
-                                                  key[
-                                                      'key_value_hash'],
-                                                  target_data_dict[
-                                                      ind1],
-                                                  hash_value,
-                                                  supplemental_metadata)
-
-
-class Command(BaseCommand):
+    if overwrite_plan is None:
+        overwrite_plan = get_overwrite_plan()
+    if coercion_plan is None:
+        coercion_plan = get_type_coercion_plan(expected_data_types)
+    if normalization_plan is None:
+        normalization_plan = get_normalization_plan()
+    if key_fields is None:
+        key_fields = get_target_key_fields()
+    mapped_paths = get_mapped_source_paths(target_mapping_dict)
+    with CommitBatch('transform') as batch:
+        for ind in profile_records(range(len_source_metadata)):
+            for table_column_name in source_data_dict[ind]:
+                with timer('transform.map'):
+                    target_data_dict, supplemental_metadata = \
+                        create_target_metadata_dict(
+                            ind, target_mapping_dict,
+                            source_data_dict[ind][table_column_name],
+                            required_column_list, expected_data_types,
+                            overwrite_plan, coercion_plan, mapped_paths)
+                # Looping through target values in dictionary
+                for ind1 in target_data_dict:
+                    # Replacing values in field referring target schema
+                    replace_field_on_target_schema(ind1,
+                                                   target_data_dict,
+                                                   normalization_plan)
+                    # Key creation for target metadata
+                    key = get_target_metadata_key_value(
+                        target_data_dict[ind1], key_fields)
+
+                    with timer('transform.hash'):
+                        hash_value = hashlib.sha512(
+                            str(target_data_dict[ind1]).encode(
+                                'utf-8')).hexdigest()
+                    with timer('transform.db_write'), \
+                            batch.record(key['key_value_hash']):
+                        store_transformed_source_metadata(
+                            key['key_value'], key['key_value_hash'],
+                            target_data_dict[ind1], hash_value,
+                            supplemental_metadata, key['key_value_digest'])
+                    increment('transform.records')
+
+
+class Command(InstrumentedCommand):
     """Django command to extract data in the Experience index Agent (XIA)"""
 
     def handle(self, *args, **options):
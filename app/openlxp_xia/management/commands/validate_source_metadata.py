@@ -1,10 +1,14 @@
 import logging
 
-from django.core.management.base import BaseCommand
 from django.utils import timezone
 
+from openlxp_xia.management.utils.findings import flush_findings
+from openlxp_xia.management.utils.instrumentation import (
+    InstrumentedCommand, increment, timer)
+from openlxp_xia.management.utils.profiling import profile_records
+from openlxp_xia.management.utils.transactions import CommitBatch
 from openlxp_xia.management.utils.xia_internal import (
-    dict_flatten, required_recommended_logs)
+    dict_flatten, get_key_filter, required_recommended_logs)
 from openlxp_xia.management.utils.xss_client import (
     get_required_fields_for_validation, get_source_validation_schema)
 from openlxp_xia.models import MetadataLedger
@@ -19,6 +23,7 @@ def get_source_metadata_for_validation():
         "Accessing source metadata from MetadataLedger to be validated")
     source_data_dict = \
         MetadataLedger.objects.values('source_metadata_key_hash',
+                                      'source_metadata_key_digest',
                                       'source_metadata').filter(
             source_metadata_validation_status='',
             record_lifecycle_status='Active').exclude(
@@ -30,12 +35,15 @@ def get_source_metadata_for_validation():
 def store_source_metadata_validation_status(source_data_dict,
                                             key_value_hash, validation_result,
                                             record_status_result,
-                                            source_metadata):
+                                            source_metadata,
+                                            key_value_digest=None):
     """Storing validation result in MetadataLedger"""
+    source_key_filter = get_key_filter('source_metadata', key_value_hash,
+                                       key_value_digest)
 
     if record_status_result == 'Active':
         source_data_dict.filter(
-            source_metadata_key_hash=key_value_hash).update(
+            source_key_filter).update(
             source_metadata=source_metadata,
             source_metadata_validation_status=validation_result,
             source_metadata_validation_date=timezone.now(),
@@ -43,7 +51,7 @@ def store_source_metadata_validation_status(source_data_dict,
         )
     else:
         source_data_dict.filter(
-            source_metadata_key_hash=key_value_hash).update(
+            source_key_filter).update(
             source_metadata=source_metadata,
             source_metadata_validation_status=validation_result,
             source_metadata_validation_date=timezone.now(),
@@ -52,54 +60,72 @@ def store_source_metadata_validation_status(source_data_dict,
         )
 
 
+@timer('validate_source')
 def validate_source_using_key(source_data_dict, required_column_list,
                               recommended_column_list):
     """Validating source data against required & recommended column names"""
 
     logger.info("Validating and updating records in MetadataLedger table for "
                 "Source data")
-    len_source_metadata = len(source_data_dict)
-    for ind in range(len_source_metadata):
-        # Updating default validation for all records
-        validation_result = 'Y'
-        record_status_result = 'Active'
-
-        # flattened source data created for reference
-        flattened_source_data = dict_flatten(source_data_dict[ind]
-                                             ['source_metadata'],
-                                             required_column_list)
-        # validate for required values in data
-        for item in required_column_list:
-            # update validation and record status for invalid data
-            # Log out error for missing required values
-            if item in flattened_source_data:
-                if not flattened_source_data[item]:
+    with timer('validate_source.query'):
+        len_source_metadata = len(source_data_dict)
+    with CommitBatch('validate_source') as batch:
+        for ind in profile_records(range(len_source_metadata)):
+            # Updating default validation for all records
+            validation_result = 'Y'
+            record_status_result = 'Active'
+
+            # assigning key hash value for source metadata
+            key_value_hash = source_data_dict[ind]['source_metadata_key_hash']
+            key_value_digest = source_data_dict[ind].get(
+                'source_metadata_key_digest')
+            # flattened source data created for reference
+            with timer('validate_source.flatten'):
+                flattened_source_data = dict_flatten(source_data_dict[ind]
+                                                     ['source_metadata'],
+                                                     required_column_list)
+            # validate for required values in data
+            for item in required_column_list:
+                # update validation and record status for invalid data
+                # Log out error for missing required values
+                if item in flattened_source_data:
+                    if not flattened_source_data[item]:
+                        validation_result = 'N'
+                        required_recommended_logs(key_value_hash, "Required",
+                                                  item, "validate_source")
+                else:
                     validation_result = 'N'
-                    required_recommended_logs(ind, "Required", item)
-            else:
-                validation_result = 'N'
-                required_recommended_logs(ind, "Required", item)
-
-        # validate for recommended values in data
-        for item in recommended_column_list:
-            # Log out warning for missing recommended values
-            if item in flattened_source_data:
-                if not flattened_source_data[item]:
-                    required_recommended_logs(ind, "Recommended", item)
-            else:
-                required_recommended_logs(ind, "Recommended", item)
-        # assigning key hash value for source metadata
-        key_value_hash = source_data_dict[ind]['source_metadata_key_hash']
-        # Calling function to update validation status
-        store_source_metadata_validation_status(source_data_dict,
-                                                key_value_hash,
-                                                validation_result,
-                                                record_status_result,
-                                                source_data_dict[ind]
-                                                ['source_metadata'])
-
-
-class Command(BaseCommand):
+                    required_recommended_logs(key_value_hash, "Required",
+                                              item, "validate_source")
+
+            # validate for recommended values in data
+            for item in recommended_column_list:
+                # Log out warning for missing recommended values
+                if item in flattened_source_data:
+                    if not flattened_source_data[item]:
+                        required_recommended_logs(key_value_hash,
+                                                  "Recommended", item,
+                                                  "validate_source")
+                else:
+                    required_recommended_logs(key_value_hash, "Recommended",
+                                              item, "validate_source")
+            # Calling function to update validation status
+            with timer('validate_source.db_write'), \
+                    batch.record(key_value_hash):
+                store_source_metadata_validation_status(source_data_dict,
+                                                        key_value_hash,
+                                                        validation_result,
+                                                        record_status_result,
+                                                        source_data_dict[ind]
+                                                        ['source_metadata'],
+                                                        key_value_digest)
+            increment('validate_source.records')
+            if validation_result == 'N':
+                increment('validate_source.invalid')
+    flush_findings()
+
+
+class Command(InstrumentedCommand):
     """Django command to validate source data"""
 
     def handle(self, *args, **options):
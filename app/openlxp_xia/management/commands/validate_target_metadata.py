@@ -1,10 +1,14 @@
 import logging
 
-from django.core.management.base import BaseCommand
 from django.utils import timezone
 
+from openlxp_xia.management.utils.findings import flush_findings
+from openlxp_xia.management.utils.instrumentation import (
+    InstrumentedCommand, increment, timer)
+from openlxp_xia.management.utils.profiling import profile_records
+from openlxp_xia.management.utils.transactions import CommitBatch
 from openlxp_xia.management.utils.xia_internal import (
-    dict_flatten, is_date, required_recommended_logs)
+    dict_flatten, get_key_filter, is_date, required_recommended_logs)
 from openlxp_xia.management.utils.xss_client import (
     get_data_types_for_validation, get_required_fields_for_validation,
     get_target_validation_schema)
@@ -19,7 +23,7 @@ def get_target_metadata_for_validation():
     logger.info(
         "Accessing target metadata from MetadataLedger to be validated")
     target_data_dict = MetadataLedger.objects.values(
-        'target_metadata_key_hash',
+        'target_metadata_key_hash', 'target_metadata_key_digest',
         'target_metadata').filter(target_metadata_validation_status='',
                                   record_lifecycle_status='Active',
                                   target_metadata_transmission_date=None
@@ -28,28 +32,29 @@ def get_target_metadata_for_validation():
     return target_data_dict
 
 
-def update_previous_instance_in_metadata(key_value_hash):
+def update_previous_instance_in_metadata(key_value_hash,
+                                         key_value_digest=None):
     """Update older instances of record to inactive status"""
+    source_key_filter = get_key_filter('source_metadata', key_value_hash,
+                                       key_value_digest)
+    supplemental_key_filter = get_key_filter('supplemental_metadata',
+                                             key_value_hash, key_value_digest)
     # Setting record_status & deleted_date for updated record
     MetadataLedger.objects.filter(
-        source_metadata_key_hash=key_value_hash,
-        record_lifecycle_status='Active'). \
+        source_key_filter, record_lifecycle_status='Active'). \
         exclude(target_metadata_validation_date=None).update(
         metadata_record_inactivation_date=timezone.now())
     MetadataLedger.objects.filter(
-        source_metadata_key_hash=key_value_hash,
-        record_lifecycle_status='Active'). \
+        source_key_filter, record_lifecycle_status='Active'). \
         exclude(target_metadata_validation_date=None).update(
         record_lifecycle_status='Inactive')
 
     SupplementalLedger.objects.filter(
-        supplemental_metadata_key_hash=key_value_hash,
-        record_lifecycle_status='Active'). \
+        supplemental_key_filter, record_lifecycle_status='Active'). \
         exclude(supplemental_metadata_validation_date=None).update(
         metadata_record_inactivation_date=timezone.now())
     SupplementalLedger.objects.filter(
-        supplemental_metadata_key_hash=key_value_hash,
-        record_lifecycle_status='Active'). \
+        supplemental_key_filter, record_lifecycle_status='Active'). \
         exclude(supplemental_metadata_validation_date=None).update(
         record_lifecycle_status='Inactive')
 
@@ -57,12 +62,16 @@ def update_previous_instance_in_metadata(key_value_hash):
 def store_target_metadata_validation_status(target_data_dict, key_value_hash,
                                             validation_result,
                                             record_status_result,
-                                            target_metadata):
+                                            target_metadata,
+                                            key_value_digest=None):
     """Storing validation result in MetadataLedger"""
+    target_key_filter = get_key_filter('target_metadata', key_value_hash,
+                                       key_value_digest)
     if record_status_result == 'Active':
-        update_previous_instance_in_metadata(key_value_hash)
+        update_previous_instance_in_metadata(key_value_hash,
+                                             key_value_digest)
         target_data_dict.filter(
-            target_metadata_key_hash=key_value_hash).update(
+            target_key_filter).update(
             target_metadata=target_metadata,
             target_metadata_validation_status=validation_result,
             target_metadata_validation_date=timezone.now(),
@@ -70,7 +79,7 @@ def store_target_metadata_validation_status(target_data_dict, key_value_hash,
 
     else:
         target_data_dict.filter(
-            target_metadata_key_hash=key_value_hash).update(
+            target_key_filter).update(
             target_metadata=target_metadata,
             target_metadata_validation_status=validation_result,
             target_metadata_validation_date=timezone.now(),
@@ -78,79 +87,100 @@ def store_target_metadata_validation_status(target_data_dict, key_value_hash,
             metadata_record_inactivation_date=timezone.now())
 
     SupplementalLedger.objects.filter(
-        supplemental_metadata_key_hash=key_value_hash,
+        get_key_filter('supplemental_metadata', key_value_hash,
+                       key_value_digest),
         record_lifecycle_status="Active").update(
         supplemental_metadata_validation_date=timezone.now(),
         record_lifecycle_status=record_status_result)
 
 
+@timer('validate_target')
 def validate_target_using_key(target_data_dict, required_column_list,
                               recommended_column_list, expected_data_types):
     """Validating target data against required & recommended column names"""
 
     logger.info('Validating and updating records in MetadataLedger table for '
                 'target data')
-    len_target_metadata = len(target_data_dict)
-    for ind in range(len_target_metadata):
-        # Updating default validation for all records
-        validation_result = 'Y'
-        record_status_result = 'Active'
-
-        # flattened source data created for reference
-        flattened_source_data = dict_flatten(target_data_dict[ind]
-                                             ['target_metadata'],
-                                             required_column_list)
-        # validate for required values in data
-        for item_name in required_column_list:
-            # update validation and record status for invalid data
-            # Log out error for missing required values
-            # item_name = item[:-len(".use")]
-            if item_name in flattened_source_data:
-                if not flattened_source_data[item_name]:
+    with timer('validate_target.query'):
+        len_target_metadata = len(target_data_dict)
+    with CommitBatch('validate_target') as batch:
+        for ind in profile_records(range(len_target_metadata)):
+            # Updating default validation for all records
+            validation_result = 'Y'
+            record_status_result = 'Active'
+
+            # assigning key hash value for target metadata
+            key_value_hash = target_data_dict[ind]['target_metadata_key_hash']
+            key_value_digest = target_data_dict[ind].get(
+                'target_metadata_key_digest')
+            # flattened source data created for reference
+            with timer('validate_target.flatten'):
+                flattened_source_data = dict_flatten(target_data_dict[ind]
+                                                     ['target_metadata'],
+                                                     required_column_list)
+            # validate for required values in data
+            for item_name in required_column_list:
+                # update validation and record status for invalid data
+                # Log out error for missing required values
+                # item_name = item[:-len(".use")]
+                if item_name in flattened_source_data:
+                    if not flattened_source_data[item_name]:
+                        validation_result = 'N'
+                        record_status_result = 'Inactive'
+                        required_recommended_logs(key_value_hash, "Required",
+                                                  item_name, "validate_target")
+                else:
                     validation_result = 'N'
                     record_status_result = 'Inactive'
-                    required_recommended_logs(ind, "Required", item_name)
-            else:
-                validation_result = 'N'
-                record_status_result = 'Inactive'
-                required_recommended_logs(ind, "Required", item_name)
-
-        # validate for recommended values in data
-        for item_name in recommended_column_list:
-            # Log out warning for missing recommended values
-            # item_name = item[:-len(".use")]
-            if item_name in flattened_source_data:
-                if not flattened_source_data[item_name]:
-                    required_recommended_logs(ind, "Recommended", item_name)
-            else:
-                required_recommended_logs(ind, "Recommended", item_name)
-        # Type checking for values in metadata
-        for item in flattened_source_data:
-            # check if datatype has been assigned to field
-            if item in expected_data_types:
-                # type checking for datetime datatype fields
-                if expected_data_types[item] == "datetime":
-                    if not is_date(flattened_source_data[item]):
-                        required_recommended_logs(ind, "datatype",
-                                                  item)
-                # type checking for datatype fields(except datetime)
-                elif (not isinstance(flattened_source_data[item],
-                                     expected_data_types[item])):
-                    required_recommended_logs(ind, "datatype",
-                                              item)
-
-        # assigning key hash value for source metadata
-        key_value_hash = target_data_dict[ind]['target_metadata_key_hash']
-        # Calling function to update validation status
-        store_target_metadata_validation_status(target_data_dict,
-                                                key_value_hash,
-                                                validation_result,
-                                                record_status_result,
-                                                target_data_dict[ind]
-                                                ['target_metadata'])
-
-
-class Command(BaseCommand):
+                    required_recommended_logs(key_value_hash, "Required",
+                                              item_name, "validate_target")
+
+            # validate for recommended values in data
+            for item_name in recommended_column_list:
+                # Log out warning for missing recommended values
+                # item_name = item[:-len(".use")]
+                if item_name in flattened_source_data:
+                    if not flattened_source_data[item_name]:
+                        required_recommended_logs(key_value_hash,
+                                                  "Recommended", item_name,
+                                                  "validate_target")
+                else:
+                    required_recommended_logs(key_value_hash, "Recommended",
+                                              item_name, "validate_target")
+            # Type checking for values in metadata
+            for item in flattened_source_data:
+                # check if datatype has been assigned to field
+                if item in expected_data_types:
+                    # type checking for datetime datatype fields
+                    if expected_data_types[item] == "datetime":
+                        if not is_date(flattened_source_data[item]):
+                            required_recommended_logs(key_value_hash,
+                                                      "datatype", item,
+                                                      "validate_target")
+                    # type checking for datatype fields(except datetime)
+                    elif (not isinstance(flattened_source_data[item],
+                                         expected_data_types[item])):
+                        required_recommended_logs(key_value_hash,
+                                                  "datatype", item,
+                                                  "validate_target")
+
+            # Calling function to update validation status
+            with timer('validate_target.db_write'), \
+                    batch.record(key_value_hash):
+                store_target_metadata_validation_status(target_data_dict,
+                                                        key_value_hash,
+                                                        validation_result,
+                                                        record_status_result,
+                                                        target_data_dict[ind]
+                                                        ['target_metadata'],
+                                                        key_value_digest)
+            increment('validate_target.records')
+            if validation_result == 'N':
+                increment('validate_target.invalid')
+    flush_findings()
+
+
+class Command(InstrumentedCommand):
     """Django command to validate target data"""
 
     def handle(self, *args, **options):
@@ -0,0 +1,111 @@
+import csv
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+from openlxp_xia.models import ValidationFinding
+
+logger = logging.getLogger('dict_config_logger')
+
+FINDINGS_TABLE_COLUMNS = ('stage', 'category', 'field', 'count', 'examples')
+
+# log level of the summary line of each finding category
+FINDING_LOG_LEVELS = {'Required': logging.ERROR,
+                      'Recommended': logging.WARNING,
+                      'datatype': logging.WARNING}
+
+# findings of these stages are stored as ValidationFinding rows, their
+# records being referenced by key hash
+PERSISTED_STAGES = ('validate_source', 'validate_target')
+
+# ValidationFinding rows written per query
+FINDINGS_BATCH_SIZE = 1000
+
+# process wide registry of findings ((stage, category, field): [count,
+# sampled record references]) and of the (stage, category, field, record)
+# findings waiting to be stored, shared by the pipeline threads
+_findings = {}
+_pending = []
+_lock = threading.Lock()
+
+
+def get_sample_size():
+    """Returns the number of example records kept per finding"""
+    return getattr(settings, 'XIA_FINDINGS_SAMPLE_SIZE', 5)
+
+
+def persist_findings():
+    """Returns whether findings are stored as ValidationFinding rows"""
+    return getattr(settings, 'XIA_PERSIST_FINDINGS', True)
+
+
+def reset_findings():
+    """Clears every finding, including the ones not stored yet"""
+    with _lock:
+        _findings.clear()
+        _pending.clear()
+
+
+def record_finding(stage, category, field, record):
+    """Counts a validation finding of a field, keeping the first records
+    it was found in as examples"""
+    key = (stage, category, field)
+    with _lock:
+        finding = _findings.get(key)
+        if finding is None:
+            finding = _findings[key] = [0, []]
+        finding[0] += 1
+        if len(finding[1]) < get_sample_size():
+            finding[1].append(str(record))
+        if stage in PERSISTED_STAGES and persist_findings():
+            _pending.append(key + (record,))
+            flush = len(_pending) >= FINDINGS_BATCH_SIZE
+        else:
+            flush = False
+    if flush:
+        flush_findings()
+
+
+def flush_findings():
+    """Stores the pending findings as ValidationFinding rows"""
+    with _lock:
+        pending = _pending[:]
+        _pending.clear()
+    if pending:
+        ValidationFinding.objects.bulk_create(
+            [ValidationFinding(stage=stage, finding_type=category,
+                               field_path=field, metadata_key_hash=record)
+             for stage, category, field, record in pending],
+            batch_size=FINDINGS_BATCH_SIZE)
+
+
+def get_findings():
+    """Returns the findings as (stage, category, field, count, examples)
+    rows, the most frequent first"""
+    with _lock:
+        rows = [(stage, category, field, count, list(examples))
+                for (stage, category, field), (count, examples)
+                in _findings.items()]
+    return sorted(rows, key=lambda row: (-row[3], row[:3]))
+
+
+def log_findings_summary():
+    """Logs a line per finding with its count and examples"""
+    for stage, category, field, count, examples in get_findings():
+        logger.log(FINDING_LOG_LEVELS.get(category, logging.WARNING),
+                   "%s: %s records with %s finding for field %s, e.g. "
+                   "records %s", stage, count, category, field,
+                   ', '.join(examples))
+
+
+def write_findings_table(file_path):
+    """Writes the findings to a CSV file, examples separated by spaces"""
+    with open(file_path + '.tmp', 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(FINDINGS_TABLE_COLUMNS)
+        for stage, category, field, count, examples in get_findings():
+            writer.writerow((stage, category, field, count,
+                             ' '.join(examples)))
+    os.replace(file_path + '.tmp', file_path)
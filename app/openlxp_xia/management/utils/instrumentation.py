@@ -0,0 +1,295 @@
+import bisect
+import contextlib
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, transaction
+
+from openlxp_xia.management.utils.findings import (flush_findings,
+                                                   log_findings_summary,
+                                                   reset_findings,
+                                                   write_findings_table)
+from openlxp_xia.management.utils.profiling import (PROFILE_MODES,
+                                                    start_profiling,
+                                                    stop_profiling)
+from openlxp_xia.models import StageMetric
+
+logger = logging.getLogger('dict_config_logger')
+
+# StatsD servers drop UDP datagrams larger than their buffer, 512 bytes is
+# safe on any network
+STATSD_MAX_PACKET_SIZE = 512
+
+# upper bounds in seconds of the timer histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+# process wide registry of timers (name: [count, total seconds, max
+# seconds, bucket counts]) and counters (name: value), shared by the
+# pipeline threads
+_timers = {}
+_counters = {}
+_lock = threading.Lock()
+
+
+def reset_metrics():
+    """Clears every timer and counter"""
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def record_time(name, seconds):
+    """Adds a duration to a timer"""
+    # durations above the last bound only count towards +Inf
+    bucket = bisect.bisect_left(DURATION_BUCKETS, seconds)
+    with _lock:
+        timer_value = _timers.get(name)
+        if timer_value is None:
+            timer_value = _timers[name] = [
+                0, 0.0, 0.0, [0] * (len(DURATION_BUCKETS) + 1)]
+        timer_value[0] += 1
+        timer_value[1] += seconds
+        timer_value[2] = max(timer_value[2], seconds)
+        timer_value[3][bucket] += 1
+
+
+def increment(name, value=1):
+    """Increments a counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+@contextlib.contextmanager
+def timer(name):
+    """Times a block of code, or every call of a function when used as a
+    decorator"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(name, time.perf_counter() - start)
+
+
+def get_metrics():
+    """Returns a copy of the timers and counters"""
+    with _lock:
+        return ({name: (count, total, maximum, list(buckets))
+                 for name, (count, total, maximum, buckets)
+                 in _timers.items()},
+                dict(_counters))
+
+
+def log_metrics_summary(command_name, elapsed):
+    """Logs the duration of every timed step and the record throughput of
+    every stage"""
+    timers, counters = get_metrics()
+    logger.info("%s finished in %.3fs", command_name, elapsed)
+    for name, (count, total, maximum, _) in sorted(timers.items()):
+        records = counters.get(name + '.records')
+        if records is not None and total:
+            logger.info("%s: %s records in %.3fs (%.1f records/s)", name,
+                        records, total, records / total)
+        else:
+            logger.info("%s: %s calls in %.3fs (avg %.6fs, max %.6fs)",
+                        name, count, total, total / count, maximum)
+    for name, value in sorted(counters.items()):
+        logger.info("%s: %s", name, value)
+
+
+def render_prometheus(metrics):
+    """Renders timers as histograms and counters in the Prometheus text
+    exposition format.
+
+    :param metrics: dictionary of command name to (timers, counters) as
+    returned by get_metrics"""
+    lines = ['# TYPE xia_step_duration_seconds histogram']
+    for command_name, (timers, _) in sorted(metrics.items()):
+        for name, (count, total, _, buckets) in sorted(timers.items()):
+            labels = 'command="%s",step="%s"' % (command_name, name)
+            cumulative = 0
+            for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append('xia_step_duration_seconds_bucket{%s,le="%s"} '
+                             '%d' % (labels, bound, cumulative))
+            lines.append('xia_step_duration_seconds_bucket{%s,le="+Inf"} '
+                         '%d' % (labels, count))
+            lines.append('xia_step_duration_seconds_sum{%s} %f' %
+                         (labels, total))
+            lines.append('xia_step_duration_seconds_count{%s} %d' %
+                         (labels, count))
+    lines.append('# TYPE xia_step_max_seconds gauge')
+    for command_name, (timers, _) in sorted(metrics.items()):
+        for name, (_, _, maximum, _) in sorted(timers.items()):
+            lines.append('xia_step_max_seconds{command="%s",step="%s"} %f' %
+                         (command_name, name, maximum))
+    lines.append('# TYPE xia_events_total counter')
+    for command_name, (_, counters) in sorted(metrics.items()):
+        for name, value in sorted(counters.items()):
+            lines.append('xia_events_total{command="%s",event="%s"} %d' %
+                         (command_name, name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def format_prometheus(command_name):
+    """Renders the metrics of the running command in the Prometheus text
+    exposition format"""
+    return render_prometheus({command_name: get_metrics()})
+
+
+def write_prometheus_textfile(path, command_name):
+    """Writes the metrics for the node exporter textfile collector, renaming
+    a temporary file so a partial file is never scraped"""
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as file:
+        file.write(format_prometheus(command_name))
+    os.replace(temporary_path, path)
+
+
+def format_statsd(prefix):
+    """Renders the timers and counters as StatsD lines"""
+    timers, counters = get_metrics()
+    lines = []
+    for name, (count, total, _, _) in sorted(timers.items()):
+        lines.append('%s.%s:%d|ms' % (prefix, name, total * 1000))
+        lines.append('%s.%s.calls:%d|c' % (prefix, name, count))
+    for name, value in sorted(counters.items()):
+        lines.append('%s.%s:%d|c' % (prefix, name, value))
+    return lines
+
+
+def send_statsd(address, prefix):
+    """Sends the metrics to a StatsD server at host:port over UDP"""
+    host, _, port = address.rpartition(':')
+    packets = []
+    packet = ''
+    for line in format_statsd(prefix):
+        if packet and len(packet) + len(line) + 1 > STATSD_MAX_PACKET_SIZE:
+            packets.append(packet)
+            packet = ''
+        packet = packet + '\n' + line if packet else line
+    if packet:
+        packets.append(packet)
+
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for packet in packets:
+                sock.sendto(packet.encode('utf-8'), (host, int(port)))
+    except (OSError, ValueError) as e:
+        logger.warning("Unable to send metrics to StatsD at %s: %s", address,
+                       e)
+
+
+def flush_metrics(command_name):
+    """Adds the metrics of the running command to the totals stored in
+    StageMetric, which are served by the metrics view"""
+    timers, counters = get_metrics()
+    with transaction.atomic():
+        stored = {metric.name: metric for metric in
+                  StageMetric.objects.select_for_update().filter(
+                      command=command_name)}
+        for name, (count, total, maximum, buckets) in timers.items():
+            metric = stored.get(name) or StageMetric(
+                command=command_name, name=name, kind='timer')
+            # buckets stored with other bounds are started over
+            if len(metric.buckets) != len(buckets):
+                metric.buckets = [0] * len(buckets)
+            metric.count += count
+            metric.total_seconds += total
+            metric.max_seconds = max(metric.max_seconds, maximum)
+            metric.buckets = [stored_count + bucket_count for
+                              stored_count, bucket_count in
+                              zip(metric.buckets, buckets)]
+            metric.save()
+        for name, value in counters.items():
+            metric = stored.get(name) or StageMetric(
+                command=command_name, name=name, kind='counter')
+            metric.count += value
+            metric.save()
+
+
+def get_stored_metrics():
+    """Returns the metrics stored in StageMetric in the format of
+    render_prometheus"""
+    metrics = {}
+    for metric in StageMetric.objects.order_by('command', 'name'):
+        timers, counters = metrics.setdefault(metric.command, ({}, {}))
+        if metric.kind == 'timer':
+            timers[metric.name] = (metric.count, metric.total_seconds,
+                                   metric.max_seconds, metric.buckets)
+        else:
+            counters[metric.name] = metric.count
+    return metrics
+
+
+class InstrumentedCommand(BaseCommand):
+    """Management command logging a summary of its timers, counters and
+    validation findings at exit, the metrics optionally exported to a
+    Prometheus textfile or StatsD"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--metrics-textfile',
+                            default=getattr(settings,
+                                            'XIA_METRICS_TEXTFILE', None),
+                            help='Write metrics in the Prometheus text '
+                                 'format to this file')
+        parser.add_argument('--statsd',
+                            default=getattr(settings, 'XIA_STATSD_ADDRESS',
+                                            None),
+                            help='Send metrics to the StatsD server at '
+                                 'host:port')
+        parser.add_argument('--findings-table',
+                            default=getattr(settings, 'XIA_FINDINGS_TABLE',
+                                            None),
+                            help='Write the aggregated validation findings '
+                                 'to this CSV file')
+        parser.add_argument('--profile', nargs='?', const='cpu',
+                            choices=PROFILE_MODES,
+                            help='Profile the run with cProfile (cpu), '
+                                 'tracemalloc (memory) or both (all) and '
+                                 'write the reports next to the logs')
+        parser.add_argument('--profile-sample', type=float, default=100,
+                            help='Percentage of records profiled by '
+                                 'cProfile, the whole run is profiled at '
+                                 '100')
+        parser.add_argument('--profile-top', type=int, default=25,
+                            help='Number of allocation sites in the memory '
+                                 'report')
+
+    def get_command_name(self):
+        """Returns the name the command is run with"""
+        return self.__module__.rsplit('.', 1)[-1]
+
+    def execute(self, *args, **options):
+        """Runs the command and reports its metrics, even when it fails"""
+        reset_metrics()
+        reset_findings()
+        command_name = self.get_command_name()
+        if options.get('profile'):
+            start_profiling(options['profile'],
+                            options.get('profile_sample', 100))
+        start = time.perf_counter()
+        try:
+            return super().execute(*args, **options)
+        finally:
+            if options.get('profile'):
+                stop_profiling(command_name, options.get('profile_top', 25))
+            log_metrics_summary(command_name, time.perf_counter() - start)
+            log_findings_summary()
+            if options.get('findings_table'):
+                write_findings_table(options['findings_table'])
+            if options.get('metrics_textfile'):
+                write_prometheus_textfile(options['metrics_textfile'],
+                                          command_name)
+            if options.get('statsd'):
+                send_statsd(options['statsd'], 'xia.' + command_name)
+            try:
+                flush_metrics(command_name)
+                flush_findings()
+            except DatabaseError as e:
+                logger.warning("Unable to store metrics and findings of "
+                               "%s: %s", command_name, e)
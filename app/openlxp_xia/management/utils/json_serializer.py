@@ -0,0 +1,75 @@
+import json
+import logging
+import math
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger('dict_config_logger')
+
+# datetimes and dataclasses are passed through to the encoder default so
+# they come out exactly as DjangoJSONEncoder renders them; UUIDs are
+# natively rendered by orjson as str(uuid), matching DjangoJSONEncoder
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME |
+                  orjson.OPT_PASSTHROUGH_DATACLASS) if orjson else 0
+
+
+def use_orjson():
+    """Return whether orjson is installed and selected as JSON backend.
+
+    The backend is chosen with the XIA_JSON_BACKEND setting ('orjson' or
+    'json'), orjson being used by default whenever it is installed."""
+    return orjson is not None and \
+        getattr(settings, 'XIA_JSON_BACKEND', 'orjson') != 'json'
+
+
+def has_non_finite_float(data):
+    """Return whether data holds a NaN or infinite float"""
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, dict):
+        data = data.values()
+    elif not isinstance(data, (list, tuple)):
+        return False
+    return any(has_non_finite_float(value) for value in data)
+
+
+def dumps(data, cls=DjangoJSONEncoder):
+    """Serialize data to a JSON string, handling types such as UUIDs and
+    datetimes identically to the given encoder class.
+
+    orjson does not pad separators with whitespace. It renders non-finite
+    floats as null, so data holding them is serialized with the stdlib,
+    which renders NaN and Infinity, as is data orjson can not serialize
+    (e.g. non-string dictionary keys, integers beyond 64 bits)."""
+    if use_orjson():
+        try:
+            serialized = orjson.dumps(data, default=cls().default,
+                                      option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            logger.debug("orjson could not serialize data, falling back "
+                         "to json")
+        else:
+            # only data rendered with a null can hold non-finite floats
+            if b'null' not in serialized or \
+                    not has_non_finite_float(data):
+                return serialized.decode('utf-8')
+    return json.dumps(data, cls=cls)
+
+
+def loads(data, cls=None):
+    """Deserialize a JSON string or bytes, using orjson when no custom
+    decoder class is requested"""
+    if cls is None and use_orjson():
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson rejects NaN and Infinity which the stdlib accepts
+            logger.debug("orjson could not deserialize data, falling "
+                         "back to json")
+    return json.loads(data, cls=cls)
@@ -0,0 +1,9 @@
+from importlib import import_module
+
+from django.utils.functional import SimpleLazyObject
+
+
+def lazy_import(module_name):
+    """Returns a proxy of a module imported at its first use, keeping heavy
+    dependencies out of the startup of every command"""
+    return SimpleLazyObject(lambda: import_module(module_name))
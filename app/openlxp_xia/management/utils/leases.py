@@ -0,0 +1,105 @@
+import datetime
+import logging
+import os
+import socket
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = logging.getLogger('dict_config_logger')
+
+# ledger rows whose lease is set or released per query
+LEASE_BATCH_SIZE = 1000
+
+# identifies the leases of this process among the workers sharing the
+# ledgers
+WORKER_ID = '%s:%s:%s' % (socket.gethostname(), os.getpid(),
+                          uuid.uuid4().hex[:8])
+
+
+def get_lease_seconds():
+    """Returns how long claimed records stay leased to a worker, after
+    which workers that crashed lose them"""
+    return getattr(settings, 'XIA_LEASE_SECONDS', 3600)
+
+
+def get_pending_seconds():
+    """Returns how long a record stays Pending while it is POSTed to XIS,
+    after which a load interrupted in between is recovered"""
+    return getattr(settings, 'XIA_PENDING_SECONDS', 300)
+
+
+def get_pending_expires():
+    """Returns the time until which a record set to Pending now is left to
+    the load POSTing it"""
+    return timezone.now() + datetime.timedelta(seconds=get_pending_seconds())
+
+
+def set_leases(model, record_ids, owner, lease_expires):
+    """Leasing ledger rows to a worker in batches"""
+    for start in range(0, len(record_ids), LEASE_BATCH_SIZE):
+        model.objects.filter(
+            pk__in=record_ids[start:start + LEASE_BATCH_SIZE]).update(
+            lease_owner=owner, lease_expires=lease_expires)
+
+
+def claim_records(queryset, limit=None, owner=WORKER_ID):
+    """Leasing the rows of a ledger queryset which are not leased to
+    another worker, or whose lease expired, returning their primary keys.
+
+    Rows locked by a worker claiming at the same time are skipped, and rows
+    claimed longest ago come first so stuck rows never starve new ones."""
+    now = timezone.now()
+    with transaction.atomic():
+        claimable = queryset.filter(
+            Q(lease_owner='') | Q(lease_expires__lt=now)).order_by(
+            F('lease_expires').asc(nulls_first=True), 'pk').values_list(
+            'pk', flat=True).select_for_update(skip_locked=True)
+        if limit is not None:
+            claimable = claimable[:limit]
+        record_ids = list(claimable)
+        set_leases(queryset.model, record_ids, owner,
+                   now + datetime.timedelta(seconds=get_lease_seconds()))
+    if record_ids:
+        logger.debug("Claimed %s %s records", len(record_ids),
+                     queryset.model.__name__)
+    return record_ids
+
+
+def renew_leases(model, owner=WORKER_ID, record_ids=None):
+    """Extending the leases of the rows a worker is still processing, or of
+    the given rows only"""
+    leased = model.objects.filter(lease_owner=owner)
+    if record_ids is not None:
+        leased = leased.filter(pk__in=record_ids)
+    return leased.update(lease_expires=timezone.now() + datetime.timedelta(
+        seconds=get_lease_seconds()))
+
+
+def release_leases(model, owner=WORKER_ID):
+    """Releasing the rows leased to a worker, the lease expiry being kept
+    as the time they were last claimed"""
+    return model.objects.filter(lease_owner=owner).update(lease_owner='')
+
+
+def recover_pending_records(model, prefix):
+    """Setting the records left Pending by a load which died or exited
+    before XIS answered back to Ready, unless their pending lease or the
+    lease of the worker processing them is still running, returning the
+    number of records recovered"""
+    now = timezone.now()
+    status_field = prefix + '_transmission_status'
+    expires_field = prefix + '_pending_expires'
+    recovered = model.objects.filter(
+        Q(**{expires_field + '__lt': now}) |
+        Q(**{expires_field: None}),
+        Q(lease_owner='') | Q(lease_expires__lt=now),
+        **{status_field: 'Pending'}).update(
+        **{status_field: 'Ready', expires_field: None})
+    if recovered:
+        logger.warning("Recovered %s %s records left Pending by an "
+                       "interrupted load", recovered, model.__name__)
+    return recovered
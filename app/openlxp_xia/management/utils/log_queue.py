@@ -0,0 +1,77 @@
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# records queued before the oldest DEBUG records start being dropped
+DEFAULT_QUEUE_SIZE = 10000
+
+
+class LogRecordQueue(queue.Queue):
+    """Bounded queue of log records dropping the oldest DEBUG record when a
+    DEBUG record arrives while it is full, records above DEBUG wait for
+    room instead"""
+
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE):
+        super().__init__(maxsize)
+        self.dropped = 0
+
+    def put_dropping_oldest(self, record):
+        """Queues a record without blocking, dropping the oldest queued
+        record when it is a DEBUG record or the new one otherwise"""
+        with self.not_full:
+            if 0 < self.maxsize <= self._qsize():
+                self.dropped += 1
+                oldest = self.queue[0]
+                if oldest is None or oldest.levelno > logging.DEBUG:
+                    return
+                self.queue.popleft()
+            self._put(record)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+
+class LogQueueListener(QueueListener):
+    """Queue listener waiting for room in a bounded queue to stop"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class XIAQueueHandler(QueueHandler):
+    """Handler passing records to its target handlers on a background
+    thread, so formatting and I/O stay out of the command loops.
+
+    Configured in settings.LOGGING after its targets, which are given as
+    cfg://handlers.<name> references:
+
+        'queue': {
+            'class': 'openlxp_xia.management.utils.log_queue.XIAQueueHandler',
+            'targets': ['cfg://handlers.console', 'cfg://handlers.file_logs'],
+            'queue_size': 10000,
+        }
+    """
+
+    def __init__(self, targets, queue_size=DEFAULT_QUEUE_SIZE):
+        super().__init__(LogRecordQueue(queue_size))
+        # indexing the list resolves the cfg:// references to the handlers
+        self.targets = [targets[ind] for ind in range(len(targets))]
+        self.listener = LogQueueListener(self.queue, *self.targets,
+                                         respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record):
+        # records never leave the process, they are formatted by the
+        # target handlers on the listener thread
+        return record
+
+    def enqueue(self, record):
+        if record.levelno <= logging.DEBUG:
+            self.queue.put_dropping_oldest(record)
+        else:
+            self.queue.put(record)
+
+    def close(self):
+        """Writes out the queued records before closing"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
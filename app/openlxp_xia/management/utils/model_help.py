@@ -1,9 +1,179 @@
-import bleach
+import collections
+import functools
+import json
 import logging
-from confusable_homoglyphs import categories, confusables
+import re
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models.fields.json import KeyTransform
+
+from openlxp_xia.management.utils.json_serializer import dumps, loads
+from openlxp_xia.management.utils.lazy_import import lazy_import
+
+bleach = lazy_import('bleach')
+categories = lazy_import('confusable_homoglyphs.categories')
+confusables = lazy_import('confusable_homoglyphs.confusables')
 
 logger = logging.getLogger('dict_config_logger')
 
+# characters bleach.clean escapes, strips or replaces; strings without any of
+# them come back from bleach.clean unchanged
+BLEACH_UNSAFE_CHARACTERS = re.compile(r'[\x00-\x08\x0b-\x1f&<>]')
+
+# strings repeated across records (names, codes, categories) are short; only
+# strings up to this length are cached, which keeps the caches to a few MB
+# instead of pinning long descriptions in memory
+CACHED_STRING_LENGTH = 256
+STRING_CACHE_SIZE = 8192
+
+# field path and script aliases of a string with dangerous homoglyphs
+HomoglyphFinding = collections.namedtuple('HomoglyphFinding',
+                                          ['field_path', 'aliases'])
+
+
+class LedgerJSONField(models.JSONField):
+    """JSONField reading and writing through the XIA JSON serializer
+    backend, which uses orjson when it is installed"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('encoder', DjangoJSONEncoder)
+        super().__init__(*args, **kwargs)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+        return dumps(value, cls=self.encoder)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        # Some backends (SQLite at least) extract non-string values in
+        # their SQL datatypes.
+        if isinstance(expression, KeyTransform) and not isinstance(value,
+                                                                   str):
+            return value
+        try:
+            return loads(value, cls=self.decoder)
+        except json.JSONDecodeError:
+            return value
+
+
+@functools.lru_cache(maxsize=STRING_CACHE_SIZE)
+def bleach_clean_string(value):
+    """Bleach/clean HTML tags from a string, caching results for strings
+    repeated across records"""
+    return bleach.clean(value, tags={}, strip=True)
+
+
+def clean_string(value):
+    """Clean HTML tags from a string, skipping bleach for strings it would
+    return unchanged"""
+    if BLEACH_UNSAFE_CHARACTERS.search(value) is None:
+        return value
+    # results are only cached for short strings repeated across records
+    if len(value) > CACHED_STRING_LENGTH:
+        return bleach_clean_string.__wrapped__(value)
+    return bleach_clean_string(value)
+
+
+@functools.lru_cache(maxsize=STRING_CACHE_SIZE)
+def get_homoglyph_aliases(value):
+    """Returns the sorted script aliases of a string when it has dangerous
+    homoglyphs, None otherwise, caching verdicts for repeated strings"""
+    if not confusables.is_dangerous(value):
+        return None
+    return tuple(sorted(categories.unique_aliases(value)))
+
+
+def get_dangerous_homoglyph_aliases(value):
+    """Checks a string for dangerous homoglyphs. ASCII strings only hold
+    LATIN and COMMON characters, which can never be mixed-script, so they
+    are never dangerous and skip the check."""
+    if value.isascii():
+        return None
+    # verdicts are only cached for short strings repeated across records
+    if len(value) > CACHED_STRING_LENGTH:
+        return get_homoglyph_aliases.__wrapped__(value)
+    return get_homoglyph_aliases(value)
+
+
+def join_field_path(path, key):
+    """Joins a dictionary key or list index to a field path"""
+    if isinstance(key, int):
+        return '%s[%d]' % (path, key)
+    return '%s.%s' % (path, key) if path else str(key)
+
+
+def log_homoglyph_findings(findings):
+    """Logs the fields holding dangerous homoglyphs"""
+    for finding in findings:
+        logger.error("Field %s has homoglyphs mixing the scripts %s",
+                     finding.field_path, ', '.join(finding.aliases))
+
+
+def find_homoglyphs(value, path='', findings=None):
+    """Recursive function finding the strings with dangerous homoglyphs in
+    dictionaries and lists.
+
+    :return: list of HomoglyphFinding"""
+    if findings is None:
+        findings = []
+    if isinstance(value, str):
+        aliases = get_dangerous_homoglyph_aliases(value)
+        if aliases:
+            findings.append(HomoglyphFinding(path, aliases))
+    elif isinstance(value, dict):
+        for key in value:
+            find_homoglyphs(value[key], join_field_path(path, key), findings)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            find_homoglyphs(item, join_field_path(path, index), findings)
+    return findings
+
+
+def sanitize_value(value, path, findings):
+    """Recursive function checking strings for dangerous homoglyphs and
+    cleaning their HTML tags in a single walk of dictionaries and lists"""
+    if isinstance(value, str):
+        aliases = get_dangerous_homoglyph_aliases(value)
+        if aliases:
+            findings.append(HomoglyphFinding(path, aliases))
+        return clean_string(value)
+    if isinstance(value, dict):
+        for key in value:
+            value[key] = sanitize_value(value[key],
+                                        join_field_path(path, key), findings)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            value[index] = sanitize_value(item, join_field_path(path, index),
+                                          findings)
+    return value
+
+
+def sanitize_metadata(data):
+    """Checks metadata for dangerous homoglyphs and bleach/cleans HTML tags
+    from its strings, walking the metadata once.
+
+    :param data: metadata to sanitize.
+    WARNING dictionaries and lists in data will be edited
+    :return: tuple of the sanitized data and the list of HomoglyphFinding,
+    empty when the data is free of dangerous homoglyphs"""
+    findings = []
+    data = sanitize_value(data, '', findings)
+    log_homoglyph_findings(findings)
+    return data, findings
+
+
+def sanitize_metadata_batch(records):
+    """Sanitizes a batch of metadata records.
+
+    :param records: iterable of metadata to sanitize.
+    WARNING dictionaries and lists in records will be edited
+    :return: list of tuples of sanitized data and its HomoglyphFinding
+    list"""
+    return [sanitize_metadata(data) for data in records]
+
 
 def bleach_data_to_json(rdata):
     """Recursive function to bleach/clean HTML tags from string
@@ -17,7 +187,7 @@ def bleach_data_to_json(rdata):
     for key in rdata:
         # if string, clean
         if isinstance(rdata[key], str):
-            rdata[key] = bleach.clean(rdata[key], tags={}, strip=True)
+            rdata[key] = clean_string(rdata[key])
         # if dict, enter dict
         if isinstance(rdata[key], dict):
             rdata[key] = bleach_data_to_json(rdata[key])
@@ -27,19 +197,6 @@ def bleach_data_to_json(rdata):
 
 def confusable_homoglyphs_check(data):
     """Checks for dangerous homoglyphs."""
-
-    data_is_safe = True
-    for key in data:
-
-        # if string, Check homoglyph
-        if isinstance(data[key], str) and bool(confusables.
-                                               is_dangerous(data[key])):
-            data_is_safe = False
-            logger.info("Homoglyphs does not have the expected prefered alias")
-            logger.error(categories.unique_aliases(data[key]))
-        # if dict, enter dict
-        if isinstance(data[key], dict):
-            ret_val = confusable_homoglyphs_check(data[key])
-            if not ret_val:
-                data_is_safe = False
-    return data_is_safe
+    findings = find_homoglyphs(data)
+    log_homoglyph_findings(findings)
+    return not findings
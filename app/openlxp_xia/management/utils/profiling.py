@@ -0,0 +1,131 @@
+import cProfile
+import contextlib
+import logging
+import os
+import pstats
+import random
+import threading
+import tracemalloc
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger('dict_config_logger')
+
+PROFILE_MODES = ('cpu', 'memory', 'all')
+
+# profiler of the running command, None when it is not profiled
+_profiler = None
+# fraction of records profiled, below 1 the profiler only runs while a
+# sampled record is processed
+_sample_rate = 1.0
+# a profiler can only run in one thread at a time, records of the other
+# pipeline threads are skipped meanwhile
+_sample_lock = threading.Lock()
+# profilers of the pipeline threads, merged into the profile of the command
+# when it is written
+_thread_profilers = []
+
+
+def start_profiling(mode, sample_percent=100):
+    """Starts cProfile and/or tracemalloc for the running command.
+
+    :param mode: 'cpu' for cProfile, 'memory' for tracemalloc or 'all'
+    :param sample_percent: percentage of records profiled by cProfile, the
+    whole run is profiled at 100"""
+    global _profiler, _sample_rate
+    if mode in ('cpu', 'all'):
+        _profiler = cProfile.Profile()
+        _sample_rate = min(max(sample_percent, 0), 100) / 100
+        if _sample_rate >= 1:
+            _profiler.enable()
+    if mode in ('memory', 'all'):
+        # a single frame is enough to group allocations by line and keeps
+        # the tracing overhead low
+        tracemalloc.start(1)
+
+
+@contextlib.contextmanager
+def profile_thread():
+    """Profiles the calling thread with its own profiler while the whole
+    run is profiled, as a profiler only records the thread enabling it"""
+    if _profiler is None or _sample_rate < 1:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _thread_profilers.append(profiler)
+
+
+def get_profile_dir():
+    """Returns the directory of the log file, where profiles are written"""
+    log_path = getattr(settings, 'LOG_PATH', None)
+    return os.path.dirname(os.path.abspath(log_path)) if log_path \
+        else os.getcwd()
+
+
+def write_allocation_report(file_path, snapshot, peak, top):
+    """Writes the lines allocating the most memory"""
+    statistics = snapshot.statistics('lineno')
+    with open(file_path, 'w') as file:
+        file.write('Peak traced memory: %.1f KiB\n' % (peak / 1024))
+        file.write('Top %s allocations by line:\n' % top)
+        for statistic in statistics[:top]:
+            file.write('%s\n' % statistic)
+
+
+def stop_profiling(command_name, top=25):
+    """Stops the profilers and writes a .pstats file and an allocation
+    report next to the logs.
+
+    :return: list of the written file paths"""
+    global _profiler, _sample_rate
+    file_prefix = os.path.join(get_profile_dir(), '%s-%s' % (
+        command_name, timezone.now().strftime('%Y%m%dT%H%M%S')))
+    written = []
+
+    if _profiler is not None:
+        _profiler.disable()
+        if _thread_profilers:
+            stats = pstats.Stats(_profiler, *_thread_profilers)
+            stats.dump_stats(file_prefix + '.pstats')
+        else:
+            _profiler.dump_stats(file_prefix + '.pstats')
+        written.append(file_prefix + '.pstats')
+        _profiler = None
+        _sample_rate = 1.0
+        _thread_profilers.clear()
+
+    if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        write_allocation_report(file_prefix + '-allocations.txt', snapshot,
+                                peak, top)
+        written.append(file_prefix + '-allocations.txt')
+
+    for file_path in written:
+        logger.info("Profile of %s written to %s", command_name, file_path)
+    return written
+
+
+def profile_records(records):
+    """Yields records, running the profiler while a sampled record is
+    processed when the command profiles a sample of its records"""
+    for record in records:
+        profiler = _profiler
+        if profiler is None or _sample_rate >= 1 or \
+                random.random() >= _sample_rate or \
+                not _sample_lock.acquire(blocking=False):
+            yield record
+            continue
+        profiler.enable()
+        try:
+            yield record
+        finally:
+            profiler.disable()
+            _sample_lock.release()
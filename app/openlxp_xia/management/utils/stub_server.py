@@ -0,0 +1,176 @@
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger('dict_config_logger')
+
+API_PREFIX = '/api/'
+LEDGER_ENDPOINTS = ('metadata/', 'supplemental-data/')
+
+
+class StubServerSettings:
+    """Behaviour of the stub XSS/XIS server, changeable while it runs.
+
+    latency: seconds every response is delayed by
+    error_rate: fraction of ledger POSTs answered with 500
+    throttle_rate: fraction of ledger POSTs answered with 429
+    schemas: dictionary of schema name or IRI to schema
+    mappings: dictionary of (target name or IRI, source name or IRI) to
+    schema mapping"""
+
+    def __init__(self, latency=0, error_rate=0, throttle_rate=0,
+                 schemas=None, mappings=None, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.schemas = schemas or {}
+        self.mappings = mappings or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'records': 0, 'created': 0,
+                      'errors': 0, 'throttled': 0}
+
+    def count(self, stat, value=1):
+        """Increments a request statistic"""
+        with self.lock:
+            self.stats[stat] += value
+
+    def draw(self):
+        """Returns a random number deciding the fate of a POST"""
+        with self.lock:
+            return self.random.random()
+
+
+def get_query_value(query, *names):
+    """Returns the first query parameter present among names"""
+    for name in names:
+        if name in query:
+            return query[name][0]
+    return None
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """Serves the XSS schema and mapping endpoints and the XIS ledger
+    endpoints used by XIA"""
+
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def settings(self):
+        return self.server.stub_settings
+
+    def send_json(self, status, data, headers=None):
+        """Sends a JSON response after the configured latency"""
+        if self.settings.latency:
+            time.sleep(self.settings.latency)
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def decode_body(self, body):
+        """Decompresses the request body when it is encoded"""
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            return gzip.decompress(body)
+        if encoding == 'zstd':
+            import zstandard
+            return zstandard.ZstdDecompressor().decompress(body)
+        return body
+
+    def do_GET(self):
+        self.settings.count('requests')
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == API_PREFIX + 'schemas/':
+            schema = self.settings.schemas.get(
+                get_query_value(query, 'name', 'iri'))
+            if schema is None:
+                return self.send_json(404, {'message': 'Schema not found'})
+            return self.send_json(200, {'schema': schema})
+        if url.path == API_PREFIX + 'mappings/':
+            mapping = self.settings.mappings.get(
+                (get_query_value(query, 'targetName', 'targetIRI'),
+                 get_query_value(query, 'sourceName', 'sourceIRI')))
+            if mapping is None:
+                return self.send_json(404, {'message': 'Mapping not found'})
+            return self.send_json(200, {'schema_mapping': mapping})
+        return self.send_json(404, {'message': 'Not found'})
+
+    def do_POST(self):
+        self.settings.count('requests')
+        # the body is always read so the connection can be kept alive
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = urlsplit(self.path).path
+        if not path.startswith(API_PREFIX) or \
+                path[len(API_PREFIX):] not in LEDGER_ENDPOINTS:
+            return self.send_json(404, {'message': 'Not found'})
+
+        try:
+            data = json.loads(self.decode_body(body))
+        except (ValueError, OSError, ImportError):
+            return self.send_json(415, {'message': 'Unsupported body'})
+        # a list of records is accepted as a batch
+        records = len(data) if isinstance(data, list) else 1
+        self.settings.count('records', records)
+
+        draw = self.settings.draw()
+        if draw < self.settings.throttle_rate:
+            self.settings.count('throttled')
+            return self.send_json(429, {'message': 'Too many requests'},
+                                  {'Retry-After': '1'})
+        if draw < self.settings.throttle_rate + self.settings.error_rate:
+            self.settings.count('errors')
+            return self.send_json(500, {'message': 'Internal error'})
+
+        self.settings.count('created', records)
+        if isinstance(data, list):
+            return self.send_json(201, [{'status': 201} for _ in data])
+        return self.send_json(201, data)
+
+    def log_message(self, format, *args):
+        logger.debug("Stub server: " + format, *args)
+
+
+class StubServer:
+    """Local stub XSS/XIS server served from a daemon thread, used as a
+    context manager.
+
+    The XSS API of XIAConfiguration is the url attribute and the XIS
+    endpoints are url + 'metadata/' and url + 'supplemental-data/'."""
+
+    def __init__(self, host='127.0.0.1', port=0, **settings):
+        self.stub_settings = StubServerSettings(**settings)
+        self.server = ThreadingHTTPServer((host, port), StubRequestHandler)
+        self.server.daemon_threads = True
+        self.server.stub_settings = self.stub_settings
+        self.url = 'http://%s:%s%s' % (host, self.server.server_port,
+                                       API_PREFIX)
+        self.thread = None
+
+    def start(self):
+        """Serves requests in a background thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='stub-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving requests and closes the socket"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
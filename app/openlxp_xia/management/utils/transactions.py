@@ -0,0 +1,115 @@
+import contextlib
+import logging
+import signal
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from openlxp_xia.management.utils.instrumentation import increment
+
+logger = logging.getLogger('dict_config_logger')
+
+
+def get_commit_interval():
+    """Returns the number of records whose ledger writes are committed
+    together"""
+    return getattr(settings, 'XIA_COMMIT_INTERVAL', 500)
+
+
+@contextlib.contextmanager
+def exit_on_sigterm():
+    """Raising SystemExit on SIGTERM, so the ledger writes of the records
+    processed before are committed and a load run again resumes after
+    them"""
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def request_exit(signum, frame):
+        raise SystemExit('Exiting! Received signal %s.' % signum)
+
+    previous_handler = signal.signal(signal.SIGTERM, request_exit)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+
+
+@contextlib.contextmanager
+def record_writes(stage, record):
+    """Makes the ledger writes of a record in autocommit, each committed as
+    it is made, logging and skipping the record on a database error.
+
+    Used by the loaders so no transaction or row lock is held across a POST
+    to XIS, and a status XIS acknowledged is never rolled back."""
+    try:
+        yield
+    except DatabaseError:
+        logger.exception("%s: writes of record %s failed", stage, record)
+        increment(stage + '.write_errors')
+
+
+class CommitBatch:
+    """Groups the ledger writes of a stage into transactions committed every
+    commit interval records, the writes of each record being made in a
+    savepoint so a database error only rolls back that record.
+
+        with CommitBatch('validate_source') as batch:
+            for record in records:
+                with batch.record(record_key):
+                    store(record)
+    """
+
+    def __init__(self, stage, commit_interval=None):
+        self.stage = stage
+        self.commit_interval = commit_interval or get_commit_interval()
+        self.records = 0
+        self.atomic = None
+
+    def begin(self):
+        self.atomic = transaction.atomic()
+        self.atomic.__enter__()
+        self.records = 0
+
+    def commit(self):
+        self.atomic.__exit__(None, None, None)
+        self.atomic = None
+        increment(self.stage + '.commits')
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the transaction may be unusable after a database error raised
+        # outside of a record, otherwise the writes made before the error
+        # are committed as they were without batching
+        if exc_type is not None and issubclass(exc_type, DatabaseError):
+            self.atomic.__exit__(exc_type, exc_value, traceback)
+            self.atomic = None
+        else:
+            self.commit()
+        return False
+
+    @contextlib.contextmanager
+    def record(self, record):
+        """Makes the ledger writes of a record in a savepoint, rolled back
+        and logged on a database error"""
+        savepoint_id = transaction.savepoint()
+        try:
+            yield
+        except DatabaseError:
+            transaction.savepoint_rollback(savepoint_id)
+            logger.exception("%s: writes of record %s rolled back",
+                             self.stage, record)
+            increment(self.stage + '.rolled_back')
+        except BaseException:
+            transaction.savepoint_commit(savepoint_id)
+            raise
+        else:
+            transaction.savepoint_commit(savepoint_id)
+        self.records += 1
+        if self.records >= self.commit_interval:
+            self.commit()
+            self.begin()
@@ -1,14 +1,25 @@
 import datetime
 import hashlib
 import logging
-from distutils.util import strtobool
 
-from dateutil.parser import parse
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q
 
-from openlxp_xia.models import XIAConfiguration
+from openlxp_xia.management.utils.findings import record_finding
+from openlxp_xia.management.utils.lazy_import import lazy_import
+from openlxp_xia.models import ValueNormalizationRule, XIAConfiguration
+
+dateutil_parser = lazy_import('dateutil.parser')
 
 logger = logging.getLogger('dict_config_logger')
 
+# string representations of truth accepted for bool overwritten values
+TRUE_VALUES = ('y', 'yes', 't', 'true', 'on', '1')
+FALSE_VALUES = ('n', 'no', 'f', 'false', 'off', '0')
+
+# target fields identifying a record when XIA is not configured
+DEFAULT_TARGET_KEY_FIELDS = 'Course.CourseCode,Course.CourseProviderName'
+
 
 def get_publisher_detail():
     """Retrieve publisher from XIA configuration """
@@ -24,97 +35,105 @@ def get_key_dict(key_value, key_value_hash):
     return key
 
 
+def get_normalization_plan():
+    """Compiling the ValueNormalizationRule table into a dictionary of
+    (section, field) to a dictionary of input value to normalized value"""
+    normalization_plan = {}
+    for rule in ValueNormalizationRule.objects.order_by('pk'):
+        section, _, field = rule.target_field_path.partition('.')
+        replacements = normalization_plan.setdefault((section, field), {})
+        for input_value in rule.input_values:
+            replacements[input_value] = rule.output_value
+    return normalization_plan
+
+
 def replace_field_on_target_schema(ind1,
-                                   target_data_dict):
-    """Replacing values in field referring target schema EducationalContext to
-    course.MANDATORYTRAINING"""
-
-    target_name = {
-        "Course": [
-            "EducationalContext",
-        ]
-    }
-    for target_section_name in target_name:
-        for target_field_name in target_name[target_section_name]:
-            if target_data_dict[ind1][target_section_name]. \
-                    get(target_field_name):
-
-                if target_data_dict[ind1][target_section_name][
-                    target_field_name] == 'y' or \
-                        target_data_dict[ind1][
-                            target_section_name][
-                            target_field_name] == 'Y':
-                    target_data_dict[ind1][
-                        target_section_name][
-                        target_field_name] = 'Mandatory'
-                else:
-                    if target_data_dict[ind1][
-                        target_section_name][
-                        target_field_name] == 'n' or \
-                            target_data_dict[ind1][
-                                target_section_name][
-                                target_field_name] == 'N':
-                        target_data_dict[ind1][
-                            target_section_name][
-                            target_field_name] = 'Non - ' \
-                                                 'Mandatory'
-
-
-def get_target_metadata_key_value(data_dict):
+                                   target_data_dict,
+                                   normalization_plan=None):
+    """Replacing values of target fields with their normalized values, such
+    as y/n in Course.EducationalContext with Mandatory/Non - Mandatory"""
+    if normalization_plan is None:
+        normalization_plan = get_normalization_plan()
+    record = target_data_dict[ind1]
+    for (section, field), replacements in normalization_plan.items():
+        fields = record.get(section)
+        if not fields or field not in fields:
+            continue
+        try:
+            fields[field] = replacements.get(fields[field], fields[field])
+        # lists and objects are never normalized
+        except TypeError:
+            pass
+
+
+def get_target_key_fields():
+    """Compiling the target fields identifying a record, configured in
+    XIAConfiguration, into a tuple of (section, field)"""
+    xia_data = XIAConfiguration.objects.first()
+    key_fields = DEFAULT_TARGET_KEY_FIELDS
+    if xia_data is not None and xia_data.target_key_fields:
+        key_fields = xia_data.target_key_fields
+    target_key_fields = tuple(tuple(item.strip().split('.', 1))
+                              for item in key_fields.split(',')
+                              if item.strip())
+    for key_field in target_key_fields:
+        if len(key_field) != 2 or not all(key_field):
+            raise ImproperlyConfigured(
+                'Target key field "' + '.'.join(key_field) + '" of the XIA '
+                'configuration is not written as Section.Field')
+    return target_key_fields
+
+
+def get_key_digest(key_value):
+    """Creating the compact digest of a key value indexed in the ledgers"""
+    return hashlib.blake2b(key_value.encode('utf-8'),
+                           digest_size=16).hexdigest()
+
+
+def get_key_filter(prefix, key_value_hash, key_value_digest=None):
+    """Returns the lookup of a ledger record by its key digest, or by its
+    key hash for records stored without a digest, such as records written
+    by other extractors"""
+    if not key_value_digest:
+        return Q(**{prefix + '_key_hash': key_value_hash})
+    return Q(**{prefix + '_key_digest': key_value_digest}) | Q(
+        **{prefix + '_key_digest': '', prefix + '_key_hash': key_value_hash})
+
+
+def get_target_metadata_key_value(data_dict, key_fields=None):
     """Function to create key value for target metadata """
-    field = {
-        "Course": [
-            "CourseCode",
-            "CourseProviderName"
-        ]
-    }
+    if key_fields is None:
+        key_fields = get_target_key_fields()
 
     field_values = []
 
-    for item_section in field:
-        for item_name in field[item_section]:
-            if not data_dict[item_section].get(item_name):
-                logger.info('Field name ' + item_name + ' is missing for '
-                                                        'key creation')
-            field_values.append(data_dict[item_section].get(item_name))
+    for item_section, item_name in key_fields:
+        value = data_dict.get(item_section, {}).get(item_name)
+        if not value:
+            logger.info('Field name %s is missing for key creation',
+                        item_name)
+        field_values.append(value)
 
     # Key value creation for source metadata
     key_value = '_'.join(field_values)
 
-    # Key value hash creation for source metadata
+    # Key value hash creation for source metadata, sent to XIS
     key_value_hash = hashlib.sha512(key_value.encode('utf-8')).hexdigest()
 
     # Key dictionary creation for source metadata
     key = get_key_dict(key_value, key_value_hash)
+    key['key_value_digest'] = get_key_digest(key_value)
 
     return key
 
 
-def required_recommended_logs(id_num, category, field):
-    """logs the missing required and recommended """
-
-    # Logs the missing required columns
-    if category == 'Required':
-        logger.error(
-            "Record " + str(
-                id_num) + " does not have all " + category +
-            " fields."
-            + field + " field is empty")
-
-    # Logs the missing recommended columns
-    if category == 'Recommended':
-        logger.warning(
-            "Record " + str(
-                id_num) + " does not have all " + category +
-            " fields."
-            + field + " field is empty")
-
-    # Logs the inaccurate datatype columns
-    if category == 'datatype':
-        logger.warning(
-            "Record " + str(
-                id_num) + " does not have the expected " + category +
-            " for the field " + field)
+def required_recommended_logs(id_num, category, field,
+                              stage='validation'):
+    """Counts a missing required or recommended field or an inaccurate
+    datatype, the findings being summarized at the end of the command"""
+    record_finding(stage, category, field, id_num)
+    logger.debug("Record %s: %s finding for field %s", id_num, category,
+                 field)
 
 
 def is_date(string, fuzzy=False):
@@ -125,8 +144,14 @@ def is_date(string, fuzzy=False):
     :param fuzzy: bool, ignore unknown tokens in string if True
     """
     if isinstance(string, str):
+        # ISO 8601 dates, the usual case, are checked without dateutil
+        try:
+            datetime.datetime.fromisoformat(string)
+            return True
+        except ValueError:
+            pass
         try:
-            parse(string, fuzzy=fuzzy)
+            dateutil_parser.parse(string, fuzzy=fuzzy)
             return True
 
         except ValueError:
@@ -238,6 +263,17 @@ def convert_date_to_isoformat(date):
     return date
 
 
+def strtobool(value):
+    """Converts a string representation of truth to 1 or 0 like
+    distutils.util.strtobool, whose import pulls in setuptools"""
+    value = value.lower()
+    if value in TRUE_VALUES:
+        return 1
+    if value in FALSE_VALUES:
+        return 0
+    raise ValueError("invalid truth value %r" % (value,))
+
+
 def type_cast_overwritten_values(field_type, field_value):
     """function to check type of overwritten value and convert it into
     required format"""
@@ -247,36 +283,30 @@ def type_cast_overwritten_values(field_type, field_value):
             try:
                 value = int(field_value)
             except ValueError:
-                logger.error("Field Value " + field_value +
-                             " and Field Data type " + field_type +
-                             " is not valid")
+                logger.error("Field Value %s and Field Data type %s "
+                             "is not valid", field_value, field_type)
             except TypeError:
-                logger.error("Field Value " + field_value +
-                             " and Field Data type " + field_type +
-                             " do not match")
+                logger.error("Field Value %s and Field Data type %s "
+                             "do not match", field_value, field_type)
 
         if field_type == "bool":
             try:
                 value = strtobool(field_value)
             except ValueError:
-                logger.error("Field Value " + field_value +
-                             " and Field Data type " + field_type +
-                             " is not valid")
+                logger.error("Field Value %s and Field Data type %s "
+                             "is not valid", field_value, field_type)
             except TypeError:
-                logger.error("Field Value " + field_value +
-                             " and Field Data type " + field_type +
-                             " do not match")
+                logger.error("Field Value %s and Field Data type %s "
+                             "do not match", field_value, field_type)
         if field_type == "datetime":
             try:
                 is_date(field_value)
             except ValueError:
-                logger.error("Field Value " + field_value +
-                             " and Field Data type " + field_type +
-                             " is not valid")
+                logger.error("Field Value %s and Field Data type %s "
+                             "is not valid", field_value, field_type)
             except TypeError:
-                logger.error("Field Value " + field_value +
-                             " and Field Data type " + field_type +
-                             " do not match")
+                logger.error("Field Value %s and Field Data type %s "
+                             "do not match", field_value, field_type)
     else:
         return None
 
@@ -1,12 +1,59 @@
+import gzip
 import logging
 
 import requests
+from django.conf import settings
 from requests.auth import AuthBase
 
+from openlxp_xia.management.utils.leases import get_pending_seconds
 from openlxp_xia.models import XISConfiguration
 
 logger = logging.getLogger('dict_config_logger')
 
+# gzip level 6 keeps most of the size reduction of level 9 at a fraction
+# of the CPU cost
+GZIP_COMPRESSION_LEVEL = 6
+ZSTD_COMPRESSION_LEVEL = 3
+
+# endpoints which answered 415 to a compressed body, sent uncompressed from
+# then on for the lifetime of the process
+uncompressed_endpoints = set()
+
+# session keeping connections to XIS open between requests, used by long
+# running processes such as the worker
+_session = None
+
+
+def open_xis_session():
+    """Sends the following XIS requests through a session reusing its
+    connections"""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def close_xis_session():
+    """Closes the connections of the XIS session"""
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+
+
+def get_xis_http_client():
+    """Returns the XIS session when one is open, or requests"""
+    return _session or requests
+
+
+def get_xis_timeout():
+    """Returns the seconds XIS is waited on to connect and to answer. A
+    record stays Pending while it is POSTed, so the timeout is kept short
+    enough for two POSTs (the second one when XIS refuses a compressed
+    body) to end before the record is recovered and POSTed again"""
+    return min(getattr(settings, 'XIA_XIS_TIMEOUT', 60),
+               get_pending_seconds() / 4)
+
 
 def get_xis_metadata_api_endpoint():
     """Retrieve xis metadata api endpoint from XIS configuration """
@@ -27,25 +74,78 @@ def get_xis_supplemental_metadata_api_endpoint():
     return xis_supplemental_api_endpoint
 
 
+def compress_request_body(renamed_data, compression):
+    """Compress request body with the configured algorithm and return the
+    body along with the matching Content-Encoding value (None when the body
+    is sent uncompressed)"""
+    if not compression or compression == 'none':
+        return renamed_data, None
+
+    if isinstance(renamed_data, str):
+        renamed_data = renamed_data.encode('utf-8')
+
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            logger.warning("zstandard is not installed, falling back to "
+                           "gzip compression")
+        else:
+            compressor = zstandard.ZstdCompressor(
+                level=ZSTD_COMPRESSION_LEVEL)
+            return compressor.compress(renamed_data), 'zstd'
+
+    return gzip.compress(renamed_data,
+                         compresslevel=GZIP_COMPRESSION_LEVEL), 'gzip'
+
+
+def post_to_xis(url, renamed_data, compression):
+    """POST data to XIS, compressing the body when configured and resending
+    it uncompressed if XIS does not accept the encoding"""
+    headers = {'Content-Type': 'application/json'}
+
+    if url in uncompressed_endpoints:
+        compression = None
+    body, content_encoding = compress_request_body(renamed_data, compression)
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+
+    http_client = get_xis_http_client()
+    timeout = get_xis_timeout()
+    xis_response = http_client.post(url=url, data=body, headers=headers,
+                                    auth=TokenAuth(), timeout=timeout)
+
+    if content_encoding and xis_response.status_code == 415:
+        logger.warning("XIS endpoint %s does not accept %s encoded "
+                       "requests, sending uncompressed", url,
+                       content_encoding)
+        uncompressed_endpoints.add(url)
+        xis_response = http_client.post(url=url, data=renamed_data,
+                                        headers={'Content-Type':
+                                                 'application/json'},
+                                        auth=TokenAuth(), timeout=timeout)
+    return xis_response
+
+
 def posting_metadata_ledger_to_xis(renamed_data):
     """This function post data to XIS and returns the XIS response to
             XIA load_target_metadata() """
-    headers = {'Content-Type': 'application/json'}
+    xis_data = XISConfiguration.objects.first()
 
-    xis_response = requests.post(url=get_xis_metadata_api_endpoint(),
-                                 data=renamed_data, headers=headers,
-                                 auth=TokenAuth())
+    xis_response = post_to_xis(xis_data.xis_metadata_api_endpoint,
+                               renamed_data,
+                               xis_data.xis_metadata_compression)
     return xis_response
 
 
 def posting_supplemental_metadata_to_xis(renamed_data):
     """This function post data to XIS and returns the XIS response to
             XIA load_target_metadata() """
-    headers = {'Content-Type': 'application/json'}
+    xis_data = XISConfiguration.objects.first()
 
-    xis_response = requests.post(
-        url=get_xis_supplemental_metadata_api_endpoint(), data=renamed_data,
-        headers=headers, auth=TokenAuth())
+    xis_response = post_to_xis(xis_data.xis_supplemental_api_endpoint,
+                               renamed_data,
+                               xis_data.xis_supplemental_compression)
     return xis_response
 
 
@@ -2,6 +2,7 @@ import logging
 
 import requests
 
+from openlxp_xia.management.utils.instrumentation import timer
 from openlxp_xia.management.utils.xia_internal import dict_flatten
 from openlxp_xia.models import XIAConfiguration
 
@@ -14,6 +15,7 @@ def xss_get():
     return conf.xss_api
 
 
+@timer('xss.fetch_schema')
 def read_json_data(source_schema_ref, target_schema_ref=None):
     """get schema from xss and ingest as dictionary values"""
     xss_host = xss_get()
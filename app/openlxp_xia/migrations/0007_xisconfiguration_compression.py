@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openlxp_xia', '0006_auto_20230907_1642'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xisconfiguration',
+            name='xis_metadata_compression',
+            field=models.CharField(choices=[('none', 'None'), ('gzip', 'gzip'), ('zstd', 'zstd')], default='none', help_text='Select the compression applied to request bodies sent to the XIS Metadata Ledger API endpoint', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='xisconfiguration',
+            name='xis_supplemental_compression',
+            field=models.CharField(choices=[('none', 'None'), ('gzip', 'gzip'), ('zstd', 'zstd')], default='none', help_text='Select the compression applied to request bodies sent to the XIS Supplemental Ledger API endpoint', max_length=10),
+        ),
+    ]
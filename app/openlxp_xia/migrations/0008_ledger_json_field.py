@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:15
+
+import django.core.serializers.json
+import django.core.validators
+from django.db import migrations
+import openlxp_xia.management.utils.model_help
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openlxp_xia', '0007_xisconfiguration_compression'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='metadataledger',
+            name='source_metadata',
+            field=openlxp_xia.management.utils.model_help.LedgerJSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, validators=[django.core.validators.RegexValidator(message='The Wrong Format Entered', regex='(?!(\\A( \\x09\\x0A\\x0D\\x20-\\x7E # ASCII | \\xC2-\\xDF # non-overlong 2-byte | \\xE0\\xA0-\\xBF # excluding overlongs | \\xE1-\\xEC\\xEE\\xEF{2} # straight 3-byte | \\xED\\x80-\\x9F # excluding surrogates | \\xF0\\x90-\\xBF{2} # planes 1-3 | \\xF1-\\xF3{3} # planes 4-15 | \\xF4\\x80-\\x8F{2} # plane 16 )*\\Z))')]),
+        ),
+        migrations.AlterField(
+            model_name='metadataledger',
+            name='target_metadata',
+            field=openlxp_xia.management.utils.model_help.LedgerJSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+        migrations.AlterField(
+            model_name='supplementalledger',
+            name='supplemental_metadata',
+            field=openlxp_xia.management.utils.model_help.LedgerJSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, validators=[django.core.validators.RegexValidator(message='The Wrong Format Entered', regex='(?!(\\A( \\x09\\x0A\\x0D\\x20-\\x7E # ASCII | \\xC2-\\xDF # non-overlong 2-byte | \\xE0\\xA0-\\xBF # excluding overlongs | \\xE1-\\xEC\\xEE\\xEF{2} # straight 3-byte | \\xED\\x80-\\x9F # excluding surrogates | \\xF0\\x90-\\xBF{2} # planes 1-3 | \\xF1-\\xF3{3} # planes 4-15 | \\xF4\\x80-\\x8F{2} # plane 16 )*\\Z))')]),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:24
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openlxp_xia', '0008_ledger_json_field'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StageMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('command', models.CharField(max_length=100)),
+                ('name', models.CharField(max_length=200)),
+                ('kind', models.CharField(choices=[('timer', 'Timer'), ('counter', 'Counter')], max_length=10)),
+                ('count', models.BigIntegerField(default=0)),
+                ('total_seconds', models.FloatField(default=0)),
+                ('max_seconds', models.FloatField(default=0)),
+                ('buckets', models.JSONField(blank=True, default=list)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='stagemetric',
+            constraint=models.UniqueConstraint(fields=('command', 'name'), name='unique_stage_metric'),
+        ),
+    ]
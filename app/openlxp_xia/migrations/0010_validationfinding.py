@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openlxp_xia', '0009_stagemetric'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValidationFinding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metadata_key_hash', models.CharField(db_index=True, max_length=200)),
+                ('stage', models.CharField(choices=[('validate_source', 'Source validation'), ('validate_target', 'Target validation')], max_length=20)),
+                ('field_path', models.CharField(max_length=255)),
+                ('finding_type', models.CharField(choices=[('Required', 'Required field missing'), ('Recommended', 'Recommended field missing'), ('datatype', 'Unexpected datatype')], max_length=15)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='validationfinding',
+            index=models.Index(fields=['field_path', 'finding_type', 'stage'], name='validation_finding_field'),
+        ),
+    ]
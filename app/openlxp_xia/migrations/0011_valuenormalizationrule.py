@@ -0,0 +1,48 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:49
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+# rules previously hard coded in replace_field_on_target_schema
+EDUCATIONAL_CONTEXT_RULES = (
+    ('Course.EducationalContext', ['y', 'Y'], 'Mandatory'),
+    ('Course.EducationalContext', ['n', 'N'], 'Non - Mandatory'),
+)
+
+
+def create_educational_context_rules(apps, schema_editor):
+    ValueNormalizationRule = apps.get_model('openlxp_xia',
+                                            'ValueNormalizationRule')
+    ValueNormalizationRule.objects.bulk_create(
+        [ValueNormalizationRule(target_field_path=target_field_path,
+                                input_values=input_values,
+                                output_value=output_value)
+         for target_field_path, input_values, output_value
+         in EDUCATIONAL_CONTEXT_RULES])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openlxp_xia', '0010_validationfinding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValueNormalizationRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('target_field_path', models.CharField(help_text='Enter the target field as section.field, e.g. Course.EducationalContext', max_length=200)),
+                ('input_values', models.JSONField(default=list, help_text='Enter the values to replace as a JSON list, e.g. ["y", "Y"]')),
+                ('output_value', models.CharField(max_length=200)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(create_educational_context_rules,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:51
+
+import hashlib
+
+from django.db import migrations, models
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def get_key_digest(key_value):
+    # same digest as xia_internal.get_key_digest, copied as migrations must
+    # not depend on application code
+    if not key_value:
+        return ''
+    return hashlib.blake2b(key_value.encode('utf-8'),
+                           digest_size=16).hexdigest()
+
+
+def backfill_model(model, key_fields):
+    batch = []
+    for record in model.objects.only(
+            *[key_field for key_field, _ in key_fields]).iterator(
+            chunk_size=BACKFILL_BATCH_SIZE):
+        for key_field, digest_field in key_fields:
+            setattr(record, digest_field,
+                    get_key_digest(getattr(record, key_field)))
+        batch.append(record)
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            model.objects.bulk_update(
+                batch, [digest_field for _, digest_field in key_fields])
+            batch = []
+    if batch:
+        model.objects.bulk_update(
+            batch, [digest_field for _, digest_field in key_fields])
+
+
+def backfill_key_digests(apps, schema_editor):
+    backfill_model(apps.get_model('openlxp_xia', 'MetadataLedger'),
+                   [('source_metadata_key', 'source_metadata_key_digest'),
+                    ('target_metadata_key', 'target_metadata_key_digest')])
+    backfill_model(apps.get_model('openlxp_xia', 'SupplementalLedger'),
+                   [('supplemental_metadata_key',
+                     'supplemental_metadata_key_digest')])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openlxp_xia', '0011_valuenormalizationrule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metadataledger',
+            name='source_metadata_key_digest',
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='metadataledger',
+            name='target_metadata_key_digest',
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='supplementalledger',
+            name='supplemental_metadata_key_digest',
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='xiaconfiguration',
+            name='target_key_fields',
+            field=models.CharField(default='Course.CourseCode,Course.CourseProviderName', help_text='Enter the comma separated target fields, as section.field, identifying a record', max_length=500),
+        ),
+        migrations.RunPython(backfill_key_digests, migrations.RunPython.noop),
+    ]
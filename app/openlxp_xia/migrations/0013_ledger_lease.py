@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openlxp_xia', '0012_key_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metadataledger',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='metadataledger',
+            name='lease_owner',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='supplementalledger',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='supplementalledger',
+            name='lease_owner',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openlxp_xia', '0013_ledger_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metadataledger',
+            name='target_metadata_pending_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='supplementalledger',
+            name='supplemental_metadata_pending_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:52
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openlxp_xia', '0014_pending_expires'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='xiaconfiguration',
+            name='target_key_fields',
+            field=models.CharField(default='Course.CourseCode,Course.CourseProviderName', help_text='Enter the comma separated target fields, as section.field, identifying a record', max_length=500, validators=[django.core.validators.RegexValidator(message='Enter the target key fields as Section.Field, separated by commas', regex='^\\s*[^.,\\s]+\\.[^,\\s]+\\s*(,\\s*[^.,\\s]+\\.[^,\\s]+\\s*)*$')]),
+        ),
+    ]
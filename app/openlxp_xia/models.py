@@ -6,8 +6,8 @@ from django.db import models
 from django.forms import ValidationError
 from django.core.validators import RegexValidator
 from django.urls import reverse
-from openlxp_xia.management.utils.model_help import confusable_homoglyphs_check
-from openlxp_xia.management.utils.model_help import bleach_data_to_json
+from openlxp_xia.management.utils.model_help import LedgerJSONField
+from openlxp_xia.management.utils.model_help import sanitize_metadata
 from model_utils.models import TimeStampedModel
 
 logger = logging.getLogger('dict_config_logger')
@@ -37,6 +37,15 @@ class XIAConfiguration(TimeStampedModel):
                                                         'validate from.')
     source_file = models.FileField(help_text='Upload the source '
                                              'file')
+    target_key_fields = models.CharField(
+        max_length=500,
+        default='Course.CourseCode,Course.CourseProviderName',
+        help_text='Enter the comma separated target fields, as '
+                  'section.field, identifying a record',
+        validators=[RegexValidator(
+            regex=r'^\s*[^.,\s]+\.[^,\s]+\s*(,\s*[^.,\s]+\.[^,\s]+\s*)*$',
+            message='Enter the target key fields as Section.Field, '
+                    'separated by commas')])
 
     def get_absolute_url(self):
         """ URL for displaying individual model records."""
@@ -90,15 +99,15 @@ class XIAConfiguration(TimeStampedModel):
                             # logging if datatype for field not present in
                             # schema
                             else:
-                                logger.warning("Datatype for required value " +
-                                               section + "." + key +
-                                               " not found in schema mapping")
+                                logger.warning("Datatype for required value "
+                                               "%s.%s not found in schema "
+                                               "mapping", section, key)
                             metadata_field_overwrite.save()
                         # logging is mapping for metadata not present in schema
                         else:
-                            logger.error("Mapping for required value " +
-                                         section + "." + key +
-                                         " not found in schema mapping")
+                            logger.error("Mapping for required value %s.%s "
+                                         "not found in schema mapping",
+                                         section, key)
 
     def save(self, *args, **kwargs):
         # Retrieve list of field required to be overwritten
@@ -118,6 +127,9 @@ class XIAConfiguration(TimeStampedModel):
 class XISConfiguration(TimeStampedModel):
     """Model for XIS Configuration """
 
+    COMPRESSION_CHOICES = [('none', 'None'), ('gzip', 'gzip'),
+                           ('zstd', 'zstd')]
+
     xis_metadata_api_endpoint = models.CharField(
         help_text='Enter the XIS Metadata Ledger API endpoint',
         max_length=200
@@ -133,6 +145,18 @@ class XISConfiguration(TimeStampedModel):
         max_length=128
     )
 
+    xis_metadata_compression = models.CharField(
+        help_text='Select the compression applied to request bodies sent '
+                  'to the XIS Metadata Ledger API endpoint',
+        max_length=10, choices=COMPRESSION_CHOICES, default='none'
+    )
+
+    xis_supplemental_compression = models.CharField(
+        help_text='Select the compression applied to request bodies sent '
+                  'to the XIS Supplemental Ledger API endpoint',
+        max_length=10, choices=COMPRESSION_CHOICES, default='none'
+    )
+
     def save(self, *args, **kwargs):
         if not self.pk and XISConfiguration.objects.exists():
             raise ValidationError('There can be only one XISConfiguration '
@@ -154,26 +178,30 @@ class MetadataLedger(TimeStampedModel):
                                             default=uuid.uuid4, editable=False)
     record_lifecycle_status = models.CharField(
         max_length=10, blank=True, choices=RECORD_ACTIVATION_STATUS_CHOICES)
-    source_metadata = models.JSONField(blank=True,
-                                       validators=[RegexValidator(regex=rcheck,
-                                                                  message="The"
-                                                                  " Wrong "
-                                                                  "Format "
-                                                                  "Entered")])
+    source_metadata = LedgerJSONField(blank=True,
+                                      validators=[RegexValidator(regex=rcheck,
+                                                                 message="The"
+                                                                 " Wrong "
+                                                                 "Format "
+                                                                 "Entered")])
     source_metadata_extraction_date = models.DateTimeField(auto_now_add=True)
     source_metadata_hash = models.CharField(max_length=200)
     source_metadata_key = models.TextField()
     source_metadata_key_hash = models.CharField(max_length=200)
+    source_metadata_key_digest = models.CharField(max_length=32, blank=True,
+                                                  db_index=True)
     source_metadata_transformation_date = models.DateTimeField(blank=True,
                                                                null=True)
     source_metadata_validation_date = models.DateTimeField(blank=True,
                                                            null=True)
     source_metadata_validation_status = models.CharField(
         max_length=10, blank=True, choices=METADATA_VALIDATION_CHOICES)
-    target_metadata = models.JSONField(default=dict)
+    target_metadata = LedgerJSONField(default=dict)
     target_metadata_hash = models.CharField(max_length=200)
     target_metadata_key = models.TextField()
     target_metadata_key_hash = models.CharField(max_length=200)
+    target_metadata_key_digest = models.CharField(max_length=32, blank=True,
+                                                  db_index=True)
     target_metadata_transmission_date = models.DateTimeField(blank=True,
                                                              null=True)
     target_metadata_transmission_status = models.CharField(
@@ -181,15 +209,22 @@ class MetadataLedger(TimeStampedModel):
         choices=RECORD_TRANSMISSION_STATUS_CHOICES)
     target_metadata_transmission_status_code = models.IntegerField(blank=True,
                                                                    null=True)
+    # a load interrupted while the record is Pending is recovered once the
+    # pending lease expires
+    target_metadata_pending_expires = models.DateTimeField(blank=True,
+                                                           null=True)
     target_metadata_validation_date = models.DateTimeField(blank=True,
                                                            null=True)
     target_metadata_validation_status = models.CharField(
         max_length=10, blank=True, choices=METADATA_VALIDATION_CHOICES)
+    # worker processing the record, until its lease expires
+    lease_owner = models.CharField(max_length=255, blank=True, default='',
+                                   db_index=True)
+    lease_expires = models.DateTimeField(blank=True, null=True,
+                                         db_index=True)
 
     def clean(self):
-        source_data = self.source_metadata
-        data_checked = confusable_homoglyphs_check(source_data)
-        self.source_metadata = bleach_data_to_json(data_checked)
+        self.source_metadata, _ = sanitize_metadata(self.source_metadata)
 
 
 class SupplementalLedger(TimeStampedModel):
@@ -205,18 +240,20 @@ class SupplementalLedger(TimeStampedModel):
                                             default=uuid.uuid4, editable=False)
     record_lifecycle_status = models.CharField(
         max_length=10, blank=True, choices=RECORD_ACTIVATION_STATUS_CHOICES)
-    supplemental_metadata = models.JSONField(blank=True,
-                                             validators=[RegexValidator
-                                                         (regex=rcheck,
-                                                          message="The"
-                                                                  " Wrong "
-                                                                  "Format "
-                                                                  "Entered")])
+    supplemental_metadata = LedgerJSONField(blank=True,
+                                            validators=[RegexValidator
+                                                        (regex=rcheck,
+                                                         message="The"
+                                                                 " Wrong "
+                                                                 "Format "
+                                                                 "Entered")])
     supplemental_metadata_extraction_date = models.DateTimeField(
         auto_now_add=True)
     supplemental_metadata_hash = models.CharField(max_length=200)
     supplemental_metadata_key = models.TextField()
     supplemental_metadata_key_hash = models.CharField(max_length=200)
+    supplemental_metadata_key_digest = models.CharField(
+        max_length=32, blank=True, db_index=True)
     supplemental_metadata_transformation_date = models.DateTimeField(
         blank=True, null=True)
     supplemental_metadata_validation_date = models.DateTimeField(
@@ -228,11 +265,19 @@ class SupplementalLedger(TimeStampedModel):
         choices=RECORD_TRANSMISSION_STATUS_CHOICES)
     supplemental_metadata_transmission_status_code = models.IntegerField(
         blank=True, null=True)
+    # a load interrupted while the record is Pending is recovered once the
+    # pending lease expires
+    supplemental_metadata_pending_expires = models.DateTimeField(
+        blank=True, null=True)
+    # worker processing the record, until its lease expires
+    lease_owner = models.CharField(max_length=255, blank=True, default='',
+                                   db_index=True)
+    lease_expires = models.DateTimeField(blank=True, null=True,
+                                         db_index=True)
 
     def clean(self):
-        supplemental_data = self.supplemental_metadata
-        data_checked = confusable_homoglyphs_check(supplemental_data)
-        self.supplemental_metadata = bleach_data_to_json(data_checked)
+        self.supplemental_metadata, _ = sanitize_metadata(
+            self.supplemental_metadata)
 
 
 class MetadataFieldOverwrite(TimeStampedModel):
@@ -258,3 +303,85 @@ class MetadataFieldOverwrite(TimeStampedModel):
 
     def save(self, *args, **kwargs):
         return super(MetadataFieldOverwrite, self).save(*args, **kwargs)
+
+
+class ValueNormalizationRule(TimeStampedModel):
+    """Model for replacing any of a set of values of a target metadata
+    field with a normalized value during transformation"""
+
+    target_field_path = models.CharField(
+        max_length=200,
+        help_text='Enter the target field as section.field, e.g. '
+                  'Course.EducationalContext')
+    input_values = models.JSONField(
+        default=list,
+        help_text='Enter the values to replace as a JSON list, e.g. '
+                  '["y", "Y"]')
+    output_value = models.CharField(max_length=200)
+
+    def __str__(self):
+        """String for representing the Model object."""
+        return f'{self.target_field_path} {self.output_value}'
+
+    def clean(self):
+        if not isinstance(self.input_values, list) or not all(
+                isinstance(value, (str, int, float))
+                for value in self.input_values):
+            raise ValidationError(
+                {'input_values': 'Enter a JSON list of text or numbers'})
+
+
+class StageMetric(TimeStampedModel):
+    """Model for the timers and counters recorded by the management commands,
+    accumulated over every run"""
+
+    METRIC_KIND_CHOICES = [('timer', 'Timer'), ('counter', 'Counter')]
+
+    command = models.CharField(max_length=100)
+    name = models.CharField(max_length=200)
+    kind = models.CharField(max_length=10, choices=METRIC_KIND_CHOICES)
+    count = models.BigIntegerField(default=0)
+    total_seconds = models.FloatField(default=0)
+    max_seconds = models.FloatField(default=0)
+    buckets = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['command', 'name'],
+                                    name='unique_stage_metric')
+        ]
+
+    def __str__(self):
+        """String for representing the Model object."""
+        return f'{self.command} {self.name}'
+
+
+class ValidationFinding(models.Model):
+    """Model for a field of a record found missing or mistyped during
+    validation, written in bulk by the validators.
+
+    Rows only hold a creation date, the aggregation queries being served by
+    the index on field_path."""
+
+    STAGE_CHOICES = [('validate_source', 'Source validation'),
+                     ('validate_target', 'Target validation')]
+    FINDING_TYPE_CHOICES = [('Required', 'Required field missing'),
+                            ('Recommended', 'Recommended field missing'),
+                            ('datatype', 'Unexpected datatype')]
+
+    metadata_key_hash = models.CharField(max_length=200, db_index=True)
+    stage = models.CharField(max_length=20, choices=STAGE_CHOICES)
+    field_path = models.CharField(max_length=255)
+    finding_type = models.CharField(max_length=15,
+                                    choices=FINDING_TYPE_CHOICES)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['field_path', 'finding_type', 'stage'],
+                         name='validation_finding_field'),
+        ]
+
+    def __str__(self):
+        """String for representing the Model object."""
+        return f'{self.stage} {self.finding_type} {self.field_path}'
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import random
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.utils import timezone
+
+from openlxp_xia.management.utils.xia_internal import get_key_digest
+from openlxp_xia.models import MetadataLedger
+
+# record counts benchmarked, overridden with a comma separated list in
+# XIA_BENCHMARK_SIZES such as 1000,10000,100000
+DEFAULT_BENCHMARK_SIZES = (1000, 10000)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__),
+                             'benchmark_baseline.json')
+
+IMPORT_TIME_MARKER = 'django setup complete'
+
+# imports every command once Django is set up, then prints the imported
+# modules
+COMMAND_IMPORT_SCRIPT = """
+import importlib, json, os, pkgutil, sys
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'openlxp_xia_project.settings')
+sys.argv = ['manage.py', 'test']
+import django
+django.setup()
+sys.stderr.write('%s\\n')
+import openlxp_xia.management.commands as commands
+for module in pkgutil.iter_modules(commands.__path__):
+    importlib.import_module(commands.__name__ + '.' + module.name)
+sys.stdout.write('\\n' + json.dumps(sorted(sys.modules)) + '\\n')
+""" % IMPORT_TIME_MARKER
+
+# self time in microseconds and name of a module in -X importtime output
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+\d+ \| *(\S+)$',
+                              re.MULTILINE)
+
+WORDS = ('acquisition', 'law', 'contract', 'management', 'cyber', 'defense',
+         'logistics', 'leadership', 'analysis', 'budget', 'systems',
+         'engineering', 'program', 'risk', 'test', 'evaluation')
+
+
+def get_benchmark_sizes():
+    """Returns the record counts to benchmark"""
+    sizes = os.environ.get('XIA_BENCHMARK_SIZES')
+    if not sizes:
+        return DEFAULT_BENCHMARK_SIZES
+    return tuple(int(size) for size in sizes.split(','))
+
+
+def get_import_time_budget():
+    """Returns the milliseconds importing every command may take,
+    overridden in XIA_IMPORT_TIME_BUDGET_MS"""
+    return float(os.environ.get('XIA_IMPORT_TIME_BUDGET_MS', 100))
+
+
+def run_command_imports(*python_options):
+    """Imports every command in a new interpreter run with the given
+    options"""
+    return subprocess.run(
+        [sys.executable] + list(python_options) + ['-c',
+                                                   COMMAND_IMPORT_SCRIPT],
+        cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=120)
+
+
+def get_text(rng, words):
+    """Returns a random phrase of the given number of words"""
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def get_field_value(ind, field, rng):
+    """Returns a realistic value for a field based on its name"""
+    name = field.lower()
+    if name in ('key', 'coursecode'):
+        return 'Bench %07d' % ind
+    if name in ('sourcesystem', 'courseprovidername'):
+        return 'AGENT'
+    if 'date' in name:
+        return '20%02d-%02d-01T00:00:00-05:00' % (rng.randint(10, 29),
+                                                  rng.randint(1, 12))
+    if 'url' in name or 'thumbnail' in name:
+        return 'https://example.test.com/%s/%s' % (name, ind)
+    if 'description' in name:
+        return get_text(rng, rng.randint(20, 80))
+    return get_text(rng, rng.randint(1, 8))
+
+
+def get_source_fields(source_schema, target_mapping):
+    """Returns the source fields of the source schema and the target
+    mapping"""
+    fields = {field[:-len('.use')] if field.endswith('.use') else field
+              for field in source_schema}
+    for section in target_mapping.values():
+        fields.update(field for field in section.values() if field)
+    return sorted(fields)
+
+
+def generate_source_record(ind, rng, source_fields):
+    """Generates source metadata holding every source field, with nested
+    objects, lists and a varying number of supplemental fields"""
+    record = {field: get_field_value(ind, field, rng)
+              for field in source_fields}
+    record['test_images'] = [{'url': 'https://example.test.com/%s/%s.png' %
+                                     (ind, image),
+                              'alt': get_text(rng, 3)}
+                             for image in range(rng.randint(1, 4))]
+    record['test_sections'] = [{'title': get_text(rng, 3),
+                                'order': section,
+                                'instructors': [get_text(rng, 2) for _ in
+                                                range(rng.randint(1, 3))]}
+                               for section in range(rng.randint(1, 6))]
+    for field in range(rng.randint(3, 12)):
+        record['supplemental_data%s' % field] = get_text(rng, 2)
+    return record
+
+
+def generate_target_record(ind, rng, target_schema):
+    """Generates target metadata holding every field of the target
+    schema"""
+    return {section: {field: get_field_value(ind, field, rng)
+                      for field in fields}
+            for section, fields in target_schema.items()}
+
+
+def generate_records(count, generator, schema, seed=1):
+    """Generates a reproducible list of records from a schema"""
+    rng = random.Random(seed)
+    return [generator(ind, rng, schema) for ind in range(count)]
+
+
+def get_hash(value):
+    """Returns the sha512 hex digest of a value as stored in the ledger"""
+    return hashlib.sha512(str(value).encode('utf-8')).hexdigest()
+
+
+def create_source_ledger_records(source_records):
+    """Stores source records in MetadataLedger ready to be validated"""
+    MetadataLedger.objects.bulk_create(
+        [MetadataLedger(record_lifecycle_status='Active',
+                        source_metadata=record,
+                        source_metadata_hash=get_hash(record),
+                        source_metadata_key=record['KEY'] + '_AGENT',
+                        source_metadata_key_hash=get_hash(
+                            record['KEY'] + '_AGENT'),
+                        source_metadata_key_digest=get_key_digest(
+                            record['KEY'] + '_AGENT'),
+                        source_metadata_validation_status='')
+         for record in source_records], batch_size=1000)
+
+
+def create_target_ledger_records(target_records, validated=False):
+    """Stores target records in MetadataLedger ready to be validated, or
+    ready to be loaded into XIS when validated"""
+    now = timezone.now()
+    MetadataLedger.objects.bulk_create(
+        [MetadataLedger(record_lifecycle_status='Active',
+                        source_metadata={},
+                        source_metadata_validation_status='Y',
+                        source_metadata_validation_date=now,
+                        source_metadata_transformation_date=now,
+                        target_metadata=record,
+                        target_metadata_hash=get_hash(record),
+                        target_metadata_key=record['Course']['CourseCode'],
+                        target_metadata_key_hash=get_hash(
+                            record['Course']['CourseCode']),
+                        target_metadata_key_digest=get_key_digest(
+                            record['Course']['CourseCode']),
+                        target_metadata_validation_status='Y' if validated
+                        else '',
+                        target_metadata_validation_date=now if validated
+                        else None)
+         for record in target_records], batch_size=1000)
@@ -1,6 +1,5 @@
 from uuid import UUID
 
-import pandas as pd
 from django.test import TestCase
 
 
@@ -448,7 +447,8 @@ class TestSetUp(TestCase):
                                            'KEY',
                                            'Start_date', 'End_date']
 
-        self.test_metadata_column_list = [["Test", "Test_id", "Test_url"]]
+        self.test_mapped_source_paths = frozenset({"Test", "Test_id",
+                                                   "Test_url"})
 
         self.source_metadata_with_supplemental = {
             "Test": "0",
@@ -463,9 +463,6 @@ class TestSetUp(TestCase):
             "supplemental_data2": "sample2"
         }
 
-        self.metadata_df = pd.DataFrame.from_dict(
-            {0: {1: self.source_metadata}}, orient='index')
-
         return super().setUp()
 
     def tearDown(self):
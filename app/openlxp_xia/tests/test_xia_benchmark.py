@@ -0,0 +1,254 @@
+import json
+import logging
+import os
+import time
+from unittest.mock import patch
+
+from django.test import tag
+
+from openlxp_xia.management.commands.load_supplemental_metadata import (
+    get_supplemental_metadata_for_loading, post_supplemental_records_to_xis)
+from openlxp_xia.management.commands.load_target_metadata import (
+    get_target_metadata_for_loading, post_records_to_xis)
+from openlxp_xia.management.commands.transform_source_metadata import (
+    create_target_metadata_dict, get_mapped_source_paths, get_overwrite_plan,
+    get_type_coercion_plan)
+from openlxp_xia.management.commands.validate_source_metadata import (
+    get_source_metadata_for_validation, validate_source_using_key)
+from openlxp_xia.management.commands.validate_target_metadata import (
+    get_target_metadata_for_validation, validate_target_using_key)
+from openlxp_xia.management.utils.stub_server import StubServer
+from openlxp_xia.management.utils.xia_internal import dict_flatten
+from openlxp_xia.management.utils.xss_client import (
+    get_required_fields_for_validation, read_json_data)
+from openlxp_xia.models import (MetadataLedger, SupplementalLedger,
+                                XISConfiguration)
+
+from .benchmark_setup import (BASELINE_PATH, IMPORT_TIME_LINE,
+                              IMPORT_TIME_MARKER,
+                              create_source_ledger_records,
+                              create_target_ledger_records,
+                              generate_records, generate_source_record,
+                              generate_target_record, get_benchmark_sizes,
+                              get_hash, get_import_time_budget,
+                              get_source_fields, run_command_imports)
+from .test_setup import TestSetUp
+
+logger = logging.getLogger('dict_config_logger')
+
+# seconds per benchmark and record count of this run
+results = {}
+
+
+def compare_with_baseline(run_results, baseline):
+    """Returns (benchmark, size, seconds, baseline seconds, delta percent)
+    for every result, the baseline values being None when not stored"""
+    comparison = []
+    for benchmark, sizes in sorted(run_results.items()):
+        for size, seconds in sorted(sizes.items(), key=lambda x: int(x[0])):
+            baseline_seconds = baseline.get(benchmark, {}).get(size)
+            delta = (seconds - baseline_seconds) / baseline_seconds * 100 \
+                if baseline_seconds else None
+            comparison.append((benchmark, size, seconds, baseline_seconds,
+                               delta))
+    return comparison
+
+
+def report_benchmarks():
+    """Logs the results with their delta to the stored baseline, storing
+    them as the new baseline when XIA_BENCHMARK_UPDATE_BASELINE is set
+
+    :return: list of the benchmarks slower than the baseline by more than
+    XIA_BENCHMARK_MAX_REGRESSION percent"""
+    baseline_path = os.environ.get('XIA_BENCHMARK_BASELINE', BASELINE_PATH)
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+
+    max_regression = os.environ.get('XIA_BENCHMARK_MAX_REGRESSION')
+    regressions = []
+    for benchmark, size, seconds, baseline_seconds, delta in \
+            compare_with_baseline(results, baseline):
+        if delta is None:
+            logger.warning("Benchmark %s %s records: %.3fs (%.0f records/s),"
+                           " no baseline", benchmark, size, seconds,
+                           int(size) / seconds)
+            continue
+        logger.warning("Benchmark %s %s records: %.3fs (%.0f records/s), "
+                       "%+.1f%% against baseline %.3fs", benchmark, size,
+                       seconds, int(size) / seconds, delta, baseline_seconds)
+        if max_regression and delta > float(max_regression):
+            regressions.append('%s %s records %+.1f%%' % (benchmark, size,
+                                                          delta))
+
+    if os.environ.get('XIA_BENCHMARK_UPDATE_BASELINE'):
+        for benchmark, sizes in results.items():
+            baseline.setdefault(benchmark, {}).update(
+                {size: round(seconds, 4) for size, seconds in sizes.items()})
+        with open(baseline_path, 'w') as file:
+            json.dump(baseline, file, indent=4, sort_keys=True)
+            file.write('\n')
+    return regressions
+
+
+@tag('benchmark')
+class BenchmarkTests(TestSetUp):
+    """Benchmarks of the transform, validate and load stages on synthetic
+    records, run with manage.py test --tag=benchmark"""
+
+    @classmethod
+    def tearDownClass(cls):
+        regressions = report_benchmarks()
+        super().tearDownClass()
+        if regressions:
+            raise AssertionError('Benchmark regressions: ' +
+                                 ', '.join(regressions))
+
+    def setUp(self):
+        super().setUp()
+        self.source_fields = get_source_fields(self.schema_data_dict,
+                                               self.source_target_mapping)
+
+    def time_benchmark(self, benchmark, size, function, *args):
+        """Times a function and stores the result of the benchmark"""
+        start = time.perf_counter()
+        function(*args)
+        results.setdefault(benchmark, {})[str(size)] = \
+            time.perf_counter() - start
+
+    def test_dict_flatten(self):
+        """Benchmark flattening source records"""
+        for size in get_benchmark_sizes():
+            records = generate_records(size, generate_source_record,
+                                       self.source_fields)
+            self.time_benchmark(
+                'dict_flatten', size,
+                lambda: [dict_flatten(record,
+                                      self.test_required_column_names)
+                         for record in records])
+
+    def test_create_target_metadata_dict(self):
+        """Benchmark mapping source records to the target schema"""
+        overwrite_plan = get_overwrite_plan()
+        coercion_plan = get_type_coercion_plan(self.expected_datatype)
+        mapped_paths = get_mapped_source_paths(self.source_target_mapping)
+        for size in get_benchmark_sizes():
+            records = generate_records(size, generate_source_record,
+                                       self.source_fields)
+            self.time_benchmark(
+                'create_target_metadata_dict', size,
+                lambda: [create_target_metadata_dict(
+                    ind, self.source_target_mapping, record,
+                    self.test_required_column_names,
+                    self.expected_datatype, overwrite_plan, coercion_plan,
+                    mapped_paths)
+                    for ind, record in enumerate(records)])
+
+    def test_validate_source_using_key(self):
+        """Benchmark validating source records stored in the ledger"""
+        required_column_list, recommended_column_list = \
+            get_required_fields_for_validation(self.schema_data_dict)
+        for size in get_benchmark_sizes():
+            MetadataLedger.objects.all().delete()
+            create_source_ledger_records(
+                generate_records(size, generate_source_record,
+                                 self.source_fields))
+            self.time_benchmark('validate_source_using_key', size,
+                                validate_source_using_key,
+                                get_source_metadata_for_validation(),
+                                required_column_list,
+                                recommended_column_list)
+            self.assertEqual(MetadataLedger.objects.filter(
+                source_metadata_validation_status='Y').count(), size)
+
+    def test_validate_target_using_key(self):
+        """Benchmark validating target records stored in the ledger"""
+        required_column_list, recommended_column_list = \
+            get_required_fields_for_validation(self.target_data_dict)
+        for size in get_benchmark_sizes():
+            MetadataLedger.objects.all().delete()
+            create_target_ledger_records(
+                generate_records(size, generate_target_record,
+                                 self.target_data_dict))
+            self.time_benchmark('validate_target_using_key', size,
+                                validate_target_using_key,
+                                get_target_metadata_for_validation(),
+                                required_column_list,
+                                recommended_column_list,
+                                self.expected_datatype)
+            self.assertEqual(MetadataLedger.objects.filter(
+                target_metadata_validation_status='Y').count(), size)
+
+    def test_read_json_data(self):
+        """Benchmark fetching schemas and mappings from a local stub XSS"""
+        fetches = 100
+        with StubServer(schemas={'source.json': self.schema_data_dict},
+                        mappings={('target.json', 'source.json'):
+                                  self.source_target_mapping}) as stub_xss, \
+                patch('openlxp_xia.management.utils.xss_client.xss_get',
+                      return_value=stub_xss.url):
+            self.time_benchmark(
+                'read_json_data', fetches,
+                lambda: [read_json_data('source.json', target)
+                         for _ in range(fetches // 2)
+                         for target in (None, 'target.json')])
+
+    def test_post_records_to_xis(self):
+        """Benchmark loading target records into a local stub XIS"""
+        with StubServer() as stub_xis:
+            XISConfiguration(xis_metadata_api_endpoint=stub_xis.url +
+                             'metadata/', xis_api_key='benchmark').save()
+            for size in get_benchmark_sizes():
+                MetadataLedger.objects.all().delete()
+                create_target_ledger_records(
+                    generate_records(size, generate_target_record,
+                                     self.target_data_dict), True)
+                self.time_benchmark('post_records_to_xis', size,
+                                    post_records_to_xis,
+                                    get_target_metadata_for_loading(),
+                                    'AGENT')
+                self.assertEqual(MetadataLedger.objects.filter(
+                    target_metadata_transmission_status='Successful'
+                ).count(), size)
+
+    def test_post_supplemental_records_to_xis(self):
+        """Benchmark loading supplemental records into a local stub XIS"""
+        with StubServer() as stub_xis, \
+                patch('openlxp_xia.management.commands.'
+                      'load_supplemental_metadata.get_publisher_detail',
+                      return_value='AGENT'):
+            XISConfiguration(xis_supplemental_api_endpoint=stub_xis.url +
+                             'supplemental-data/',
+                             xis_api_key='benchmark').save()
+            for size in get_benchmark_sizes():
+                SupplementalLedger.objects.all().delete()
+                SupplementalLedger.objects.bulk_create(
+                    [SupplementalLedger(
+                        record_lifecycle_status='Active',
+                        supplemental_metadata=self.supplemental_data,
+                        supplemental_metadata_hash=get_hash(ind),
+                        supplemental_metadata_key='Bench %07d' % ind,
+                        supplemental_metadata_key_hash=get_hash(
+                            'Bench %07d' % ind))
+                     for ind in range(size)], batch_size=1000)
+                self.time_benchmark('post_supplemental_records_to_xis',
+                                    size, post_supplemental_records_to_xis,
+                                    get_supplemental_metadata_for_loading())
+                self.assertEqual(SupplementalLedger.objects.filter(
+                    supplemental_metadata_transmission_status='Successful'
+                ).count(), size)
+
+    def test_command_import_time(self):
+        """Test that importing every command stays within the import time
+        budget, measured with python -X importtime"""
+        result = run_command_imports('-X', 'importtime')
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+
+        # only the imports following Django setup are the commands' own
+        command_imports = IMPORT_TIME_LINE.findall(
+            result.stderr.partition(IMPORT_TIME_MARKER)[2])
+        import_time_ms = sum(int(self_us) for self_us, _ in
+                             command_imports) / 1000
+        logger.info("Commands imported in %.1f ms", import_time_ms)
+        self.assertLess(import_time_ms, get_import_time_budget())
@@ -1,30 +1,63 @@
+import datetime
+import gzip
+import hashlib
+import importlib
+import io
+import json
 import logging
+import os
+import pkgutil
+import tempfile
+import threading
 from unittest.mock import patch
 
-from ddt import ddt
+from ddt import data, ddt, unpack
+from django.core.management import CommandError, call_command
 from django.test import tag
 from django.utils import timezone
 
+import openlxp_xia.management.commands as commands
+from openlxp_xia.management.commands.export_target_metadata import (
+    export_target_metadata, get_file_sha256, get_target_metadata_for_export,
+    iter_records_by_key)
+from openlxp_xia.management.commands.ingest_source_metadata import (
+    get_source_metadata_key_value, ingest_source_metadata, iter_json_array,
+    iter_source_records)
 from openlxp_xia.management.commands.load_supplemental_metadata import (
     load_supplemental_metadata_to_xis, post_supplemental_metadata_to_xis,
     rename_supplemental_metadata_fields)
 from openlxp_xia.management.commands.load_target_metadata import (
     get_records_to_load_into_xis, post_data_to_xis,
     rename_metadata_ledger_fields)
+from openlxp_xia.management.commands.report_validation_findings import (
+    get_finding_counts, purge_findings)
+from openlxp_xia.management.commands.run_pipeline import (
+    get_pipeline_record_chunks, run_pipeline_sequential,
+    run_pipeline_threaded, validate_source_chunk)
+from openlxp_xia.management.commands.run_xia_worker import (get_next_sleep,
+                                                            run_worker)
 from openlxp_xia.management.commands.transform_source_metadata import (
-    create_supplemental_metadata, create_target_metadata_dict,
-    get_metadata_fields_to_overwrite, get_source_metadata_for_transformation,
-    overwrite_append_metadata, overwrite_metadata_field,
-    transform_source_using_key, type_checking_target_metadata)
+    OverwriteRule, create_supplemental_metadata, create_target_metadata_dict,
+    get_mapped_source_paths, get_overwrite_plan,
+    get_source_metadata_for_transformation, get_type_coercion_plan,
+    overwrite_append_metadata,
+    overwrite_metadata_field, transform_source_using_key,
+    type_checking_target_metadata)
 from openlxp_xia.management.commands.validate_source_metadata import (
     get_source_metadata_for_validation, validate_source_using_key,
     store_source_metadata_validation_status)
 from openlxp_xia.management.commands.validate_target_metadata import (
-    get_target_metadata_for_validation, update_previous_instance_in_metadata,
-    validate_target_using_key)
+    get_target_metadata_for_validation,
+    store_target_metadata_validation_status,
+    update_previous_instance_in_metadata, validate_target_using_key)
+from openlxp_xia.management.utils.findings import (get_findings,
+                                                   reset_findings)
+from openlxp_xia.management.utils.instrumentation import (
+    InstrumentedCommand, increment, reset_metrics)
+from openlxp_xia.management.utils.xia_internal import get_key_digest
 from openlxp_xia.models import (MetadataFieldOverwrite, MetadataLedger,
-                                SupplementalLedger, XIAConfiguration,
-                                XISConfiguration)
+                                SupplementalLedger, ValidationFinding,
+                                XIAConfiguration, XISConfiguration)
 
 from .test_setup import TestSetUp
 
@@ -165,6 +198,38 @@ class CommandTests(TestSetUp):
         self.assertIsInstance(target_metadata[0]['General_Information'][
                                   "EndDate"], str)
 
+    def test_get_type_coercion_plan(self):
+        """Test that expected datatypes are compiled by (section, field)"""
+        coercion_plan = get_type_coercion_plan({
+            'Course.StartDate': 'datetime', 'Course.Hours': int,
+            'Course.Level': 'decimal'})
+
+        self.assertEqual(sorted(coercion_plan), [('Course', 'Hours'),
+                                                 ('Course', 'StartDate')])
+        convert = coercion_plan[('Course', 'Hours')].convert
+        self.assertEqual(convert(12), (12, True))
+        self.assertEqual(convert('12'), ('12', False))
+        convert = coercion_plan[('Course', 'StartDate')].convert
+        self.assertEqual(convert('2021-01-01T00:00:00-05:00'),
+                         ('2021-01-01T00:00:00-05:00', True))
+        self.assertEqual(convert(1), ('1', False))
+
+    def test_type_checking_target_metadata_findings(self):
+        """Test that mismatched datatypes are converted to string and
+        aggregated, and fields without datatype converted to string"""
+        reset_findings()
+        target_metadata = {0: {'Course': {'Hours': 'twelve', 'Code': 12},
+                               'Section': {'Hours': 'twelve'}}}
+        coercion_plan = get_type_coercion_plan({'Course.Hours': int})
+
+        target_metadata = type_checking_target_metadata(
+            3, target_metadata, {}, coercion_plan)
+        self.assertEqual(target_metadata, {
+            0: {'Course': {'Hours': 'twelve', 'Code': '12'},
+                'Section': {'Hours': 'twelve'}}})
+        self.assertEqual(get_findings(), [
+            ('transform', 'datatype', 'Course.Hours', 1, ['3'])])
+
     def test_get_source_metadata_for_transformation(self):
         """Test to Retrieving Source metadata from MetadataLedger that needs
         to be transformed"""
@@ -185,11 +250,21 @@ class CommandTests(TestSetUp):
         """Test to check creation of supplemental data from source data"""
 
         supplemental_data = \
-            create_supplemental_metadata(self.test_metadata_column_list,
+            create_supplemental_metadata(self.test_mapped_source_paths,
                                          self.
                                          source_metadata_with_supplemental)
         self.assertEqual(supplemental_data, self.supplemental_data)
 
+    def test_get_mapped_source_paths(self):
+        """Test the source paths mapped to target fields are collected
+        once, missing mappings being skipped"""
+        mapping = {'Course': {'CourseCode': 'KEY', 'CourseTitle': None},
+                   'Lifecycle': {'Provider': 'SOURCESYSTEM',
+                                 'Code': 'KEY'}}
+
+        self.assertEqual(get_mapped_source_paths(mapping),
+                         frozenset({'KEY', 'SOURCESYSTEM'}))
+
     def test_create_target_metadata_dict(self):
         """Test for a function to replace and transform source data to target
         data for using target mapping schema"""
@@ -262,40 +337,84 @@ class CommandTests(TestSetUp):
     def test_overwrite_metadata_field(self):
         """Test to overwrite metadata with admin entered values and
         return metadata in dictionary format """
-
-        with patch('openlxp_xia.management.commands.transform_source_metadata'
-                   '.get_metadata_fields_to_overwrite') as mock_get_overwrite:
-            mock_get_overwrite.return_value = self.metadata_df
-
-            return_val = overwrite_metadata_field(self.metadata_df)
-            self.assertIsInstance(return_val, dict)
-
-    def test_get_metadata_fields_to_overwrite(self):
-        """Test for looping through fields to be overwrite or appended"""
+        overwrite_plan = (OverwriteRule('column1', 'value1', True),
+                          OverwriteRule('column2', 'value2', False),
+                          OverwriteRule('column3', 'value3', False),
+                          OverwriteRule('column4', 4, False))
+        metadata = {'column1': 'old1', 'column2': 'old2', 'column3': ''}
+
+        return_val = overwrite_metadata_field(metadata, overwrite_plan)
+        self.assertEqual(return_val, {'column1': 'value1', 'column2': 'old2',
+                                      'column3': 'value3', 'column4': 4})
+
+    def test_get_overwrite_plan(self):
+        """Test that fields to be overwritten or appended are loaded and
+        type cast once"""
         with patch('openlxp_xia.management.commands.'
                    'transform_source_metadata.MetadataFieldOverwrite.'
-                   'objects') as mock_field, \
-                patch('openlxp_xia.management.commands.'
-                      'transform_source_metadata.'
-                      'overwrite_append_metadata') as mock_overwrite_fun:
-            config = \
+                   'objects') as mock_field:
+            mock_field.all.return_value = \
                 [MetadataFieldOverwrite(field_name='column1', overwrite=True,
-                                        field_value='value1'),
+                                        field_type='int', field_value='1'),
                  MetadataFieldOverwrite(field_name='column2', overwrite=False,
+                                        field_type='str',
                                         field_value='value2')]
-            mock_field.all.return_value = config
-            mock_overwrite_fun.return_value = self.metadata_df
 
-            get_metadata_fields_to_overwrite(self.metadata_df)
-            self.assertEqual(mock_overwrite_fun.call_count, 2)
+            overwrite_plan = get_overwrite_plan()
+            self.assertEqual(overwrite_plan,
+                             (OverwriteRule('column1', 1, True),
+                              OverwriteRule('column2', 'value2', False)))
+            self.assertEqual(mock_field.all.call_count, 1)
 
-    def test_overwrite_append_metadata(self):
+    @data(('value', None), ('value', ''), ('value', float('nan')),
+          ('old', 'old'))
+    @unpack
+    def test_overwrite_append_metadata(self, expected, old_value):
         """test Overwrite & append metadata fields based on overwrite flag """
         return_val = \
-            overwrite_append_metadata(self.metadata_df, 'column_1', 'value_1',
-                                      True)
+            overwrite_append_metadata({'column_1': 'old'}, 'column_1',
+                                      'value_1', True)
+        self.assertEqual(return_val['column_1'], 'value_1')
+
+        return_val = overwrite_append_metadata({'column_1': old_value},
+                                               'column_1', 'value', False)
+        self.assertEqual(return_val['column_1'], expected)
+
+    def test_transform_source_using_key_overwrite_plan(self):
+        """Test that the overwrite plan is loaded once per run"""
+        data = [{'source_metadata': self.source_metadata}] * 3
+        with patch('openlxp_xia.management.commands.'
+                   'transform_source_metadata.get_overwrite_plan',
+                   return_value=()) as mock_plan, \
+                patch('openlxp_xia.management.commands.'
+                      'transform_source_metadata'
+                      '.store_transformed_source_metadata'):
+            transform_source_using_key(data, self.source_target_mapping,
+                                       self.test_required_column_names,
+                                       self.expected_datatype)
+            self.assertEqual(mock_plan.call_count, 1)
 
-        self.assertEqual(return_val['column_1'][0], 'value_1')
+    def test_transform_source_using_key_without_digest(self):
+        """Test that records stored without a key digest are transformed"""
+        key_value_hash = hashlib.sha512(
+            self.key_value.encode('utf-8')).hexdigest()
+        metadata = MetadataLedger(source_metadata=self.source_metadata,
+                                  source_metadata_key=self.key_value,
+                                  source_metadata_key_hash=key_value_hash,
+                                  record_lifecycle_status='Active',
+                                  source_metadata_validation_date=timezone.
+                                  now())
+        metadata.save()
+
+        transform_source_using_key(get_source_metadata_for_transformation(),
+                                   self.source_target_mapping,
+                                   self.test_required_column_names,
+                                   self.expected_datatype)
+
+        metadata.refresh_from_db()
+        self.assertIsNotNone(metadata.source_metadata_transformation_date)
+        self.assertEqual(metadata.target_metadata_key_digest,
+                         get_key_digest(self.target_key_value))
 
     # Test cases for validate_target_metadata
 
@@ -380,6 +499,37 @@ class CommandTests(TestSetUp):
             get(target_metadata_key_hash=self.target_key_value_hash)
         self.assertEqual(updated_value.record_lifecycle_status, 'Inactive')
 
+    def test_store_target_metadata_validation_status_without_digest(self):
+        """Test that older instances stored without a key digest are set
+        inactive when a record with a digest is validated"""
+        previous = MetadataLedger(source_metadata=self.source_metadata,
+                                  source_metadata_key_hash=self.
+                                  target_key_value_hash,
+                                  record_lifecycle_status='Active',
+                                  target_metadata_validation_date=timezone.
+                                  now())
+        previous.save()
+        digest = get_key_digest(self.target_key_value)
+        metadata = MetadataLedger(source_metadata=self.source_metadata,
+                                  source_metadata_key_hash=self.
+                                  target_key_value_hash,
+                                  source_metadata_key_digest=digest,
+                                  target_metadata_key_hash=self.
+                                  target_key_value_hash,
+                                  target_metadata_key_digest=digest,
+                                  record_lifecycle_status='Active')
+        metadata.save()
+
+        store_target_metadata_validation_status(
+            MetadataLedger.objects.filter(pk=metadata.pk),
+            self.target_key_value_hash, 'Y', 'Active', self.target_metadata,
+            digest)
+
+        previous.refresh_from_db()
+        metadata.refresh_from_db()
+        self.assertEqual(previous.record_lifecycle_status, 'Inactive')
+        self.assertEqual(metadata.target_metadata_validation_status, 'Y')
+
     # Test cases for load_target_metadata
 
     def test_rename_metadata_ledger_fields(self):
@@ -669,3 +819,422 @@ class CommandTests(TestSetUp):
             post_supplemental_metadata_to_xis(data)
             self.assertEqual(response_obj.call_count, 2)
             self.assertEqual(mock_check_records_to_load.call_count, 1)
+
+    # Test cases for export_target_metadata
+
+    def create_exportable_records(self, count):
+        """Saving active and validated target metadata records"""
+        for ind in range(count):
+            MetadataLedger(
+                record_lifecycle_status='Active',
+                source_metadata=self.source_metadata,
+                target_metadata=self.target_metadata,
+                target_metadata_hash=self.target_hash_value,
+                target_metadata_key_hash=self.target_key_value_hash + str(ind),
+                target_metadata_key=self.target_key_value,
+                target_metadata_validation_status='Y').save()
+        MetadataLedger(
+            record_lifecycle_status='Inactive',
+            source_metadata=self.source_metadata,
+            target_metadata=self.target_metadata,
+            target_metadata_validation_status='Y').save()
+
+    def test_export_target_metadata_shards(self):
+        """Test that target metadata is exported in shards with a manifest"""
+        self.create_exportable_records(5)
+        with patch('openlxp_xia.management.commands.export_target_metadata'
+                   '.get_publisher_detail', return_value='AGENT'), \
+                tempfile.TemporaryDirectory() as output_dir:
+            manifest = export_target_metadata(
+                get_target_metadata_for_export(), output_dir, shard_size=2,
+                chunk_size=2)
+
+            self.assertEqual(manifest['record_count'], 5)
+            self.assertEqual([shard['records'] for shard in
+                              manifest['shards']], [2, 2, 1])
+            for shard in manifest['shards']:
+                shard_path = os.path.join(output_dir, shard['file'])
+                self.assertEqual(get_file_sha256(shard_path),
+                                 shard['sha256'])
+            with open(os.path.join(output_dir, 'manifest.json')) as file:
+                self.assertEqual(json.load(file)['record_count'], 5)
+            with open(os.path.join(output_dir,
+                                   manifest['shards'][0]['file'])) as file:
+                record = json.loads(file.readline())
+            self.assertEqual(record['provider_name'], 'AGENT')
+            self.assertEqual(record['metadata'], self.target_metadata)
+
+    def test_iter_records_by_key(self):
+        """Test that records are read in pages keyed on their uuid"""
+        self.create_exportable_records(5)
+        records = list(iter_records_by_key(get_target_metadata_for_export(),
+                                           2))
+        self.assertEqual([record['metadata_record_uuid']
+                          for record in records],
+                         sorted(MetadataLedger.objects.filter(
+                             record_lifecycle_status='Active').values_list(
+                             'metadata_record_uuid', flat=True)))
+
+    def test_export_target_metadata_gzip(self):
+        """Test that target metadata is exported as gzip compressed NDJSON"""
+        self.create_exportable_records(3)
+        with patch('openlxp_xia.management.commands.export_target_metadata'
+                   '.get_publisher_detail', return_value='AGENT'), \
+                tempfile.TemporaryDirectory() as output_dir:
+            manifest = export_target_metadata(
+                get_target_metadata_for_export(), output_dir, compress=True)
+
+            self.assertEqual(len(manifest['shards']), 1)
+            shard_file = manifest['shards'][0]['file']
+            self.assertTrue(shard_file.endswith('.ndjson.gz'))
+            with gzip.open(os.path.join(output_dir, shard_file)) as file:
+                self.assertEqual(len(file.readlines()), 3)
+
+    @data(0, -1)
+    def test_export_target_metadata_chunk_size(self, chunk_size):
+        """Test that a chunk size below 1 is rejected instead of exporting
+        no records"""
+        with tempfile.TemporaryDirectory() as output_dir, \
+                self.assertRaises(CommandError):
+            call_command('export_target_metadata', output_dir,
+                         chunk_size=chunk_size)
+
+    # Test cases for ingest_source_metadata
+
+    def test_iter_json_array(self):
+        """Test that records are streamed from a JSON array read in small
+        pieces"""
+        records = [self.source_metadata, self.metadata_invalid,
+                   {"nested": {"list": [1, "]", {"a": "}"}]}}]
+        file = io.StringIO(json.dumps(records))
+        self.assertEqual(list(iter_json_array(file, read_size=7)), records)
+
+    def test_iter_json_array_numbers(self):
+        """Test that numbers split across reads are not cut short"""
+        file = io.StringIO('[1, 12345, 678]')
+        self.assertEqual(list(iter_json_array(file, read_size=3)),
+                         [1, 12345, 678])
+
+    @data('', '  ', '[{"KEY": "a"}, {"KEY": "b"', '[{"KEY": "a"},',
+          '[{"KEY": ', '{"KEY": ')
+    def test_iter_json_array_malformed(self, content):
+        """Test that empty, truncated and invalid files raise CommandError"""
+        file = io.StringIO(content)
+        with self.assertRaises(CommandError):
+            list(iter_json_array(file, read_size=4))
+
+    def test_iter_json_array_record_size(self):
+        """Test that a malformed record does not read the rest of the
+        file"""
+        file = io.StringIO('[{"KEY": "a" "b"}' + ' ' * 100 + ']')
+        with self.assertRaises(CommandError):
+            list(iter_json_array(file, read_size=4, max_record_size=16))
+        self.assertLess(file.tell(), 100)
+
+    def test_iter_source_records_csv(self):
+        """Test that records are read from CSV"""
+        file = io.StringIO('KEY,SOURCESYSTEM\nTestData 123,AGENT\n')
+        self.assertEqual(list(iter_source_records(file, 'csv')),
+                         [{'KEY': 'TestData 123', 'SOURCESYSTEM': 'AGENT'}])
+
+    def test_get_source_metadata_key_value(self):
+        """Test source key creation from key fields"""
+        self.assertEqual(get_source_metadata_key_value(
+            self.source_metadata, ['KEY', 'SOURCESYSTEM']), self.key_value)
+        self.assertIsNone(get_source_metadata_key_value(
+            self.source_metadata, ['KEY', 'MISSING']))
+
+    def test_ingest_source_metadata_unknown_format(self):
+        """Test that the source file is closed when its format can not be
+        inferred"""
+        with tempfile.TemporaryDirectory() as source_dir:
+            source_path = os.path.join(source_dir, 'source.txt')
+            with open(source_path, 'w') as file:
+                file.write('KEY\n')
+            opened_files = []
+
+            def open_file(*args):
+                opened_files.append(open(*args))
+                return opened_files[-1]
+
+            with patch('openlxp_xia.management.commands.'
+                       'ingest_source_metadata.open', create=True,
+                       side_effect=open_file), \
+                    self.assertRaises(CommandError):
+                call_command('ingest_source_metadata', source_path,
+                             key_fields=['KEY'])
+
+            self.assertEqual(len(opened_files), 1)
+            self.assertTrue(opened_files[0].closed)
+
+    def test_ingest_source_metadata_skips_unchanged(self):
+        """Test that new records are stored and unchanged records are
+        skipped on the next run"""
+        changed = dict(self.source_metadata_overwrite,
+                       test_name='<b>new name</b>')
+        file = io.StringIO(json.dumps(self.source_metadata) + '\n' +
+                           json.dumps(self.source_metadata_overwrite) + '\n')
+        stats = ingest_source_metadata(iter_source_records(file, 'ndjson'),
+                                       ['KEY', 'SOURCESYSTEM'], batch_size=1)
+        self.assertEqual(stats['created'], 2)
+
+        stats = ingest_source_metadata(
+            [self.source_metadata, changed, {'KEY': 'no source system'}],
+            ['KEY', 'SOURCESYSTEM'])
+        self.assertEqual(stats['unchanged'], 1)
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['missing_key'], 1)
+        self.assertEqual(MetadataLedger.objects.filter(
+            source_metadata_key=self.key_value_overwrite,
+            source_metadata_validation_status='').count(), 2)
+        self.assertTrue(MetadataLedger.objects.filter(
+            source_metadata__test_name='new name').exists())
+
+    def test_ingest_source_metadata_homoglyphs(self):
+        """Test that records with dangerous homoglyphs are sanitized and
+        stored like MetadataLedger.clean does"""
+        record = dict(self.source_metadata, test_name='<b>ρаypаl</b>')
+        stats = ingest_source_metadata([record], ['KEY', 'SOURCESYSTEM'])
+        self.assertEqual(stats['homoglyphs'], 1)
+        self.assertEqual(stats['created'], 1)
+        self.assertTrue(MetadataLedger.objects.filter(
+            source_metadata__test_name='ρаypаl').exists())
+
+    # Test cases for run_pipeline
+
+    def test_get_pipeline_record_chunks(self):
+        """Test that active records not yet transmitted are chunked"""
+        for ind in range(5):
+            MetadataLedger(record_lifecycle_status='Active',
+                           source_metadata=self.source_metadata).save()
+        MetadataLedger(record_lifecycle_status='Active',
+                       source_metadata=self.source_metadata,
+                       target_metadata_transmission_date=timezone.now(),
+                       target_metadata_transmission_status='Successful'
+                       ).save()
+        MetadataLedger(record_lifecycle_status='Active',
+                       source_metadata=self.source_metadata,
+                       target_metadata_transmission_date=timezone.now(),
+                       target_metadata_transmission_status='Failed',
+                       target_metadata_transmission_status_code=400).save()
+        MetadataLedger(record_lifecycle_status='Inactive',
+                       source_metadata=self.source_metadata).save()
+
+        chunks = list(get_pipeline_record_chunks(2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+
+    def test_get_pipeline_record_chunks_claimed_by_chunk(self):
+        """Test that records are claimed a chunk at a time, leaving the
+        others to other workers"""
+        for ind in range(5):
+            MetadataLedger(record_lifecycle_status='Active',
+                           source_metadata=self.source_metadata).save()
+
+        chunks = get_pipeline_record_chunks(2)
+        next(chunks)
+
+        self.assertEqual(
+            MetadataLedger.objects.exclude(lease_owner='').count(), 2)
+
+    def test_get_pipeline_record_chunks_failed(self):
+        """Test that records XIS failed to load other than on a bad request
+        are run through the pipeline again"""
+        record = MetadataLedger(record_lifecycle_status='Active',
+                                source_metadata=self.source_metadata,
+                                target_metadata_transmission_date=timezone.
+                                now(),
+                                target_metadata_transmission_status='Failed',
+                                target_metadata_transmission_status_code=503)
+        record.save()
+
+        chunks = list(get_pipeline_record_chunks(2))
+
+        self.assertEqual(chunks, [[record.pk]])
+
+    def test_get_pipeline_record_chunks_pending(self):
+        """Test that records left Pending by an interrupted load are run
+        through the pipeline again"""
+        record = MetadataLedger(record_lifecycle_status='Active',
+                                source_metadata=self.source_metadata,
+                                target_metadata_transmission_status='Pending')
+        record.save()
+
+        chunks = list(get_pipeline_record_chunks(2))
+
+        self.assertEqual(chunks, [[record.pk]])
+        record.refresh_from_db()
+        self.assertEqual(record.target_metadata_transmission_status, 'Ready')
+
+    def test_validate_source_chunk(self):
+        """Test that a stage only processes the records of its chunk"""
+        records = [MetadataLedger(record_lifecycle_status='Active',
+                                  source_metadata=self.source_metadata,
+                                  source_metadata_extraction_date=timezone
+                                  .now(),
+                                  source_metadata_validation_status='')
+                   for _ in range(3)]
+        for record in records:
+            record.save()
+        with patch('openlxp_xia.management.commands.run_pipeline'
+                   '.validate_source_using_key') as mock_validate:
+            validate_source_chunk(
+                [records[0].metadata_record_uuid], {
+                    'source_required': self.test_required_column_names,
+                    'source_recommended': []})
+            source_data_dict = mock_validate.call_args[0][0]
+            self.assertEqual(len(source_data_dict), 1)
+
+    def test_run_pipeline_sequential(self):
+        """Test that each chunk goes through every stage in order"""
+        calls = []
+        stages = [lambda ids, context, name=name: calls.append((name, ids))
+                  for name in ('validate', 'transform')]
+        run_pipeline_sequential([[1, 2], [3]], {}, stages)
+        self.assertEqual(calls, [('validate', [1, 2]), ('transform', [1, 2]),
+                                 ('validate', [3]), ('transform', [3])])
+
+    def test_run_pipeline_threaded(self):
+        """Test that threaded stages see every chunk in order"""
+        calls = {'validate': [], 'transform': []}
+
+        def stage(name):
+            return lambda ids, context: calls[name].append(ids)
+
+        chunks = [[ind] for ind in range(10)]
+        with patch('openlxp_xia.management.commands.run_pipeline.'
+                   'renew_pipeline_leases') as mock_renew:
+            run_pipeline_threaded(chunks, {}, [stage('validate'),
+                                               stage('transform')], 1)
+        self.assertEqual(calls['validate'], chunks)
+        self.assertEqual(calls['transform'], chunks)
+        self.assertEqual(mock_renew.call_count, 20)
+
+    def test_run_pipeline_threaded_error(self):
+        """Test that a failing threaded stage stops the pipeline"""
+        loaded = []
+
+        def failing_stage(ids, context):
+            raise SystemExit('Exiting! Can not make connection with XIS.')
+
+        with self.assertRaises(SystemExit), \
+                patch('openlxp_xia.management.commands.run_pipeline.'
+                      'renew_pipeline_leases'):
+            run_pipeline_threaded([[ind] for ind in range(10)], {},
+                                  [failing_stage,
+                                   lambda ids, context: loaded.append(ids)],
+                                  1)
+        self.assertEqual(loaded, [])
+
+    # Test cases for run_xia_worker
+
+    @data((1, False, 2), (2, False, 4), (40, False, 60), (60, True, 1),
+          (0, False, 2))
+    @unpack
+    def test_get_next_sleep(self, sleep, found_work, expected_sleep):
+        """Test that the sleep doubles without work up to the maximum"""
+        self.assertEqual(get_next_sleep(sleep, found_work, 1, 60),
+                         expected_sleep)
+
+    def run_test_worker(self, stage):
+        """Runs the worker on two chunks with a single stage"""
+        stop = threading.Event()
+        reset_metrics()
+        with patch('openlxp_xia.management.commands.run_xia_worker.'
+                   'get_pipeline_context', return_value={}) as context, \
+                patch('openlxp_xia.management.commands.run_xia_worker.'
+                      'get_pipeline_record_chunks',
+                      return_value=[[1], [2]]), \
+                patch('openlxp_xia.management.commands.run_xia_worker.'
+                      'close_old_connections'), \
+                patch('openlxp_xia.management.commands.run_xia_worker.'
+                      'connection'), \
+                patch('openlxp_xia.management.commands.run_xia_worker.'
+                      'flush_metrics') as mock_flush:
+            run_worker(stop, min_sleep=0.01, max_sleep=0.01,
+                       stages=[lambda ids, context: stage(ids, stop)])
+        return context, mock_flush
+
+    def test_run_worker(self):
+        """Test that the worker keeps its context between cycles and
+        completes the current chunk when stopped"""
+        calls = []
+
+        def stage(ids, stop):
+            calls.append(ids)
+            if len(calls) < 3:
+                increment('transform.records')
+            else:
+                stop.set()
+
+        context, mock_flush = self.run_test_worker(stage)
+        self.assertEqual(calls, [[1], [2], [1]])
+        self.assertEqual(context.call_count, 1)
+        self.assertEqual(mock_flush.call_count, 1)
+
+    def test_run_worker_failure(self):
+        """Test that the worker keeps running after a failed cycle"""
+        calls = []
+
+        def stage(ids, stop):
+            calls.append(ids)
+            if len(calls) == 1:
+                raise SystemExit('Exiting! Can not make connection with '
+                                 'XIS.')
+            stop.set()
+
+        self.run_test_worker(stage)
+        self.assertEqual(calls, [[1], [1]])
+
+    # Test cases for report_validation_findings
+
+    def create_validation_findings(self):
+        """Stores findings of two fields, the second failing most often"""
+        ValidationFinding.objects.bulk_create(
+            [ValidationFinding(stage='validate_target',
+                               finding_type='Required',
+                               field_path='Course.CourseTitle',
+                               metadata_key_hash='hash1')] +
+            [ValidationFinding(stage='validate_source',
+                               finding_type='Recommended',
+                               field_path='Start_date',
+                               metadata_key_hash='hash%s' % ind)
+             for ind in range(3)])
+
+    def test_get_finding_counts(self):
+        """Test that findings are counted per field, most frequent first"""
+        self.create_validation_findings()
+        self.assertEqual(get_finding_counts(), [
+            ('validate_source', 'Recommended', 'Start_date', 3),
+            ('validate_target', 'Required', 'Course.CourseTitle', 1)])
+        self.assertEqual(get_finding_counts(stage='validate_target'), [
+            ('validate_target', 'Required', 'Course.CourseTitle', 1)])
+        self.assertEqual(get_finding_counts(top=1), [
+            ('validate_source', 'Recommended', 'Start_date', 3)])
+
+    def test_report_validation_findings(self):
+        """Test that the report command prints a line per field"""
+        self.create_validation_findings()
+        stdout = io.StringIO()
+        call_command('report_validation_findings', finding_type='Required',
+                     stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1].split(), ['validate_target', 'Required',
+                                            '1', 'Course.CourseTitle'])
+
+    def test_purge_findings(self):
+        """Test that findings older than the given days are deleted"""
+        self.create_validation_findings()
+        ValidationFinding.objects.filter(field_path='Start_date').update(
+            created=timezone.now() - datetime.timedelta(days=40))
+        self.assertEqual(purge_findings(30), 3)
+        self.assertEqual(ValidationFinding.objects.count(), 1)
+
+    def test_commands_are_instrumented(self):
+        """Test that every command accepts the instrumentation and
+        profiling options"""
+        for module_info in pkgutil.iter_modules(commands.__path__):
+            module = importlib.import_module(
+                commands.__name__ + '.' + module_info.name)
+            self.assertTrue(issubclass(module.Command, InstrumentedCommand),
+                            module_info.name)
@@ -1,3 +1,5 @@
+import datetime
+import uuid
 from unittest.mock import patch
 
 from django.core.exceptions import ValidationError
@@ -258,3 +260,37 @@ class ModelTests(TestCase):
                          field_value)
         self.assertEqual(metadata_field_overwrite.overwrite,
                          overwrite)
+
+    def test_ledger_json_field_round_trip(self):
+        """Test that ledger JSON fields store UUIDs and datetimes the same
+        way DjangoJSONEncoder renders them"""
+        record_id = uuid.UUID('09edea0e-6c83-40a6-951e-2acee3e99502')
+        metadata_ledger = MetadataLedger(
+            source_metadata={'id': record_id,
+                             'date': datetime.datetime(
+                                 2021, 3, 4, 5, 6, 7, 891234,
+                                 tzinfo=timezone.utc)},
+            target_metadata={'Course': {'CourseCode': 'TestData 123'}})
+        metadata_ledger.save()
+
+        saved = MetadataLedger.objects.get(
+            metadata_record_uuid=metadata_ledger.metadata_record_uuid)
+        self.assertEqual(saved.source_metadata,
+                         {'id': str(record_id),
+                          'date': '2021-03-04T05:06:07.891Z'})
+        self.assertEqual(saved.target_metadata,
+                         {'Course': {'CourseCode': 'TestData 123'}})
+
+    def test_metadata_ledger_clean(self):
+        """Test that cleaning ledger records sanitizes their metadata"""
+        metadata_ledger = MetadataLedger(
+            source_metadata={'name': '<b>name</b>', 'list': ['<i>a</i>']})
+        metadata_ledger.clean()
+        self.assertEqual(metadata_ledger.source_metadata,
+                         {'name': 'name', 'list': ['a']})
+
+        supplemental_ledger = SupplementalLedger(
+            supplemental_metadata={'name': '<b>name</b>'})
+        supplemental_ledger.clean()
+        self.assertEqual(supplemental_ledger.supplemental_metadata,
+                         {'name': 'name'})
@@ -1,33 +1,223 @@
+import datetime
+import decimal
+import gzip
 import hashlib
+import json
 import logging
+import os
+import pstats
+import signal
+import tempfile
+import threading
+import uuid
 from unittest.mock import patch
 
+import bleach
+import requests
 from ddt import data, ddt, unpack
-from django.test import tag
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError
+from django.db.models import Q
+from django.test import override_settings, tag
+from django.utils import timezone
 
+from openlxp_xia.management.utils.findings import (flush_findings,
+                                                   get_findings,
+                                                   reset_findings)
+from openlxp_xia.management.utils.instrumentation import (
+    format_prometheus, format_statsd, get_metrics, increment, reset_metrics,
+    send_statsd, timer)
+from openlxp_xia.management.utils.json_serializer import (dumps, loads,
+                                                          use_orjson)
+from openlxp_xia.management.utils.lazy_import import lazy_import
+from openlxp_xia.management.utils.leases import (claim_records,
+                                                 recover_pending_records,
+                                                 release_leases,
+                                                 renew_leases)
+from openlxp_xia.management.utils.log_queue import (LogRecordQueue,
+                                                    XIAQueueHandler)
+from openlxp_xia.management.utils.model_help import (
+    HomoglyphFinding, bleach_clean_string, clean_string,
+    confusable_homoglyphs_check, find_homoglyphs,
+    get_dangerous_homoglyph_aliases, get_homoglyph_aliases,
+    sanitize_metadata, sanitize_metadata_batch)
+from openlxp_xia.management.utils.profiling import (profile_records,
+                                                    profile_thread,
+                                                    start_profiling,
+                                                    stop_profiling)
+from openlxp_xia.management.utils.stub_server import StubServer
+from openlxp_xia.management.utils.transactions import (CommitBatch,
+                                                       exit_on_sigterm,
+                                                       record_writes)
 from openlxp_xia.management.utils.xia_internal import (
     dict_flatten, flatten_dict_object, flatten_list_object, get_key_dict,
-    get_publisher_detail, get_target_metadata_key_value, is_date,
-    replace_field_on_target_schema, type_cast_overwritten_values,
+    get_key_digest, get_key_filter, get_normalization_plan,
+    get_publisher_detail, get_target_key_fields,
+    get_target_metadata_key_value, is_date, replace_field_on_target_schema,
+    required_recommended_logs, type_cast_overwritten_values,
     update_flattened_object)
 from openlxp_xia.management.utils.xis_client import (
-    get_xis_metadata_api_endpoint, get_xis_supplemental_metadata_api_endpoint)
+    close_xis_session, compress_request_body, get_xis_http_client,
+    get_xis_metadata_api_endpoint, get_xis_supplemental_metadata_api_endpoint,
+    get_xis_timeout, open_xis_session, post_to_xis, uncompressed_endpoints)
 from openlxp_xia.management.utils.xss_client import (
     get_data_types_for_validation, get_required_fields_for_validation,
     get_source_validation_schema, get_target_metadata_for_transformation,
     get_target_validation_schema, read_json_data, xss_get)
-from openlxp_xia.models import XIAConfiguration, XISConfiguration
+from openlxp_xia.models import (MetadataLedger, ValidationFinding,
+                                ValueNormalizationRule, XIAConfiguration,
+                                XISConfiguration)
 
+from .benchmark_setup import run_command_imports
 from .test_setup import TestSetUp
 
 logger = logging.getLogger('dict_config_logger')
 
+# modules imported at their first use rather than with the commands
+LAZY_MODULES = ('pandas', 'bleach', 'dateutil.parser',
+                'confusable_homoglyphs.confusables')
+
 
 @tag('unit')
 @ddt
 class UtilsTests(TestSetUp):
     """Unit Test cases for utils """
 
+    # Test cases for JSON_SERIALIZER
+
+    def serializer_test_data(self):
+        """Data covering the types DjangoJSONEncoder handles"""
+        return {
+            'uuid': uuid.UUID('09edea0e-6c83-40a6-951e-2acee3e99502'),
+            'aware': datetime.datetime(2021, 3, 4, 5, 6, 7, 891234,
+                                       tzinfo=timezone.utc),
+            'offset': datetime.datetime(
+                2021, 3, 4, 5, 6, 7, tzinfo=datetime.timezone(
+                    datetime.timedelta(hours=-5))),
+            'naive': datetime.datetime(2021, 3, 4, 5, 6, 7, 1000),
+            'date': datetime.date(2021, 3, 4),
+            'time': datetime.time(5, 6, 7, 891234),
+            'duration': datetime.timedelta(days=1, seconds=5),
+            'decimal': decimal.Decimal('1.10'),
+            'nested': [{'uuid': uuid.UUID(int=1)}, 'text', 1, 1.5, None,
+                       True]
+        }
+
+    def test_dumps_equivalent_to_django_encoder(self):
+        """Test that the serializer renders values exactly as
+        DjangoJSONEncoder"""
+        test_data = self.serializer_test_data()
+        expected = json.loads(json.dumps(test_data, cls=DjangoJSONEncoder))
+        self.assertEqual(json.loads(dumps(test_data)), expected)
+        with override_settings(XIA_JSON_BACKEND='json'):
+            self.assertFalse(use_orjson())
+            self.assertEqual(dumps(test_data),
+                             json.dumps(test_data, cls=DjangoJSONEncoder))
+
+    def test_dumps_fallback(self):
+        """Test that data orjson rejects is serialized by the stdlib"""
+        test_data = {1: 'int key', 'big': 2 ** 70}
+        self.assertEqual(json.loads(dumps(test_data)),
+                         json.loads(json.dumps(test_data)))
+        with self.assertRaises(TypeError):
+            dumps({'unsupported': object()})
+
+    def test_dumps_non_finite_floats(self):
+        """Test that both backends render NaN and Infinity alike"""
+        test_data = {'nan': float('nan'), 'nested': [
+            {'inf': float('inf'), 'ninf': float('-inf')}, None, 1.5]}
+        expected = json.dumps(test_data, cls=DjangoJSONEncoder)
+        self.assertEqual(dumps(test_data), expected)
+        with override_settings(XIA_JSON_BACKEND='json'):
+            self.assertEqual(dumps(test_data), expected)
+        self.assertEqual(json.loads(dumps({'a': None, 'b': [1.5]})),
+                         {'a': None, 'b': [1.5]})
+
+    @data('{"a": [1, 2.5, "b", null, true]}', b'{"a": {"b": "c"}}',
+          '{"a": NaN}')
+    def test_loads_equivalent_to_json(self, value):
+        """Test that deserialized data matches the stdlib"""
+        self.assertEqual(str(loads(value)), str(json.loads(value)))
+
+    # Test cases for MODEL_HELP
+
+    @data('plain text', 'é ü 中', 'tab\tnew\nline', 'a > b', 'a & b',
+          '<p>hi</p>', 'x\r\ny', 'nul\x00x', '\x01ctl', '')
+    def test_clean_string(self, value):
+        """Test that cleaning strings matches bleach"""
+        self.assertEqual(clean_string(value),
+                         bleach.clean(value, tags={}, strip=True))
+
+    def test_clean_string_skips_bleach(self):
+        """Test that strings without markup are not passed to bleach"""
+        with patch('openlxp_xia.management.utils.model_help.bleach') as \
+                mock_bleach:
+            self.assertEqual(clean_string('no markup here'), 'no markup here')
+            self.assertEqual(mock_bleach.clean.call_count, 0)
+
+    def test_sanitize_metadata(self):
+        """Test that nested dictionaries and lists are sanitized"""
+        test_data = {"key1": "<b>value1</b>",
+                     "key2": {"sub_key1": "sub <i>value</i>"},
+                     "key3": ["<p>item</p>", {"sub_key2": "a & b"}, 1]}
+        sanitized, findings = sanitize_metadata(test_data)
+        self.assertEqual(findings, [])
+        self.assertEqual(sanitized, {
+            "key1": "value1",
+            "key2": {"sub_key1": "sub value"},
+            "key3": ["item", {"sub_key2": "a &amp; b"}, 1]})
+
+    def test_sanitize_metadata_batch_homoglyphs(self):
+        """Test that records with dangerous homoglyphs are flagged"""
+        results = sanitize_metadata_batch([{"key": "safe"},
+                                           {"key": ["ρаypаl"]}])
+        self.assertEqual([findings for _, findings in results],
+                         [[], [HomoglyphFinding(
+                             'key[0]', ('CYRILLIC', 'GREEK', 'LATIN'))]])
+
+    def test_get_dangerous_homoglyph_aliases_ascii(self):
+        """Test that ASCII strings skip the homoglyph check"""
+        with patch('openlxp_xia.management.utils.model_help.confusables') \
+                as mock_confusables:
+            self.assertIsNone(get_dangerous_homoglyph_aliases('paypal'))
+            self.assertEqual(mock_confusables.is_dangerous.call_count, 0)
+
+    def test_get_dangerous_homoglyph_aliases_cached(self):
+        """Test that homoglyph verdicts are cached for repeated strings"""
+        get_homoglyph_aliases.cache_clear()
+        for _ in range(3):
+            self.assertEqual(get_dangerous_homoglyph_aliases('Alloρ'),
+                             ('GREEK', 'LATIN'))
+            self.assertIsNone(get_dangerous_homoglyph_aliases('Allô'))
+        self.assertEqual(get_homoglyph_aliases.cache_info().misses, 2)
+        self.assertEqual(get_homoglyph_aliases.cache_info().hits, 4)
+
+    def test_long_strings_not_cached(self):
+        """Test that long strings are checked and cleaned without being
+        cached"""
+        get_homoglyph_aliases.cache_clear()
+        bleach_clean_string.cache_clear()
+        long_value = 'Alloρ ' * 100
+        self.assertEqual(get_dangerous_homoglyph_aliases(long_value),
+                         ('COMMON', 'GREEK', 'LATIN'))
+        self.assertEqual(clean_string('<b>' + long_value + '</b>'),
+                         long_value)
+        self.assertEqual(get_homoglyph_aliases.cache_info().currsize, 0)
+        self.assertEqual(bleach_clean_string.cache_info().currsize, 0)
+
+    def test_find_homoglyphs(self):
+        """Test that findings carry the path of the dangerous fields"""
+        test_data = {"key1": "safe",
+                     "key2": {"sub_key1": "Alloρ"},
+                     "key3": [{"sub_key2": "ΑlaskaJazz"}]}
+        self.assertEqual(
+            [finding.field_path for finding in find_homoglyphs(test_data)],
+            ['key2.sub_key1', 'key3[0].sub_key2'])
+        self.assertFalse(confusable_homoglyphs_check(test_data))
+        self.assertTrue(confusable_homoglyphs_check({"key1": "safe"}))
+
     # Test cases for XIA_INTERNAL
 
     def test_get_publisher_detail(self):
@@ -74,6 +264,48 @@ class UtilsTests(TestSetUp):
         self.assertEqual(test_dict1['1']['Course']['EducationalContext'],
                          'Non - Mandatory')
 
+    def test_get_normalization_plan(self):
+        """Test that rules are compiled by field, the rule added last winning
+        for the same value"""
+        ValueNormalizationRule.objects.create(
+            target_field_path='Course.CourseLevel', input_values=['1', 1],
+            output_value='Beginner')
+        ValueNormalizationRule.objects.create(
+            target_field_path='Course.EducationalContext',
+            input_values=['m'], output_value='Mandatory')
+        ValueNormalizationRule.objects.create(
+            target_field_path='Course.CourseLevel', input_values=[1],
+            output_value='Introductory')
+
+        normalization_plan = get_normalization_plan()
+        self.assertEqual(normalization_plan[('Course', 'CourseLevel')],
+                         {'1': 'Beginner', 1: 'Introductory'})
+        self.assertEqual(
+            normalization_plan[('Course', 'EducationalContext')],
+            {'y': 'Mandatory', 'Y': 'Mandatory', 'n': 'Non - Mandatory',
+             'N': 'Non - Mandatory', 'm': 'Mandatory'})
+
+    def test_replace_field_on_target_schema_plan(self):
+        """Test that a compiled plan replaces only matching values of
+        present fields"""
+        normalization_plan = {('Course', 'CourseLevel'): {'1': 'Beginner'},
+                              ('Lifecycle', 'Provider'): {'a': 'b'},
+                              ('Course', 'Tags'): {'x': 'y'}}
+        test_dict = {0: {'Course': {'CourseLevel': '1', 'Tags': ['x'],
+                                    'EducationalContext': 'y'}}}
+
+        replace_field_on_target_schema(0, test_dict, normalization_plan)
+        self.assertEqual(test_dict[0], {
+            'Course': {'CourseLevel': 'Beginner', 'Tags': ['x'],
+                       'EducationalContext': 'y'}})
+
+    def test_value_normalization_rule_clean(self):
+        """Test that input values must be a list of text or numbers"""
+        with self.assertRaises(ValidationError):
+            ValueNormalizationRule(target_field_path='Course.CourseLevel',
+                                   input_values={'1': 'Beginner'},
+                                   output_value='Beginner').clean()
+
     @data((1, False), ("1990-12-1", True), ("Monday at 12:01am", True))
     @unpack
     def test_is_date(self, value_to_be_tested, result):
@@ -95,9 +327,72 @@ class UtilsTests(TestSetUp):
         expected_key_hash = hashlib.sha512(expected_key.encode('utf-8')). \
             hexdigest()
 
-        result_key_dict = get_target_metadata_key_value(test_dict)
+        result_key_dict = get_target_metadata_key_value(
+            test_dict, (('Course', 'CourseCode'),
+                        ('Course', 'CourseProviderName')))
         self.assertEqual(result_key_dict['key_value'], expected_key)
         self.assertEqual(result_key_dict['key_value_hash'], expected_key_hash)
+        self.assertEqual(result_key_dict['key_value_digest'],
+                         get_key_digest(expected_key))
+
+    def test_get_target_metadata_key_value_key_fields(self):
+        """Test key creation from configured target key fields"""
+        test_dict = {'Course': {'CourseCode': 'code'},
+                     'Lifecycle': {'Provider': 'provider'}}
+
+        result_key_dict = get_target_metadata_key_value(
+            test_dict, (('Lifecycle', 'Provider'), ('Course', 'CourseCode')))
+
+        self.assertEqual(result_key_dict['key_value'], 'provider_code')
+
+    def test_get_target_key_fields(self):
+        """Test compiling the configured target key fields, the default
+        ones being used without XIA configuration"""
+        with patch('openlxp_xia.management.utils.xia_internal'
+                   '.XIAConfiguration.objects') as xiaCfg:
+            xiaCfg.first.return_value = XIAConfiguration(
+                target_key_fields='Course.CourseCode, Lifecycle.Provider')
+            self.assertEqual(get_target_key_fields(),
+                             (('Course', 'CourseCode'),
+                              ('Lifecycle', 'Provider')))
+
+            xiaCfg.first.return_value = None
+            self.assertEqual(get_target_key_fields(),
+                             (('Course', 'CourseCode'),
+                              ('Course', 'CourseProviderName')))
+
+    @data('CourseCode', 'Course.CourseCode,Provider', 'Course.',
+          '.CourseCode')
+    def test_get_target_key_fields_invalid(self, key_fields):
+        """Test that key fields not written as Section.Field are reported
+        as a configuration error, and rejected by the model"""
+        with patch('openlxp_xia.management.utils.xia_internal'
+                   '.XIAConfiguration.objects') as xiaCfg:
+            xiaCfg.first.return_value = XIAConfiguration(
+                target_key_fields=key_fields)
+            with self.assertRaises(ImproperlyConfigured):
+                get_target_key_fields()
+        with self.assertRaises(ValidationError):
+            XIAConfiguration(target_key_fields=key_fields).clean_fields(
+                exclude=['publisher', 'xss_api', 'source_metadata_schema',
+                         'target_metadata_schema', 'source_file'])
+
+    def test_get_key_digest(self):
+        """Test key digests are 32 hexadecimal characters"""
+        digest = get_key_digest('key_field1_key_field2')
+        self.assertEqual(len(digest), 32)
+        int(digest, 16)
+        self.assertNotEqual(digest, get_key_digest('key_field1_key_field3'))
+
+    def test_get_key_filter(self):
+        """Test records are looked up by key digest, or by key hash when
+        they have no digest"""
+        self.assertEqual(get_key_filter('source_metadata', 'hash', 'digest'),
+                         Q(source_metadata_key_digest='digest') |
+                         Q(source_metadata_key_digest='',
+                           source_metadata_key_hash='hash'))
+        self.assertEqual(get_key_filter('source_metadata', 'hash', ''),
+                         Q(source_metadata_key_hash='hash'))
 
     def test_dict_flatten(self):
         """Test function to navigate to value in source
@@ -383,6 +678,14 @@ class UtilsTests(TestSetUp):
         values = type_cast_overwritten_values(field_type, field_value)
         self.assertNotIsInstance(values, int)
 
+    @data(("yes", 1), ("True", 1), ("off", 0), ("0", 0), ("maybe", "maybe"))
+    @unpack
+    def test_type_cast_overwritten_values_bool(self, field_value, expected):
+        """Test that bool overwritten values are converted like
+        distutils.util.strtobool"""
+        self.assertEqual(type_cast_overwritten_values("bool", field_value),
+                         expected)
+
     # Test cases for XIS_CLIENT
 
     def test_get_xis_metadata_api_endpoint(self):
@@ -408,6 +711,81 @@ class UtilsTests(TestSetUp):
             self.assertEqual(xisConfig.xis_supplemental_api_endpoint,
                              return_from_function)
 
+    @data('none', '', None)
+    def test_compress_request_body_none(self, compression):
+        """Test that request bodies are sent as is without compression"""
+        body, encoding = compress_request_body('{"a": "b"}', compression)
+        self.assertEqual(body, '{"a": "b"}')
+        self.assertIsNone(encoding)
+
+    def test_compress_request_body_gzip(self):
+        """Test that request bodies are gzip compressed"""
+        body, encoding = compress_request_body('{"a": "b"}', 'gzip')
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gzip.decompress(body), b'{"a": "b"}')
+
+    def test_compress_request_body_zstd_fallback(self):
+        """Test that zstd falls back to gzip when zstandard is missing"""
+        with patch.dict('sys.modules', {'zstandard': None}):
+            body, encoding = compress_request_body('{"a": "b"}', 'zstd')
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gzip.decompress(body), b'{"a": "b"}')
+
+    def test_post_to_xis_compressed(self):
+        """Test that compressed bodies carry the Content-Encoding header"""
+        with patch('requests.post') as response_obj:
+            response_obj.return_value = response_obj
+            response_obj.status_code = 201
+            post_to_xis(self.xis_api_endpoint_url, '{"a": "b"}', 'gzip')
+            headers = response_obj.call_args[1]['headers']
+            self.assertEqual(headers['Content-Encoding'], 'gzip')
+
+    def test_post_to_xis_unsupported_encoding(self):
+        """Test that a 415 response resends the body uncompressed"""
+        url = 'http://openlxp-xis:8020/api/unsupported/'
+        with patch('requests.post') as response_obj:
+            response_obj.return_value = response_obj
+            response_obj.status_code = 415
+            post_to_xis(url, '{"a": "b"}', 'gzip')
+            self.assertEqual(response_obj.call_count, 2)
+            self.assertEqual(response_obj.call_args[1]['data'], '{"a": "b"}')
+            self.assertIn(url, uncompressed_endpoints)
+        uncompressed_endpoints.discard(url)
+
+    @override_settings(XIA_XIS_TIMEOUT=30, XIA_PENDING_SECONDS=300)
+    def test_post_to_xis_timeout(self):
+        """Test that both POSTs of a record time out"""
+        url = 'http://openlxp-xis:8020/api/timeout/'
+        with patch('requests.post') as response_obj:
+            response_obj.return_value = response_obj
+            response_obj.status_code = 415
+            post_to_xis(url, '{"a": "b"}', 'gzip')
+            self.assertEqual([call[1]['timeout'] for call in
+                              response_obj.call_args_list], [30, 30])
+        uncompressed_endpoints.discard(url)
+
+    @override_settings(XIA_XIS_TIMEOUT=300, XIA_PENDING_SECONDS=100)
+    def test_get_xis_timeout_pending(self):
+        """Test that POSTs time out before their record is recovered"""
+        self.assertEqual(get_xis_timeout(), 25)
+
+    def test_post_to_xis_session(self):
+        """Test that requests go through the XIS session while it is
+        open"""
+        session = open_xis_session()
+        try:
+            self.assertIs(open_xis_session(), session)
+            with patch.object(session, 'post') as response_obj, \
+                    patch('requests.post') as requests_post:
+                response_obj.return_value = response_obj
+                response_obj.status_code = 201
+                post_to_xis(self.xis_api_endpoint_url, '{"a": "b"}', None)
+                self.assertEqual(response_obj.call_count, 1)
+                self.assertEqual(requests_post.call_count, 0)
+        finally:
+            close_xis_session()
+        self.assertIs(get_xis_http_client(), requests)
+
     # Test cases for XSS_CLIENT
 
     def test_get_source_validation_schema(self):
@@ -503,3 +881,452 @@ class UtilsTests(TestSetUp):
             req.json.return_value = schema
 
             self.assertEqual(read_json_data(""), schema['schema'])
+
+    # Test cases for INSTRUMENTATION
+
+    def test_timer_and_increment(self):
+        """Test that timers and counters are recorded"""
+        reset_metrics()
+
+        @timer('stage')
+        def stage():
+            with timer('stage.step'):
+                increment('stage.records')
+
+        stage()
+        stage()
+        timers, counters = get_metrics()
+        self.assertEqual(timers['stage'][0], 2)
+        self.assertEqual(timers['stage.step'][0], 2)
+        self.assertEqual(counters, {'stage.records': 2})
+
+    def test_format_prometheus(self):
+        """Test metrics rendered in the Prometheus text format"""
+        reset_metrics()
+        with timer('transform.map'):
+            increment('transform.records', 3)
+        text = format_prometheus('transform_source_metadata')
+        self.assertIn('xia_step_duration_seconds_count{command="transform_'
+                      'source_metadata",step="transform.map"} 1', text)
+        self.assertIn('xia_events_total{command="transform_source_metadata'
+                      '",event="transform.records"} 3', text)
+
+    def test_send_statsd(self):
+        """Test that metrics are sent to StatsD in small datagrams"""
+        reset_metrics()
+        for ind in range(50):
+            increment('load_target.event%s' % ind)
+        with patch('openlxp_xia.management.utils.instrumentation.socket'
+                   '.socket') as mock_socket:
+            sock = mock_socket.return_value.__enter__.return_value
+            send_statsd('localhost:8125', 'xia.load_target_metadata')
+            packets = [call[0][0] for call in sock.sendto.call_args_list]
+            self.assertGreater(len(packets), 1)
+            self.assertTrue(all(len(packet) <= 512 for packet in packets))
+            self.assertEqual(sum(packet.count(b'\n') + 1
+                                 for packet in packets),
+                             len(format_statsd('xia.load_target_metadata')))
+            self.assertEqual(sock.sendto.call_args[0][1],
+                             ('localhost', 8125))
+
+    def test_instrumented_command_textfile(self):
+        """Test that a command writes its metrics at exit"""
+        with patch('openlxp_xia.management.commands.validate_source_metadata'
+                   '.get_source_validation_schema',
+                   return_value=self.schema_data_dict), \
+                patch('openlxp_xia.management.commands.'
+                      'validate_source_metadata'
+                      '.get_source_metadata_for_validation',
+                      return_value=[]), \
+                tempfile.TemporaryDirectory() as output_dir:
+            textfile = os.path.join(output_dir, 'xia.prom')
+            call_command('validate_source_metadata',
+                         metrics_textfile=textfile)
+            with open(textfile) as file:
+                self.assertIn('step="validate_source.query"', file.read())
+
+    # Test cases for PROFILING
+
+    def test_profile_records_sample(self):
+        """Test that the profiler only runs for sampled records"""
+        with patch('openlxp_xia.management.utils.profiling.cProfile'
+                   '.Profile') as mock_profile, \
+                patch('openlxp_xia.management.utils.profiling.random'
+                      '.random', side_effect=[0.1, 0.9, 0.2]), \
+                tempfile.TemporaryDirectory() as output_dir, \
+                override_settings(LOG_PATH=os.path.join(output_dir,
+                                                        'xia.log')):
+            start_profiling('cpu', 50)
+            self.assertEqual(list(profile_records(['a', 'b', 'c'])),
+                             ['a', 'b', 'c'])
+            self.assertEqual(mock_profile.return_value.enable.call_count, 2)
+            stop_profiling('test_command')
+
+    def test_profile_thread(self):
+        """Test that work done in other threads is in the written profile
+        while the whole run is profiled"""
+        def stage_work():
+            return sorted(range(1000), key=str)
+
+        def thread_work():
+            with profile_thread():
+                stage_work()
+
+        with tempfile.TemporaryDirectory() as output_dir, \
+                override_settings(LOG_PATH=os.path.join(output_dir,
+                                                        'xia.log')):
+            start_profiling('cpu')
+            thread = threading.Thread(target=thread_work)
+            thread.start()
+            thread.join()
+            file_path, = stop_profiling('test_command')
+            functions = {function[2] for function in
+                         pstats.Stats(file_path).stats}
+            self.assertIn('stage_work', functions)
+
+    def test_command_profile(self):
+        """Test that a profiled command writes its reports next to the
+        logs"""
+        with patch('openlxp_xia.management.commands.validate_source_metadata'
+                   '.get_source_validation_schema',
+                   return_value=self.schema_data_dict), \
+                patch('openlxp_xia.management.commands.'
+                      'validate_source_metadata'
+                      '.get_source_metadata_for_validation',
+                      return_value=[]), \
+                tempfile.TemporaryDirectory() as output_dir, \
+                override_settings(LOG_PATH=os.path.join(output_dir,
+                                                        'xia.log')):
+            call_command('validate_source_metadata', profile='all')
+            file_names = sorted(os.listdir(output_dir))
+
+            self.assertEqual(len(file_names), 2)
+            self.assertTrue(file_names[0].endswith('-allocations.txt'))
+            self.assertTrue(file_names[1].endswith('.pstats'))
+            pstats.Stats(os.path.join(output_dir, file_names[1]))
+
+    # Test cases for FINDINGS
+
+    @override_settings(XIA_FINDINGS_SAMPLE_SIZE=2)
+    def test_required_recommended_logs_aggregates(self):
+        """Test that findings are counted per field with sampled example
+        records"""
+        reset_findings()
+        with self.assertNoLogs('dict_config_logger', logging.INFO):
+            for record in ('a', 'b', 'c'):
+                required_recommended_logs(record, 'Required', 'Course.Name',
+                                          'validate_target')
+            required_recommended_logs('a', 'datatype', 'Course.Date',
+                                      'validate_target')
+
+        self.assertEqual(get_findings(), [
+            ('validate_target', 'Required', 'Course.Name', 3, ['a', 'b']),
+            ('validate_target', 'datatype', 'Course.Date', 1, ['a'])])
+
+    def test_flush_findings(self):
+        """Test that validation findings are stored in bulk and transform
+        findings are not"""
+        reset_findings()
+        required_recommended_logs('hash1', 'Required', 'Course.Name',
+                                  'validate_target')
+        required_recommended_logs(0, 'datatype', 'Course.Date', 'transform')
+        self.assertFalse(ValidationFinding.objects.exists())
+        flush_findings()
+
+        self.assertEqual(list(ValidationFinding.objects.values_list(
+            'stage', 'finding_type', 'field_path', 'metadata_key_hash')),
+            [('validate_target', 'Required', 'Course.Name', 'hash1')])
+
+    def test_command_findings_table(self):
+        """Test that a command logs a findings summary and writes the
+        findings table"""
+        data = [{'source_metadata_key_hash': 'hash1',
+                 'source_metadata': {}}]
+        with patch('openlxp_xia.management.commands.validate_source_metadata'
+                   '.get_source_validation_schema',
+                   return_value=self.schema_data_dict), \
+                patch('openlxp_xia.management.commands.'
+                      'validate_source_metadata'
+                      '.get_source_metadata_for_validation',
+                      return_value=data), \
+                patch('openlxp_xia.management.commands.'
+                      'validate_source_metadata'
+                      '.store_source_metadata_validation_status'), \
+                tempfile.TemporaryDirectory() as output_dir, \
+                self.assertLogs('dict_config_logger', logging.ERROR) as logs:
+            table_path = os.path.join(output_dir, 'findings.csv')
+            call_command('validate_source_metadata',
+                         findings_table=table_path)
+            with open(table_path) as file:
+                lines = file.read().splitlines()
+
+        self.assertEqual(lines[0], 'stage,category,field,count,examples')
+        self.assertTrue(any(line.startswith('validate_source,Required,')
+                            for line in lines[1:]))
+        self.assertTrue(all(line.endswith(',1,hash1') for line in lines[1:]))
+        self.assertIn('1 records with Required finding', logs.output[0])
+
+    # Test cases for LOG_QUEUE
+
+    def get_log_record(self, level, message):
+        """Returns a log record of the given level"""
+        return logging.LogRecord('test', level, __file__, 1, message, None,
+                                 None)
+
+    def test_log_record_queue_drops_oldest_debug(self):
+        """Test that a full queue drops its oldest DEBUG record, and never
+        a record above DEBUG"""
+        log_queue = LogRecordQueue(2)
+        for message in ('first', 'second', 'third'):
+            log_queue.put_dropping_oldest(
+                self.get_log_record(logging.DEBUG, message))
+        self.assertEqual([record.msg for record in log_queue.queue],
+                         ['second', 'third'])
+
+        log_queue = LogRecordQueue(1)
+        log_queue.put(self.get_log_record(logging.ERROR, 'error'))
+        log_queue.put_dropping_oldest(
+            self.get_log_record(logging.DEBUG, 'debug'))
+        self.assertEqual([record.msg for record in log_queue.queue],
+                         ['error'])
+        self.assertEqual(log_queue.dropped, 1)
+
+    def test_queue_handler_emits_on_listener_thread(self):
+        """Test that records are formatted and written by the target
+        handlers on the listener thread"""
+        emitted = []
+
+        class ListHandler(logging.Handler):
+            def emit(self, record):
+                emitted.append((self.format(record),
+                                threading.current_thread()))
+
+        queue_handler = XIAQueueHandler([ListHandler()])
+        test_logger = logging.getLogger('test_log_queue')
+        test_logger.addHandler(queue_handler)
+        try:
+            test_logger.warning("Record %s of %s", 1, 2)
+        finally:
+            test_logger.removeHandler(queue_handler)
+            queue_handler.close()
+
+        self.assertEqual(emitted[0][0], 'Record 1 of 2')
+        self.assertIsNot(emitted[0][1], threading.current_thread())
+
+    # Test cases for STUB_SERVER
+
+    def test_stub_server_schema_endpoints(self):
+        """Test that the stub server serves schemas and mappings to
+        read_json_data"""
+        with StubServer(schemas={'source.json': self.schema_data_dict},
+                        mappings={('target.json', 'source.json'):
+                                  self.source_target_mapping}) as stub, \
+                patch('openlxp_xia.management.utils.xss_client.xss_get',
+                      return_value=stub.url):
+            self.assertEqual(read_json_data('source.json'),
+                             self.schema_data_dict)
+            self.assertEqual(read_json_data('source.json', 'target.json'),
+                             self.source_target_mapping)
+            self.assertEqual(requests.get(stub.url + 'schemas/?name=none')
+                             .status_code, 404)
+
+    def test_stub_server_ledger_endpoints(self):
+        """Test that the stub server accepts single, batched and gzip
+        encoded records"""
+        XISConfiguration(xis_api_key='stub').save()
+        with StubServer() as stub:
+            response = post_to_xis(stub.url + 'metadata/',
+                                   json.dumps(self.target_data_dict), 'gzip')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.json(), self.target_data_dict)
+
+            response = requests.post(stub.url + 'supplemental-data/',
+                                     json=[self.supplemental_data] * 3)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.json()), 3)
+            self.assertEqual(stub.stub_settings.stats['created'], 4)
+
+    def test_stub_server_failures(self):
+        """Test that the stub server answers with the configured error and
+        throttling responses"""
+        with StubServer(error_rate=1) as stub:
+            self.assertEqual(requests.post(stub.url + 'metadata/',
+                                           json={}).status_code, 500)
+            stub.stub_settings.error_rate = 0
+            stub.stub_settings.throttle_rate = 1
+            response = requests.post(stub.url + 'metadata/', json={})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers['Retry-After'], '1')
+            self.assertEqual(stub.stub_settings.stats['errors'], 1)
+            self.assertEqual(stub.stub_settings.stats['throttled'], 1)
+
+    # Test cases for LAZY_IMPORT
+
+    def test_lazy_import(self):
+        """Test that a module is imported at the first use of its proxy"""
+        with patch('openlxp_xia.management.utils.lazy_import.import_module',
+                   return_value=json) as mock_import:
+            proxy = lazy_import('json')
+            self.assertEqual(mock_import.call_count, 0)
+            self.assertEqual(proxy.dumps([1]), '[1]')
+            self.assertEqual(proxy.loads('[1]'), [1])
+            mock_import.assert_called_once_with('json')
+
+    def test_command_lazy_imports(self):
+        """Test that importing every command leaves the lazily imported
+        modules out of sys.modules"""
+        result = run_command_imports()
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+
+        imported_modules = json.loads(result.stdout.splitlines()[-1])
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, imported_modules)
+
+    # Test cases for TRANSACTIONS
+
+    def create_finding(self, key_hash):
+        """Writes a ValidationFinding row for a record"""
+        ValidationFinding.objects.create(
+            metadata_key_hash=key_hash, stage='validate_source',
+            field_path='Course.CourseCode', finding_type='Required')
+
+    def test_commit_batch_interval(self):
+        """Test that writes are committed every commit interval records"""
+        reset_metrics()
+        with CommitBatch('test_stage', commit_interval=2) as batch:
+            for key_hash in ('a', 'b', 'c'):
+                with batch.record(key_hash):
+                    self.create_finding(key_hash)
+
+        self.assertEqual(get_metrics()[1]['test_stage.commits'], 2)
+        self.assertEqual(ValidationFinding.objects.count(), 3)
+
+    def test_commit_batch_database_error(self):
+        """Test that a database error only rolls back the writes of its
+        record"""
+        reset_metrics()
+        with CommitBatch('test_stage') as batch:
+            for key_hash in ('a', 'b', 'c'):
+                with batch.record(key_hash):
+                    self.create_finding(key_hash)
+                    if key_hash == 'b':
+                        raise DatabaseError('bad record')
+
+        self.assertEqual(sorted(ValidationFinding.objects.values_list(
+            'metadata_key_hash', flat=True)), ['a', 'c'])
+        self.assertEqual(
+            get_metrics()[1]['test_stage.rolled_back'], 1)
+
+    def test_record_writes_database_error(self):
+        """Test that writes are committed as they are made and a database
+        error only skips its record"""
+        reset_metrics()
+        for key_hash in ('a', 'b'):
+            with record_writes('test_stage', key_hash):
+                self.create_finding(key_hash)
+                if key_hash == 'a':
+                    raise DatabaseError('bad record')
+
+        self.assertEqual(ValidationFinding.objects.count(), 2)
+        self.assertEqual(get_metrics()[1]['test_stage.write_errors'], 1)
+
+    def test_commit_batch_other_error(self):
+        """Test that writes made before other errors are kept"""
+        with self.assertRaises(SystemExit):
+            with CommitBatch('test_stage') as batch:
+                with batch.record('a'):
+                    self.create_finding('a')
+                    raise SystemExit('Exiting!')
+
+        self.assertEqual(ValidationFinding.objects.count(), 1)
+
+    # Test cases for LEASES
+
+    def create_ledger_records(self, count):
+        """Writes MetadataLedger rows waiting for the pipeline"""
+        return [MetadataLedger.objects.create(
+            record_lifecycle_status='Active', source_metadata={},
+            source_metadata_key_hash=str(index)).pk
+            for index in range(count)]
+
+    def test_claim_records(self):
+        """Test that records leased to another worker are skipped until
+        their lease expires"""
+        record_ids = self.create_ledger_records(3)
+        MetadataLedger.objects.filter(pk=record_ids[0]).update(
+            lease_owner='other',
+            lease_expires=timezone.now() + datetime.timedelta(hours=1))
+        MetadataLedger.objects.filter(pk=record_ids[1]).update(
+            lease_owner='crashed',
+            lease_expires=timezone.now() - datetime.timedelta(hours=1))
+
+        claimed = claim_records(MetadataLedger.objects.all(), owner='me')
+
+        self.assertEqual(claimed, [record_ids[2], record_ids[1]])
+        self.assertEqual(
+            MetadataLedger.objects.filter(lease_owner='me').count(), 2)
+        self.assertEqual(claim_records(MetadataLedger.objects.all(),
+                                       owner='another'), [])
+
+    def test_claim_records_limit(self):
+        """Test that records claimed longest ago are claimed first, up to
+        the limit"""
+        record_ids = self.create_ledger_records(3)
+        MetadataLedger.objects.filter(pk=record_ids[0]).update(
+            lease_expires=timezone.now())
+
+        claimed = claim_records(MetadataLedger.objects.all(), 2, 'me')
+
+        self.assertEqual(set(claimed), set(record_ids[1:]))
+
+    def test_release_and_renew_leases(self):
+        """Test that released records can be claimed again and renewed
+        leases are extended"""
+        self.create_ledger_records(2)
+        claim_records(MetadataLedger.objects.all(), 1, 'me')
+        with override_settings(XIA_LEASE_SECONDS=7200):
+            self.assertEqual(renew_leases(MetadataLedger, 'me'), 1)
+        self.assertGreater(
+            MetadataLedger.objects.get(lease_owner='me').lease_expires,
+            timezone.now() + datetime.timedelta(hours=1))
+
+        self.assertEqual(renew_leases(MetadataLedger, 'me', []), 0)
+        self.assertEqual(release_leases(MetadataLedger, 'me'), 1)
+
+        self.assertEqual(len(claim_records(MetadataLedger.objects.all(),
+                                           owner='other')), 2)
+
+    def test_recover_pending_records(self):
+        """Test that records left Pending are made ready again once their
+        pending lease and worker lease expired"""
+        record_ids = self.create_ledger_records(4)
+        now = timezone.now()
+        MetadataLedger.objects.update(
+            target_metadata_transmission_status='Pending',
+            target_metadata_pending_expires=now - datetime.timedelta(
+                minutes=1))
+        MetadataLedger.objects.filter(pk=record_ids[1]).update(
+            target_metadata_pending_expires=None)
+        MetadataLedger.objects.filter(pk=record_ids[2]).update(
+            target_metadata_pending_expires=now + datetime.timedelta(
+                minutes=1))
+        MetadataLedger.objects.filter(pk=record_ids[3]).update(
+            lease_owner='other',
+            lease_expires=now + datetime.timedelta(minutes=1))
+
+        self.assertEqual(
+            recover_pending_records(MetadataLedger, 'target_metadata'), 2)
+
+        self.assertEqual(set(MetadataLedger.objects.filter(
+            target_metadata_transmission_status='Ready').values_list(
+            'pk', flat=True)), set(record_ids[:2]))
+
+    def test_exit_on_sigterm(self):
+        """Test that SIGTERM raises SystemExit until the handler is
+        restored"""
+        previous_handler = signal.getsignal(signal.SIGTERM)
+        with self.assertRaises(SystemExit):
+            with exit_on_sigterm():
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        self.assertEqual(signal.getsignal(signal.SIGTERM), previous_handler)
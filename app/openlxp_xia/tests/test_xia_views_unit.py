@@ -0,0 +1,131 @@
+import logging
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import override_settings, tag
+from django.urls import reverse
+from django.utils import timezone
+
+from openlxp_xia.management.utils.instrumentation import (flush_metrics,
+                                                          increment,
+                                                          reset_metrics,
+                                                          timer)
+from openlxp_xia.models import MetadataLedger, SupplementalLedger
+
+from .test_setup import TestSetUp
+
+logger = logging.getLogger('dict_config_logger')
+
+
+@tag('unit')
+class ViewTests(TestSetUp):
+    """Unit Test cases for views """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def create_ledger_records(self):
+        """Create ledger records in different stages"""
+        MetadataLedger(record_lifecycle_status='Active',
+                       source_metadata=self.source_metadata,
+                       source_metadata_validation_status='Y').save()
+        MetadataLedger(record_lifecycle_status='Active',
+                       source_metadata=self.source_metadata,
+                       source_metadata_validation_status='N',
+                       target_metadata_transmission_status='Failed').save()
+        loaded = MetadataLedger(record_lifecycle_status='Active',
+                                source_metadata=self.source_metadata,
+                                source_metadata_validation_status='Y',
+                                target_metadata_validation_status='Y')
+        loaded.target_metadata_transmission_status = 'Successful'
+        loaded.save()
+        MetadataLedger.objects.filter(pk=loaded.pk).update(
+            source_metadata_extraction_date=timezone.now() - timedelta(
+                minutes=5),
+            target_metadata_transmission_date=timezone.now())
+        MetadataLedger(record_lifecycle_status='Inactive',
+                       source_metadata=self.source_metadata).save()
+        SupplementalLedger(record_lifecycle_status='Active',
+                           supplemental_metadata=self.supplemental_data
+                           ).save()
+
+    def test_metrics_ledger_gauges(self):
+        """Test that ledger backlog and validation gauges are served"""
+        self.create_ledger_records()
+
+        response = self.client.get(reverse('metrics'))
+        text = response.content.decode('utf-8')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('xia_ledger_records{ledger="metadata",'
+                      'transmission_status="Ready"} 1', text)
+        self.assertIn('xia_ledger_records{ledger="metadata",'
+                      'transmission_status="Failed"} 1', text)
+        self.assertIn('xia_ledger_records{ledger="supplemental",'
+                      'transmission_status="Ready"} 1', text)
+        self.assertIn('xia_ledger_validation_records{stage="source",'
+                      'status="Y"} 2', text)
+        self.assertIn('xia_ledger_validation_failure_ratio{stage="source"} '
+                      '0.333333', text)
+        self.assertIn('xia_transmission_latency_seconds{statistic="maximum"}',
+                      text)
+
+    def test_metrics_cached(self):
+        """Test that the ledgers are only counted once within the cache
+        timeout"""
+        self.create_ledger_records()
+        self.client.get(reverse('metrics'))
+        MetadataLedger(record_lifecycle_status='Active',
+                       source_metadata=self.source_metadata).save()
+
+        # only the stage metrics are queried
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('metrics'))
+        self.assertIn('transmission_status="Ready"} 1',
+                      response.content.decode('utf-8'))
+
+    def test_metrics_stage_metrics(self):
+        """Test that metrics flushed by the commands are accumulated and
+        served as histograms"""
+        for _ in range(2):
+            reset_metrics()
+            with timer('transform.map'):
+                increment('transform.records', 3)
+            flush_metrics('transform_source_metadata')
+
+        response = self.client.get(reverse('metrics'))
+        text = response.content.decode('utf-8')
+
+        self.assertIn('xia_step_duration_seconds_count{command="transform_'
+                      'source_metadata",step="transform.map"} 2', text)
+        self.assertIn('xia_step_duration_seconds_bucket{command="transform_'
+                      'source_metadata",step="transform.map",le="+Inf"} 2',
+                      text)
+        self.assertIn('xia_events_total{command="transform_source_metadata",'
+                      'event="transform.records"} 6', text)
+
+    @override_settings(XIA_METRICS_ENABLED=False)
+    def test_metrics_disabled(self):
+        """Test that metrics are not served when disabled"""
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(XIA_METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        """Test that metrics are only served to requests bearing the
+        token"""
+        self.assertEqual(self.client.get(reverse('metrics')).status_code,
+                         401)
+        self.assertEqual(self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong'
+        ).status_code, 401)
+        self.assertEqual(self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret'
+        ).status_code, 200)
+
+    def test_admin_url(self):
+        """Test that the admin is still routed next to the metrics"""
+        self.assertEqual(reverse('admin:index'), '/admin/')
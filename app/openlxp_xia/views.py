@@ -0,0 +1,140 @@
+import hmac
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F
+from django.db.models import Max
+from django.http import Http404, HttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+
+from openlxp_xia.management.utils.instrumentation import (get_stored_metrics,
+                                                          render_prometheus)
+from openlxp_xia.models import MetadataLedger, SupplementalLedger
+
+logger = logging.getLogger('dict_config_logger')
+
+LEDGER_METRICS_CACHE_KEY = 'openlxp_xia.ledger_metrics'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# transmission latency is averaged over the records loaded in this window
+TRANSMISSION_LATENCY_WINDOW = timedelta(hours=1)
+
+
+def get_ledger_metrics():
+    """Counting active ledger records by status with one grouped query per
+    ledger and measuring recent transmission latency"""
+    metadata_status = list(MetadataLedger.objects.filter(
+        record_lifecycle_status='Active').values(
+        'target_metadata_transmission_status',
+        'source_metadata_validation_status',
+        'target_metadata_validation_status').annotate(
+        records=Count('metadata_record_uuid')).order_by())
+
+    supplemental_status = list(SupplementalLedger.objects.filter(
+        record_lifecycle_status='Active').values(
+        'supplemental_metadata_transmission_status').annotate(
+        records=Count('metadata_record_uuid')).order_by())
+
+    latency = MetadataLedger.objects.filter(
+        target_metadata_transmission_status='Successful',
+        target_metadata_transmission_date__gte=timezone.now() -
+        TRANSMISSION_LATENCY_WINDOW).annotate(
+        latency=ExpressionWrapper(
+            F('target_metadata_transmission_date') -
+            F('source_metadata_extraction_date'),
+            output_field=DurationField())).aggregate(
+        average=Avg('latency'), maximum=Max('latency'))
+
+    return {
+        'metadata_status': metadata_status,
+        'supplemental_status': supplemental_status,
+        'latency_average': latency['average'],
+        'latency_maximum': latency['maximum']
+    }
+
+
+def get_cached_ledger_metrics():
+    """Retrieving ledger metrics from the cache, querying the ledgers at
+    most once every XIA_METRICS_CACHE_SECONDS"""
+    ledger_metrics = cache.get(LEDGER_METRICS_CACHE_KEY)
+    if ledger_metrics is None:
+        ledger_metrics = get_ledger_metrics()
+        cache.set(LEDGER_METRICS_CACHE_KEY, ledger_metrics,
+                  getattr(settings, 'XIA_METRICS_CACHE_SECONDS', 60))
+    return ledger_metrics
+
+
+def add_count(counts, key, records):
+    """Adding records to a count in a dictionary"""
+    counts[key] = counts.get(key, 0) + records
+
+
+def format_ledger_metrics(ledger_metrics):
+    """Rendering ledger gauges in the Prometheus text exposition format"""
+    transmission = {}
+    validation = {}
+    for row in ledger_metrics['metadata_status']:
+        add_count(transmission,
+                  ('metadata', row['target_metadata_transmission_status']),
+                  row['records'])
+        for stage in ('source', 'target'):
+            status = row[stage + '_metadata_validation_status'] or 'pending'
+            add_count(validation, (stage, status), row['records'])
+    for row in ledger_metrics['supplemental_status']:
+        add_count(transmission,
+                  ('supplemental',
+                   row['supplemental_metadata_transmission_status']),
+                  row['records'])
+
+    lines = ['# TYPE xia_ledger_records gauge']
+    for (ledger, status), records in sorted(transmission.items()):
+        lines.append('xia_ledger_records{ledger="%s",transmission_status='
+                     '"%s"} %d' % (ledger, status or 'none', records))
+
+    lines.append('# TYPE xia_ledger_validation_records gauge')
+    for (stage, status), records in sorted(validation.items()):
+        lines.append('xia_ledger_validation_records{stage="%s",status="%s"}'
+                     ' %d' % (stage, status, records))
+
+    lines.append('# TYPE xia_ledger_validation_failure_ratio gauge')
+    for stage in ('source', 'target'):
+        failed = validation.get((stage, 'N'), 0)
+        validated = failed + validation.get((stage, 'Y'), 0)
+        if validated:
+            lines.append('xia_ledger_validation_failure_ratio{stage="%s"} '
+                         '%f' % (stage, failed / validated))
+
+    lines.append('# TYPE xia_transmission_latency_seconds gauge')
+    for statistic in ('average', 'maximum'):
+        latency = ledger_metrics['latency_' + statistic]
+        if latency is not None:
+            lines.append('xia_transmission_latency_seconds{statistic="%s"} '
+                         '%f' % (statistic, latency.total_seconds()))
+    return '\n'.join(lines) + '\n'
+
+
+def is_metrics_request_allowed(request):
+    """Returns whether the request bears the token /metrics is restricted
+    to, if any"""
+    token = getattr(settings, 'XIA_METRICS_TOKEN', None)
+    if not token:
+        return True
+    return hmac.compare_digest(
+        request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token)
+
+
+@require_GET
+def metrics(request):
+    """Serving ledger gauges and the stage metrics recorded by the
+    management commands for Prometheus"""
+    if not getattr(settings, 'XIA_METRICS_ENABLED', True):
+        raise Http404('Metrics are disabled')
+    if not is_metrics_request_allowed(request):
+        return HttpResponse('Unauthorized', status=401,
+                            content_type=PROMETHEUS_CONTENT_TYPE)
+    text = format_ledger_metrics(get_cached_ledger_metrics()) + \
+        render_prometheus(get_stored_metrics())
+    return HttpResponse(text, content_type=PROMETHEUS_CONTENT_TYPE)
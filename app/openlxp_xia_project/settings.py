@@ -90,6 +90,9 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASSWORD'),
         'HOST': os.environ.get('DB_HOST'),
         'PORT': 3306,
+        # seconds connections are kept open between requests and worker
+        # cycles, 0 closes them every time
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
     }
 }
 
@@ -146,7 +149,7 @@ LOGGING = {
 
     'loggers': {
         'dict_config_logger': {
-            'handlers': ['console', 'file_logs'],
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': True,
         },
@@ -164,7 +167,16 @@ LOGGING = {
             'filename': LOG_PATH,
             'formatter': 'simpleRe',
         },
-
+        # console and file_logs are written on a background thread, the
+        # queue handler being configured after them as handlers are
+        # configured in name order
+        'queue': {
+            'class': 'openlxp_xia.management.utils.log_queue.'
+                     'XIAQueueHandler',
+            'targets': ['cfg://handlers.console',
+                        'cfg://handlers.file_logs'],
+            'queue_size': int(os.environ.get('XIA_LOG_QUEUE_SIZE', 10000)),
+        },
     },
 
     'formatters': {
@@ -179,3 +191,33 @@ CORS_ORIGIN_ALLOW_ALL = True
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# management command metrics exports, see the Instrumentation section of
+# the README
+XIA_METRICS_TEXTFILE = os.environ.get('XIA_METRICS_TEXTFILE')
+XIA_STATSD_ADDRESS = os.environ.get('XIA_STATSD_ADDRESS')
+# validation findings are logged as one line per field with this many
+# example records, and optionally written to a CSV table
+XIA_FINDINGS_SAMPLE_SIZE = int(os.environ.get('XIA_FINDINGS_SAMPLE_SIZE', 5))
+XIA_FINDINGS_TABLE = os.environ.get('XIA_FINDINGS_TABLE')
+# validation findings are also stored in the ValidationFinding table
+XIA_PERSIST_FINDINGS = os.environ.get('XIA_PERSIST_FINDINGS',
+                                      'true').lower() == 'true'
+# ledger writes of the pipeline stages are committed every this many records
+XIA_COMMIT_INTERVAL = int(os.environ.get('XIA_COMMIT_INTERVAL', 500))
+# ledger rows claimed by a worker are left to the others once their lease
+# expires
+XIA_LEASE_SECONDS = int(os.environ.get('XIA_LEASE_SECONDS', 3600))
+# records left Pending longer by an interrupted load are loaded again
+XIA_PENDING_SECONDS = int(os.environ.get('XIA_PENDING_SECONDS', 300))
+# seconds XIS is waited on to connect and to answer, at most a quarter of
+# XIA_PENDING_SECONDS
+XIA_XIS_TIMEOUT = int(os.environ.get('XIA_XIS_TIMEOUT', 60))
+# ledger gauges served by /metrics are recounted at most this often
+XIA_METRICS_CACHE_SECONDS = int(os.environ.get('XIA_METRICS_CACHE_SECONDS',
+                                               60))
+# /metrics is only served when enabled, and only to requests bearing the
+# token when one is set
+XIA_METRICS_ENABLED = os.environ.get('XIA_METRICS_ENABLED',
+                                     'true').lower() == 'true'
+XIA_METRICS_TOKEN = os.environ.get('XIA_METRICS_TOKEN')